@@ -0,0 +1,64 @@
+"""
+Times the crossover-based buy indicators of source.features against the previous pandas implementation, which diffed
+the conditions of the whole stacked dataset, on a synthetic dataset.
+
+Usage: python -m benchmarks.bench_buy_signals [n_firms] [n_days]
+"""
+
+import sys
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.bench_indicators import INDICATORS, time_call
+from source import features
+from source import synthetic
+
+
+def legacy_rsi_buy_indicator(rsi_col):
+    temp_col = (rsi_col.fillna(1000) >= 30).astype(int).diff()
+    new_col = np.where((temp_col == 1 & rsi_col.isnull()), 0, temp_col)
+    pd.Series(new_col).replace(to_replace=[np.NaN, -1], value=0, inplace=True)
+
+    return new_col
+
+
+def legacy_bb_buy_indicator(bb_lower_band_col, close_col):
+    temp_col = (close_col < bb_lower_band_col.fillna(-1)).astype(int).diff()
+    new_col = np.where((temp_col == 1 & close_col.isnull()), 0, temp_col)
+    pd.Series(new_col).replace(to_replace=[np.NaN, -1], value=0, inplace=True)
+
+    return new_col
+
+
+def legacy_macd_buy_indicator(macd_signal_col, macd_col):
+    new_col = (macd_col > macd_signal_col).astype(int).diff()
+    pd.Series(new_col).replace(to_replace=[np.NaN, -1], value=0, inplace=True)
+
+    return new_col
+
+
+def legacy_signals(df):
+    legacy_rsi_buy_indicator(df["RSI_27"])
+    legacy_bb_buy_indicator(df["BBL_20_2.0"], df["close"])
+    legacy_macd_buy_indicator(df["MACDs_12_26_9"], df["MACD_12_26_9"])
+
+
+def crossover_signals(df):
+    features.compute_buy_nobuy(df, features.rsi_buy_indicator, "RSI_27")
+    features.compute_buy_nobuy(df, features.bb_buy_indicator, "BBL_20_2.0", "close")
+    features.compute_buy_nobuy(df, features.macd_buy_indicator, "MACDs_12_26_9", "MACD_12_26_9")
+
+
+def main(n_firms=500, n_days=2000):
+    df = synthetic.make_ohlc(n_firms, n_days)
+    df = pd.concat([df, features.build_indicators(df, INDICATORS)], axis=1)
+    print(f"{n_firms} firms x {n_days} days = {len(df):,} rows")
+
+    legacy = min(time_call(legacy_signals, df) for _ in range(3))
+    crossover = min(time_call(crossover_signals, df) for _ in range(3))
+    print(f"buy signals: legacy {legacy:6.3f}s  crossover {crossover:6.3f}s  speedup {legacy / crossover:6.1f}x")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
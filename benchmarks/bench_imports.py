@@ -0,0 +1,59 @@
+"""
+Times a cold import of every module of the source package in a fresh interpreter, and lists the heavy backends
+(matplotlib, mplfinance, PIL, h2o, pandas_ta) each import pulled in. Those are loaded by the functions that use
+them, so a module over the budget or with a heavy backend is reported and the script exits with an error.
+
+Usage: python -m benchmarks.bench_imports [budget_seconds]
+"""
+
+import subprocess
+import sys
+
+
+MODULES = ["aws", "cache", "datasets", "features", "h2o_modelling", "market_data", "metrics", "plots", "raster",
+           "sampling", "store", "streaming", "synthetic"]
+HEAVY = ["matplotlib", "mplfinance", "PIL", "h2o", "pandas_ta"]
+# Importing pandas alone takes most of this
+BUDGET = 1.5
+
+SCRIPT = """
+import sys
+import time
+
+start = time.perf_counter()
+import source.{module}
+seconds = time.perf_counter() - start
+
+print(seconds, *[m for m in {heavy} if m in sys.modules])
+"""
+
+
+def import_module(module):
+    """Imports source.module in a fresh interpreter.
+
+    Returns:
+        tuple: The seconds the import took and the list of heavy backends it imported.
+    """
+    output = subprocess.run([sys.executable, "-c", SCRIPT.format(module=module, heavy=HEAVY)],
+                            capture_output=True, text=True, check=True).stdout.split()
+
+    return float(output[0]), output[1:]
+
+
+def main(budget=BUDGET):
+    slow = []
+
+    for module in MODULES:
+        seconds, heavy = import_module(module)
+        print(f"{module:>14}: {seconds:6.3f}s  {' '.join(heavy)}")
+
+        if seconds > budget or heavy:
+            slow.append(module)
+
+    print(f"over the {budget}s budget or heavy: {', '.join(slow)}" if slow else "all imports within budget")
+
+    return slow
+
+
+if __name__ == "__main__":
+    raise SystemExit(1 if main(*[float(arg) for arg in sys.argv[1:]]) else 0)
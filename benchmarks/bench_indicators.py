@@ -0,0 +1,50 @@
+"""
+Times the pandas_ta and grouped engines of features.build_indicator, and the single-pass features.build_indicators,
+on a synthetic dataset.
+
+Usage: python -m benchmarks.bench_indicators [n_firms] [n_days]
+"""
+
+import sys
+import time
+
+from source import features
+from source import synthetic
+
+
+INDICATORS = [("rsi", 27), ("bbands", 20), ("macd", 26)]
+
+
+def notebook_indicators(df, engine):
+    """The indicator calls of the 00_upload_plots notebook, which computes the macd twice."""
+    features.build_indicator(df, "rsi", 27, engine=engine)
+    features.build_indicator(df, "bbands", 20, engine=engine)["BBL_20_2.0"]
+    features.build_indicator(df, "macd", 26, engine=engine)["MACDs_12_26_9"]
+    features.build_indicator(df, "macd", 26, engine=engine)["MACD_12_26_9"]
+
+
+def time_call(fn, *args, **kwargs):
+    """Returns the wall time in seconds of a single call."""
+    start = time.perf_counter()
+    fn(*args, **kwargs)
+
+    return time.perf_counter() - start
+
+
+def main(n_firms=500, n_days=2000):
+    df = synthetic.make_ohlc(n_firms, n_days)
+    print(f"{n_firms} firms x {n_days} days = {len(df):,} rows")
+
+    for indicator, window_size in INDICATORS:
+        grouped = time_call(features.build_indicator, df, indicator, window_size, engine="grouped")
+        pandas_ta = time_call(features.build_indicator, df, indicator, window_size, engine="pandas_ta")
+        print(f"{indicator:>7}: pandas_ta {pandas_ta:8.2f}s  grouped {grouped:6.2f}s  speedup {pandas_ta / grouped:6.1f}x")
+
+    separate = time_call(notebook_indicators, df, "grouped")
+    single_pass = time_call(features.build_indicators, df, INDICATORS)
+    print(f"notebook: 4 grouped calls {separate:6.2f}s  build_indicators {single_pass:6.2f}s  "
+          f"speedup {separate / single_pass:6.1f}x")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
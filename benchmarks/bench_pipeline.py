@@ -0,0 +1,212 @@
+"""
+Times every stage of the pipeline, from the indicators to the h2o frame, on synthetic datasets of several sizes and
+records the wall time, throughput and peak memory of each stage. The results can be saved as json and compared with
+a saved baseline, so that a stage that got slower or bigger is reported as a regression.
+
+Usage: python -m benchmarks.bench_pipeline [--scales 10x500 100x2000 505x2000] [--n-plots 20] [--save results.json]
+    [--baseline results.json] [--tolerance 0.25] [--no-memory]
+"""
+
+import argparse
+import json
+from pathlib import Path
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.bench_indicators import INDICATORS
+from source import features
+from source import plots
+from source import synthetic
+
+
+SCALES = ["10x500", "100x2000", "505x2000"]
+# The smallest increase that compare reports, so that the noise of stages that take a few milliseconds is ignored
+MIN_CHANGE = {"seconds": 0.05, "peak_mb": 1.0}
+BUY_SIGNALS = [
+    ("rsi_buy", features.rsi_buy_indicator, ["RSI_27"]),
+    ("bb_buy", features.bb_buy_indicator, ["BBL_20_2.0", "close"]),
+    ("macd_buy", features.macd_buy_indicator, ["MACDs_12_26_9", "MACD_12_26_9"]),
+]
+
+
+def measure(fn, *args, memory=True, **kwargs):
+    """Times a call of fn, then calls it again while tracing memory allocations. Tracing slows down python code
+    several times over, so the two are not measured in the same call.
+
+    Args:
+        memory (bool, optional): Should the peak memory be traced? Defaults to True.
+
+    Returns:
+        tuple: The result of the timed call, its wall time in seconds and the peak traced memory in bytes (0 when
+        memory is False).
+    """
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    seconds = time.perf_counter() - start
+
+    peak = 0
+    if memory:
+        tracemalloc.start()
+        try:
+            fn(*args, **kwargs)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    return result, seconds, peak
+
+
+def add_indicators(df):
+    return pd.concat([df, features.build_indicators(df, INDICATORS)], axis=1)
+
+
+def add_buy_signals(df):
+    for name, fn, columns in BUY_SIGNALS:
+        df[name] = features.compute_buy_nobuy(df, fn, *columns)
+
+    return df
+
+
+def h2o_frame(*files):
+    """Converts parquet files to an h2o frame, starting a local cluster first. h2o is imported here, so the other
+    stages run without it."""
+    import h2o
+    from source import h2o_modelling
+
+    h2o.init()
+    return h2o_modelling.parquet_to_h2o(*files)
+
+
+def run_scale(n_firms, n_days, n_plots, work_dir, memory=True):
+    """Runs every stage on one synthetic dataset.
+
+    Args:
+        n_firms (int): The number of firms.
+        n_days (int): The number of days per firm.
+        n_plots (int): The number of windows to plot for each plot type. Plotting costs the same per window at any
+            scale, so it is not scaled with the dataset.
+        work_dir (str): A directory for the plots and parquet files.
+        memory (bool, optional): Should the peak memory of each stage be traced? Defaults to True.
+
+    Returns:
+        list of dict: One record per stage with its "stage", "seconds", "items", "per_second" and "peak_mb".
+    """
+    records = []
+
+    def stage(name, items, fn, *args, **kwargs):
+        result, seconds, peak = measure(fn, *args, memory=memory, **kwargs)
+        records.append({
+            "scale": f"{n_firms}x{n_days}",
+            "stage": name,
+            "seconds": seconds,
+            "items": items,
+            "per_second": items / seconds if seconds else float("inf"),
+            "peak_mb": peak / 1024 ** 2,
+        })
+        return result
+
+    df = stage("make_ohlc", n_firms * n_days, synthetic.make_ohlc, n_firms, n_days)
+    df = stage("build_indicators", len(df), add_indicators, df)
+    df = stage("buy_signals", len(df), add_buy_signals, df)
+    df = stage("check_signals", len(df), plots.check_signals, df, "firm", "macd_buy", 1, 20)
+    df = stage("sample_groups", len(df), plots.sample_groups, df, "firm", "macd_buy", 1, 20, "sampled", 748574)
+
+    # Plot the first n_plots buy signals, whatever the scale
+    to_plot = np.flatnonzero(df["macd_buy"].to_numpy() == 1)[:n_plots]
+    df["to_plot"] = False
+    df.iloc[to_plot, df.columns.get_loc("to_plot")] = True
+
+    # Line and candle plots differ in size, so each plot type gets its own dataset, as in the notebooks
+    for plot_type in ["line", "candle"]:
+        plot_dir = Path(work_dir) / plot_type
+        plot_dir.mkdir()
+        stage(f"plot_sampled_{plot_type}", len(to_plot), plots.plot_sampled, df, "to_plot", "macd", "buy", 26,
+              plot_dir.as_posix(), "close", plot_type)
+
+        files = sorted(plots.list_files(plot_dir.as_posix()))
+        h2o_df = stage(f"build_h2o_dataset_{plot_type}", len(files), plots.build_h2o_dataset, files,
+                       [1] * len(files), files)
+
+        parquet_file = f"{work_dir}/{plot_type}.parquet"
+        stage(f"to_parquet_{plot_type}", len(files), h2o_df.to_parquet, parquet_file)
+
+        try:
+            stage(f"parquet_to_h2o_{plot_type}", len(files), h2o_frame, parquet_file)
+        except Exception as e:
+            print(f'Unexpected error: {e}')
+            print(f'parquet_to_h2o_{plot_type} not timed.')
+
+    return records
+
+
+def compare(records, baseline, tolerance, min_change=MIN_CHANGE):
+    """Finds the stages that are slower or use more memory than in the baseline by more than the tolerance.
+
+    Args:
+        records (list of dict): The records of this run, see run_scale.
+        baseline (list of dict): The records of an earlier run.
+        tolerance (float): The allowed relative increase, e.g. 0.25 for 25%.
+        min_change (dict, optional): The smallest increase of the seconds and peak_mb that can be a regression.
+            Defaults to MIN_CHANGE.
+
+    Returns:
+        list of str: One message per regression.
+    """
+    previous = {(r["scale"], r["stage"]): r for r in baseline}
+    regressions = []
+
+    for record in records:
+        old = previous.get((record["scale"], record["stage"]))
+        if old is None:
+            continue
+
+        for key in ["seconds", "peak_mb"]:
+            increase = record[key] - old[key]
+            if old[key] > 0 and increase > old[key] * tolerance and increase > min_change[key]:
+                regressions.append(f"{record['scale']} {record['stage']}: {key} {old[key]:.3f} -> {record[key]:.3f}")
+
+    return regressions
+
+
+def main(scales=SCALES, n_plots=20, save=None, baseline=None, tolerance=0.25, memory=True):
+    records = []
+
+    for scale in scales:
+        n_firms, n_days = [int(x) for x in scale.split("x")]
+        with tempfile.TemporaryDirectory() as work_dir:
+            records.extend(run_scale(n_firms, n_days, n_plots, work_dir, memory))
+
+    print(f"{'scale':>10} {'stage':>24} {'seconds':>9} {'items/s':>12} {'peak MB':>9}")
+    for r in records:
+        print(f"{r['scale']:>10} {r['stage']:>24} {r['seconds']:9.3f} {r['per_second']:12,.0f} {r['peak_mb']:9.1f}")
+
+    if save is not None:
+        with open(save, "w") as f:
+            json.dump(records, f, indent=1)
+
+    if baseline is not None:
+        with open(baseline) as f:
+            regressions = compare(records, json.load(f), tolerance)
+
+        print("\n".join(["regressions:"] + regressions) if regressions else "no regressions")
+        return regressions
+
+    return []
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scales", nargs="+", default=SCALES, help="firms x days, e.g. 100x2000")
+    parser.add_argument("--n-plots", type=int, default=20, help="windows plotted per plot type")
+    parser.add_argument("--save", help="write the results to this json file")
+    parser.add_argument("--baseline", help="compare the results with this json file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative increase")
+    parser.add_argument("--no-memory", action="store_true", help="skip the traced run of each stage")
+    args = parser.parse_args()
+
+    regressions = main(args.scales, args.n_plots, args.save, args.baseline, args.tolerance, not args.no_memory)
+    raise SystemExit(1 if regressions else 0)
@@ -0,0 +1,51 @@
+"""
+Renders candle plots of a synthetic dataset, builds a pixel index with pruning.build_index, and times
+h2o_modelling.train_and_save on every pixel and on the informative pixels only. AutoML is limited by the number of
+models rather than by time, so the two runs train the same models. Needs a local h2o cluster.
+
+Usage: python -m benchmarks.bench_pruning [n_firms] [n_days] [threshold]
+"""
+
+import sys
+import tempfile
+
+import h2o
+import numpy as np
+
+from benchmarks.bench_indicators import time_call
+from source import h2o_modelling
+from source import plots
+from source import pruning
+from source import scoring
+from source import synthetic
+
+
+def main(n_firms=20, n_days=500, threshold=25.0):
+    h2o.init()
+
+    df = synthetic.make_ohlc(n_firms, n_days)
+    df["sampled"] = np.random.default_rng(0).random(len(df)) < 0.05
+    windows = [df.iloc[p] for p in plots.window_positions(df, "sampled", 26)]
+    imgs = scoring.Scorer(None, "close", "candle", window_size=26).pixels(windows)
+    labels = np.random.default_rng(1).integers(0, 2, len(imgs))
+    names = [f"window_{i}" for i in range(len(imgs))]
+
+    index = pruning.build_index(lambda: pruning.iter_arrays(imgs), threshold)
+    print(f"{len(imgs):,} plots: {pruning.describe(index)}")
+
+    h2o_df = h2o.H2OFrame(plots.pixels_to_dataset(imgs, labels, names))
+    train, y, x = h2o_modelling.prepare_h2o_df(h2o_df, "label")
+    _, _, pruned_x = h2o_modelling.prepare_h2o_df(train, "label", to_factor=False,
+                                                  predictors=pruning.column_names(index))
+
+    with tempfile.TemporaryDirectory() as save_path:
+        every = time_call(h2o_modelling.train_and_save, train, y, x, save_path, max_models=5, max_runtime_min=60)
+        pruned = time_call(h2o_modelling.train_and_save, train, y, pruned_x, save_path, max_models=5,
+                           max_runtime_min=60)
+
+    print(f"train_and_save: {len(x)} pixels {every:7.1f}s  {len(pruned_x)} pixels {pruned:7.1f}s  "
+          f"saved {1 - pruned / every:5.1%}")
+
+
+if __name__ == "__main__":
+    main(*[float(arg) if i == 2 else int(arg) for i, arg in enumerate(sys.argv[1:])])
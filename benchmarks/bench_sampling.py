@@ -0,0 +1,42 @@
+"""
+Times plots.sample_mask against the sampling steps of the 00_upload_plots notebook (check_signals, a groupby sample
+and a membership test over the whole index) on a synthetic dataset.
+
+Usage: python -m benchmarks.bench_sampling [n_firms] [n_days]
+"""
+
+import sys
+
+import numpy as np
+
+from benchmarks.bench_indicators import time_call
+from source import plots
+from source import synthetic
+
+
+def notebook_sample(df, n):
+    """The notebook's sampling of 20 macd buy signals per firm, with the old lambda filter of check_signals."""
+    sampled_indices = (
+        df[df["macd_buy"] == 1.0]
+        .groupby("firm")
+        .filter(lambda x: x[x["macd_buy"] == 1.0].shape[0] >= n)
+        .groupby("firm")
+        .sample(n, random_state=748574)
+        .index
+    )
+
+    return [True if x in sampled_indices else False for x in df.index]
+
+
+def main(n_firms=500, n_days=2000):
+    df = synthetic.make_ohlc(n_firms, n_days)
+    df["macd_buy"] = (np.random.default_rng(0).random(len(df)) < 0.03).astype(float)
+    print(f"{n_firms} firms x {n_days} days = {len(df):,} rows")
+
+    vectorized = time_call(plots.sample_mask, df, "firm", "macd_buy", 1.0, 20, 748574)
+    notebook = time_call(notebook_sample, df, 20)
+    print(f"sampling: notebook {notebook:8.2f}s  sample_mask {vectorized:6.3f}s  speedup {notebook / vectorized:8.1f}x")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
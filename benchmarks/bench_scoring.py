@@ -0,0 +1,48 @@
+"""
+Trains a small h2o model on rendered windows of a synthetic dataset, saves it, and measures how fast a Scorer
+with the reloaded model scores new windows: the throughput of micro-batches in windows per second and the latency
+of a single-window request. Needs a local h2o cluster.
+
+Usage: python -m benchmarks.bench_scoring [n_firms] [n_days]
+"""
+
+import sys
+import tempfile
+
+import h2o
+from h2o.estimators import H2OGradientBoostingEstimator
+import numpy as np
+
+from source import plots
+from source import scoring
+from source import synthetic
+
+
+def main(n_firms=20, n_days=500):
+    h2o.init()
+
+    df = synthetic.make_ohlc(n_firms, n_days)
+    df["sampled"] = np.random.default_rng(0).random(len(df)) < 0.05
+    positions = plots.window_positions(df, "sampled", 26)
+    windows = [df.iloc[p] for p in positions]
+    print(f"{n_firms} firms x {n_days} days = {len(windows):,} windows")
+
+    scorer = scoring.Scorer(None, "close", "line", window_size=26)
+    imgs = scorer.pixels(windows)
+    train = h2o.H2OFrame(plots.pixels_to_dataset(imgs, np.random.default_rng(1).integers(0, 2, len(imgs))))
+    train["label"] = train["label"].asfactor()
+    model = H2OGradientBoostingEstimator(ntrees=20, seed=1)
+    model.train(x=[c for c in train.columns if c != "label"], y="label", training_frame=train)
+
+    with tempfile.TemporaryDirectory() as model_dir:
+        scorer.model = scoring.load_model(h2o.save_model(model, path=model_dir))
+
+        for batch_size in [1, 32, 256]:
+            scorer.batch_size = batch_size
+            stats = scoring.benchmark(scorer, windows)
+            print(f"batch_size {batch_size:>4}: {stats['windows_per_second']:8.1f} windows/s  "
+                  f"single window {stats['latency_ms']:7.1f}ms")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
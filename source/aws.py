@@ -1,15 +1,26 @@
 """ 
 This script allows the user to connect to AWS, create an Amazon s3 bucket, and send files to the bucket.
 
-There is also a function to remove a file locally.
+There is also a function to remove a file locally, and a bulk uploader that shares one pooled client between
+threads and retries failed uploads. Small files can be packed into size-bounded tar shards with a json index,
+so a directory of plots takes a few requests instead of one per plot, and a single plot can still be read back
+with a range request.
 """
 
-import pathlib as Path
+from concurrent.futures import ThreadPoolExecutor
+import json
+from pathlib import Path
+import tarfile
+import tempfile
+import time
+import uuid
 
 import boto3
-from botocore.exceptions import ClientError
+from boto3.s3.transfer import S3UploadFailedError, TransferConfig
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
 
-from source import plots
+from source import metrics
 
 
 def get_s3_resource(region='us-east-2'):
@@ -26,6 +37,27 @@ def get_s3_resource(region='us-east-2'):
     return s3_resource
 
 
+def get_s3_client(region='us-east-2', max_pool_connections=32):
+    """Returns a boto3 s3 client with a specific region, which can be shared between threads.
+
+    Args:
+        region (str, optional): Region for s3 client. Defaults to 'us-east-2'.
+        max_pool_connections (int, optional): Maximum number of open connections. Should be at least the number
+            of upload threads times TransferConfig.max_concurrency. Defaults to 32.
+
+    Returns:
+        An s3 client object.
+    """
+    config = Config(max_pool_connections=max_pool_connections, retries={'max_attempts': 5, 'mode': 'adaptive'})
+    s3_client = boto3.client(service_name='s3', region_name=region, config=config)
+
+    return s3_client
+
+
+TRANSFER_CONFIG = TransferConfig(multipart_threshold=8 * 1024 ** 2, multipart_chunksize=8 * 1024 ** 2,
+                                 max_concurrency=4)
+
+
 def create_bucket(bucket_name, region='us-east-2'):
     """Create an S3 bucket with the specified name and in the specified region.
 
@@ -70,25 +102,237 @@ def del_file(file):
         file (str): Relative filepath of file to be removed.
     """
     if Path(file).is_file():
-        Path.unlink(file)
+        Path(file).unlink()
+
+
+def upload_file(bucket_name, file, key, s3_client, transfer_config=TRANSFER_CONFIG, max_retries=3, backoff=0.5):
+    """Uploads a file, retrying with exponential backoff, and confirms that the object in the bucket has the
+    size of the local file.
+
+    Args:
+        bucket_name (str): Name of bucket to send file.
+        file (str): Filepath of file to be sent.
+        key (str): Key of the object in the bucket.
+        s3_client: An s3 client object, see get_s3_client.
+        transfer_config (TransferConfig, optional): Multipart settings. Defaults to TRANSFER_CONFIG.
+        max_retries (int, optional): Number of retries after a failed upload. Defaults to 3.
+        backoff (float, optional): Seconds to wait before the first retry, doubled for every further retry.
+            Defaults to 0.5.
+
+    Returns:
+        bool: Whether the upload was confirmed.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            s3_client.upload_file(Filename=file, Bucket=bucket_name, Key=key, Config=transfer_config)
+            response = s3_client.head_object(Bucket=bucket_name, Key=key)
+
+            if response['ContentLength'] == Path(file).stat().st_size:
+                return True
+
+        except (BotoCoreError, ClientError, S3UploadFailedError) as e:
+            if attempt == max_retries:
+                print(f'Unexpected error: {e}')
+
+        if attempt < max_retries:
+            time.sleep(backoff * 2 ** attempt)
+
+    return False
+
+
+def upload_files(bucket_name, files, keys=None, s3_client=None, region='us-east-2', n_threads=8,
+                 transfer_config=TRANSFER_CONFIG, max_retries=3, delete=False):
+    """Uploads many files concurrently with one shared s3 client.
+
+    Args:
+        bucket_name (str): Name of bucket to send files.
+        files (list of str): Filepaths of files to be sent.
+        keys (list of str, optional): Key of each object in the bucket. Defaults to None, which uses the filepaths.
+        s3_client (optional): An s3 client object. Defaults to None, which creates one with get_s3_client.
+        region (str, optional): Region for s3 client. Defaults to 'us-east-2'.
+        n_threads (int, optional): Number of files uploaded at once. Defaults to 8.
+        transfer_config (TransferConfig, optional): Multipart settings. Defaults to TRANSFER_CONFIG.
+        max_retries (int, optional): Number of retries after a failed upload. Defaults to 3.
+        delete (bool, optional): Should each file be removed once its upload is confirmed? Defaults to False.
+
+    Returns:
+        list: The files that could not be uploaded. They are never deleted.
+    """
+    if keys is None:
+        keys = files
+    if s3_client is None:
+        s3_client = get_s3_client(region, max_pool_connections=n_threads * transfer_config.max_concurrency)
+
+    def upload(file, key):
+        uploaded = upload_file(bucket_name, file, key, s3_client, transfer_config, max_retries)
+        if uploaded and delete:
+            del_file(file)
+
+        return uploaded
+
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        uploaded = list(executor.map(upload, files, keys))
+
+    return [file for file, ok in zip(files, uploaded) if not ok]
+
+
+def pack_files(files, pack_dir, max_bytes=64 * 1024 ** 2, prefix='pack'):
+    """Packs files into uncompressed tar shards of about max_bytes each (a larger file gets a shard of its own),
+    and writes an index.json that maps each member to its shard and the byte range of its data.
+
+    Args:
+        files (list of str): Filepaths of files to be packed. Members are named by filename.
+        pack_dir (str): Directory to write the shards and the index to.
+        max_bytes (int, optional): Maximum size of a shard. Defaults to 64 MiB.
+        prefix (str, optional): Prefix of the shard names, e.g. pack_00000.tar. Defaults to 'pack'.
+
+    Returns:
+        list: The filepaths of the shards followed by the index.
+    """
+    Path(pack_dir).mkdir(parents=True, exist_ok=True)
+    shards = []
+    index = {}
+    tar = None
+
+    for file in files:
+        size = Path(file).stat().st_size
+        if tar is None or (tar.offset > 0 and tar.offset + tarfile.BLOCKSIZE + size > max_bytes):
+            if tar is not None:
+                tar.close()
+            shards.append((Path(pack_dir) / f'{prefix}_{len(shards):05d}.tar').as_posix())
+            tar = tarfile.open(shards[-1], 'w', format=tarfile.USTAR_FORMAT)
+
+        member = tar.gettarinfo(file, arcname=Path(file).name)
+        offset = tar.offset + tarfile.BLOCKSIZE
+        with open(file, 'rb') as f:
+            tar.addfile(member, f)
+        index[member.name] = {'shard': Path(shards[-1]).name, 'offset': offset, 'size': size}
+
+    if tar is not None:
+        tar.close()
+
+    index_path = (Path(pack_dir) / 'index.json').as_posix()
+    with open(index_path, 'w') as f:
+        json.dump(index, f)
+
+    return shards + [index_path]
+
+
+def run_prefix(dir_name):
+    """Returns a key prefix unique to one upload, e.g. 'plots/20240105-143000-1a2b3c4d/' for the directory 'plots',
+    so the shards and index of a run never overwrite those of an earlier run."""
+    return f"{Path(dir_name).absolute().name}/{time.strftime('%Y%m%d-%H%M%S', time.gmtime())}-{uuid.uuid4().hex[:8]}/"
+
+
+def read_index(bucket_name, s3_client, prefix='', key='index.json'):
+    """Downloads the index of a set of packed shards, see pack_files.
+
+    Args:
+        bucket_name (str): Name of bucket of the shards.
+        s3_client: An s3 client object, see get_s3_client.
+        prefix (str, optional): Key prefix of the shards in the bucket, as returned by send_dir. Defaults to ''.
+        key (str, optional): Name of the index. Defaults to 'index.json'.
+
+    Returns:
+        dict: The index.
+    """
+    return json.loads(s3_client.get_object(Bucket=bucket_name, Key=f'{prefix}{key}')['Body'].read())
 
 
-def send_dir(bucket_name, dir_name, name='df.gzip'):
-    """Uploads all files in a specified directory to a specified AWS bucket.
+def read_packed(bucket_name, name, index, s3_client, prefix=''):
+    """Reads one packed file from its shard with a range request.
+
+    Args:
+        bucket_name (str): Name of bucket of the shards.
+        name (str): Filename of the packed file.
+        index (dict): The index of the shards, see read_index.
+        s3_client: An s3 client object, see get_s3_client.
+        prefix (str, optional): Key prefix of the shards in the bucket, as returned by send_dir. Defaults to ''.
+
+    Returns:
+        bytes: The content of the file.
+    """
+    entry = index[name]
+    byte_range = f"bytes={entry['offset']}-{entry['offset'] + entry['size'] - 1}"
+    response = s3_client.get_object(Bucket=bucket_name, Key=f"{prefix}{entry['shard']}", Range=byte_range)
+
+    return response['Body'].read()
+
+
+@metrics.timed("send_dir")
+def send_dir(bucket_name, dir_name, name='df.gzip', s3_client=None, region='us-east-2', n_threads=8, pack=False,
+             max_pack_bytes=64 * 1024 ** 2, prefix=None):
+    """Uploads all files in a specified directory to a specified AWS bucket, followed by their h2o dataset.
+
+    Files are removed locally once their upload is confirmed. Each file is stored under its filename, or when pack
+    is True, in tar shards named pack_00000.tar, ... next to an index.json (see pack_files and read_packed), all
+    under a key prefix of their own so that runs to the same bucket do not overwrite each other.
 
     Args:
         bucket_name (str): Name of AWS bucket to send.
         dir_name (str): Name of directory.
         name (str, optional): Name of h2o file. Defaults to 'df.gzip'.
+        s3_client (optional): An s3 client object. Defaults to None, which creates one with get_s3_client.
+        region (str, optional): Region for s3 client. Defaults to 'us-east-2'.
+        n_threads (int, optional): Number of files uploaded at once. Defaults to 8.
+        pack (bool, optional): Should the files be packed into tar shards before upload? Defaults to False.
+        max_pack_bytes (int, optional): Maximum size of a shard. Defaults to 64 MiB.
+        prefix (str, optional): Key prefix of the shards and the index when pack is True. Defaults to None, a new
+            prefix from run_prefix.
+
+    Returns:
+        tuple: The files that could not be uploaded, and the key prefix to pass to read_index and read_packed
+        (None when pack is False). When pack is True, the failed files are those of the shards that could not be
+        uploaded, or every file if the index could not be; no file is deleted unless every shard was uploaded.
     """
+    from source import plots
+
     p = Path(dir_name)
-    list_of_files = [f.name for f in p.iterdir() if (f.is_file()) & ~(f.name.startswith('.'))]
+    list_of_files = [f.as_posix() for f in p.iterdir() if f.is_file() and not f.name.startswith('.')]
     h2o_df = plots.build_h2o_dataset(list_of_files, [i for i in range(len(list_of_files))])
 
-    for filename in list_of_files:
-        to_bucket(bucket_name, filename)
-        del_file(filename)
-    
-    h2o_df.to_parquet(f'{dir_name}{name}')
-    to_bucket(bucket_name, f'{dir_name}{name}')
-    del_file(f'{dir_name}{name}')
+    if s3_client is None:
+        s3_client = get_s3_client(region, max_pool_connections=n_threads * TRANSFER_CONFIG.max_concurrency)
+
+    h2o_path = (p / name).as_posix()
+    h2o_df.to_parquet(h2o_path)
+    list_of_files.append(h2o_path)
+
+    if not pack:
+        sizes = {f: Path(f).stat().st_size for f in list_of_files}
+        failed = upload_files(bucket_name, list_of_files, [Path(f).name for f in list_of_files], s3_client,
+                              n_threads=n_threads, delete=True)
+        metrics.count(items=len(list_of_files) - len(failed),
+                      bytes_written=sum(size for f, size in sizes.items() if f not in failed))
+        return failed, None
+
+    if prefix is None:
+        prefix = run_prefix(dir_name)
+
+    with tempfile.TemporaryDirectory() as pack_dir:
+        packs = pack_files(list_of_files, pack_dir, max_pack_bytes)
+        failed_packs = upload_files(bucket_name, packs, [f'{prefix}{Path(f).name}' for f in packs], s3_client,
+                                    n_threads=n_threads)
+        failed = packed_members(list_of_files, packs[-1], failed_packs)
+        metrics.count(items=len(list_of_files) - len(failed), written=[f for f in packs if f not in failed_packs])
+
+    if failed_packs:
+        return failed, prefix
+
+    [del_file(f) for f in list_of_files]
+
+    return [], prefix
+
+
+def packed_members(files, index_path, failed_packs):
+    """Returns the files packed into any of the failed shards, or every file if the index itself failed."""
+    failed_names = {Path(f).name for f in failed_packs}
+    if not failed_names:
+        return []
+    if Path(index_path).name in failed_names:
+        return list(files)
+
+    with open(index_path) as f:
+        index = json.load(f)
+
+    return [file for file in files if index[Path(file).name]['shard'] in failed_names]
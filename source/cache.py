@@ -0,0 +1,181 @@
+"""
+This script allows the user to cache rendered plots on disk.
+
+Each plot is stored under a hash of the values and dates of its window and the rendering parameters, so the same
+window is only drawn once no matter which sample or experiment it comes from. A plot is kept as it was drawn: the
+grayscale pixels of the raster module, or the JPEG bytes written by matplotlib, so an image saved from the cache is
+the same file as one saved after drawing it. The cache is bounded in size and evicts the least recently used plots
+first.
+"""
+
+from collections import OrderedDict
+import hashlib
+import os
+from pathlib import Path
+
+import numpy as np
+
+
+# Part of every key, so that changing how plots are drawn invalidates the plots cached before the change.
+STYLE_VERSION = "1"
+
+# The file suffixes of cached pixel arrays and cached JPEG bytes.
+SUFFIXES = (".npy", ".jpg")
+
+
+class RenderCache:
+    """An on-disk cache of rendered plots, either 2-D uint8 pixel arrays or encoded JPEG bytes, with least recently
+    used eviction.
+
+    A RenderCache sent to a worker process only carries its directory and size limit. The worker records the
+    lookups and writes it makes (see usage), and the parent process merges them, so statistics and the size limit
+    cover every process.
+
+    Args:
+        cache_dir (str): The directory of the cache. Plots cached by earlier runs are reused.
+        max_bytes (int, optional): The maximum size of the cached files. Defaults to 1 GiB.
+    """
+
+    def __init__(self, cache_dir, max_bytes=1024 ** 3):
+        self.setup(cache_dir, max_bytes, worker=False)
+
+        files = sorted((f for suffix in SUFFIXES for f in self.cache_dir.glob(f"*/*{suffix}")),
+                       key=lambda f: f.stat().st_mtime)
+        self.entries = OrderedDict((f.stem, f.stat().st_size) for f in files)
+        self.total_bytes = sum(self.entries.values())
+
+    def setup(self, cache_dir, max_bytes, worker):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.worker = worker
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.touched = []
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+
+    def __getstate__(self):
+        return {"cache_dir": self.cache_dir, "max_bytes": self.max_bytes}
+
+    def __setstate__(self, state):
+        self.setup(state["cache_dir"], state["max_bytes"], worker=True)
+
+    @staticmethod
+    def key(values, times, plot_type, engine, **params):
+        """Returns the key of a plot.
+
+        Args:
+            values (np.ndarray): The plotted values of the window, e.g. its close prices or its open, high, low and
+                close prices, with one row per day.
+            times (np.ndarray): The datetime64 time of each day.
+            plot_type (str): The type of plot: "line" or "candle".
+            engine (str): The library used to draw the plot: "matplotlib" or "numpy".
+            **params: Any other rendering parameters.
+
+        Returns:
+            str: A hexadecimal hash.
+        """
+        h = hashlib.blake2b(digest_size=16)
+        h.update(np.ascontiguousarray(values, dtype=np.float64).tobytes())
+        h.update(np.asarray(times, dtype="datetime64[ns]").view(np.int64).tobytes())
+        h.update(repr((STYLE_VERSION, plot_type, engine, sorted(params.items()))).encode())
+
+        return h.hexdigest()
+
+    def path(self, key, suffix=".npy"):
+        return self.cache_dir / key[:2] / f"{key}{suffix}"
+
+    def track(self, key, size):
+        """Marks a key as the most recently used one."""
+        if self.worker:
+            self.touched.append((key, size))
+            return
+
+        self.total_bytes += size - self.entries.pop(key, 0)
+        self.entries[key] = size
+
+    def get(self, key):
+        """Returns the cached plot of a key (a pixel array or JPEG bytes), or None if it is not in the cache."""
+        for suffix in SUFFIXES:
+            path = self.path(key, suffix)
+
+            try:
+                plot = np.load(path) if suffix == ".npy" else path.read_bytes()
+                os.utime(path)
+            except (FileNotFoundError, ValueError):
+                continue
+
+            self.track(key, path.stat().st_size)
+            self.hits += 1
+            return plot
+
+        self.total_bytes -= self.entries.pop(key, 0)
+        self.misses += 1
+
+        return None
+
+    def put(self, key, plot):
+        """Caches the plot of a key and evicts the least recently used plots while the cache is too big.
+
+        Args:
+            key (str): The key of the plot.
+            plot (np.ndarray or bytes): A 2-D uint8 pixel array, or the bytes of a JPEG file.
+        """
+        suffix = ".jpg" if isinstance(plot, bytes) else ".npy"
+        path = self.path(key, suffix)
+        path.parent.mkdir(exist_ok=True)
+
+        tmp_path = path.with_name(f"{key}.{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            if suffix == ".jpg":
+                f.write(plot)
+            else:
+                np.save(f, np.asarray(plot, dtype=np.uint8))
+        os.replace(tmp_path, path)
+
+        self.track(key, path.stat().st_size)
+        self.evict()
+
+    def evict(self):
+        """Removes the least recently used plots while the cache is too big. Worker processes leave this to the
+        parent process, which sees every process's writes."""
+        if self.worker:
+            return
+
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            old_key, size = self.entries.popitem(last=False)
+            for suffix in SUFFIXES:
+                self.path(old_key, suffix).unlink(missing_ok=True)
+            self.total_bytes -= size
+            self.evictions += 1
+
+    def usage(self):
+        """Returns the lookups and writes of a worker process, to be merged by the parent process."""
+        return {"hits": self.hits, "misses": self.misses, "touched": self.touched}
+
+    def merge(self, usage):
+        """Adds the usage of a worker process to this cache's statistics and entries, then evicts the least
+        recently used plots while the cache is too big. Plots this process evicted since the worker used them
+        are not added back."""
+        self.hits += usage["hits"]
+        self.misses += usage["misses"]
+        for key, size in usage["touched"]:
+            if any(self.path(key, suffix).exists() for suffix in SUFFIXES):
+                self.track(key, size)
+
+        self.evict()
+
+    def stats(self):
+        """Returns the number of hits, misses and evictions of this process, and the size of the cache."""
+        lookups = self.hits + self.misses
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self.entries),
+            "bytes": self.total_bytes,
+        }
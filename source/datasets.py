@@ -0,0 +1,148 @@
+"""
+This script allows the user to write the h2o dataset of a directory of plots as a series of parquet shards.
+
+Images are read and written chunk_size at a time, so memory is bounded by the chunk size instead of the number of
+plots. A manifest.json next to the shards records the row range of each shard and the firms, indicators, signals
+and plot types it contains, and an interrupted run resumes after the last shard in the manifest.
+"""
+
+import json
+import os
+from pathlib import Path
+import re
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from source import plots
+
+
+MANIFEST = "manifest.json"
+
+
+def read_manifest(save_dir):
+    """Reads the manifest of a shard directory.
+
+    Args:
+        save_dir (str): The directory of the shards.
+
+    Returns:
+        list of dict: One entry per completed shard, in the order they were written. Empty if there is no manifest.
+    """
+    path = Path(save_dir) / MANIFEST
+
+    if not path.is_file():
+        return []
+
+    with open(path) as f:
+        return json.load(f)["shards"]
+
+
+def write_json(obj, path):
+    """Writes obj to a temporary file first, so a crash never leaves a half-written file at path."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(obj, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def describe_names(names):
+    """Collects the firms, indicators, signals and plot types of image names like plot_sampled's
+    "{firm}_{indicator}_{signal}_{date}_{plot_type}.jpg". Names that do not follow the pattern are ignored."""
+    parts = [Path(name).stem.rsplit("_", 4) for name in names]
+    parts = [p for p in parts if len(p) == 5]
+
+    return {
+        "firms": sorted({p[0] for p in parts}),
+        "indicators": sorted({p[1] for p in parts}),
+        "signals": sorted({p[2] for p in parts}),
+        "plot_types": sorted({p[4] for p in parts}),
+    }
+
+
+def write_shard(h2o_df, save_dir, manifest):
+    """Writes h2o_df as the next shard of save_dir and records it in the manifest.
+
+    The shard is written to a temporary file and renamed before the manifest is updated, so the manifest only
+    lists complete shards.
+
+    Args:
+        h2o_df (pd.DataFrame): A DataFrame built by plots.pixels_to_dataset, with a "name" column.
+        save_dir (str): The directory of the shards.
+        manifest (list of dict): The entries of the shards written so far, see read_manifest. It is updated in place.
+
+    Returns:
+        dict: The manifest entry of the new shard.
+    """
+    index = len(manifest)
+    start = manifest[-1]["stop"] if manifest else 0
+    shard = f"shard_{index:05d}.parquet"
+    path = Path(save_dir) / shard
+
+    h2o_df.to_parquet(f"{path}.tmp")
+    os.replace(f"{path}.tmp", path)
+
+    entry = {"shard": shard, "start": start, "stop": start + len(h2o_df), **describe_names(h2o_df["name"])}
+    manifest.append(entry)
+    write_json({"shards": manifest}, Path(save_dir) / MANIFEST)
+
+    return entry
+
+
+def completed_names(save_dir, manifest):
+    """Returns the set of image names already written to the shards in the manifest."""
+    names = set()
+
+    for entry in manifest:
+        table = pq.read_table(Path(save_dir) / entry["shard"], columns=["name"])
+        names.update(table.column("name").to_pylist())
+
+    return names
+
+
+def shard_paths(save_dir):
+    """Returns the filepaths of the completed shards in the order they were written, e.g. for
+    h2o_modelling.parquet_to_h2o."""
+    return [(Path(save_dir) / entry["shard"]).as_posix() for entry in read_manifest(save_dir)]
+
+
+def read_shards(save_dir):
+    """Reads the completed shards of save_dir into a single DataFrame."""
+    h2o_df = pd.concat([pd.read_parquet(path) for path in shard_paths(save_dir)], ignore_index=True)
+    h2o_df["name"] = h2o_df["name"].astype("category")
+
+    return h2o_df
+
+
+def build_h2o_shards(dir_path, save_dir, chunk_size=1000, clear_dir=False):
+    """The sharded counterpart of plots.build_h2o_del_dir: builds the h2o dataset of a directory of plots
+    chunk_size images at a time and writes each chunk as a parquet shard.
+
+    Images that are already in a shard of save_dir are skipped, so calling it again after a crash
+    resumes the run.
+
+    Args:
+        dir_path (str): The directory of the plots.
+        save_dir (str): The directory to save the shards and the manifest to.
+        chunk_size (int, optional): The number of images per shard. Defaults to 1000.
+        clear_dir (bool): Should the files of each shard be removed from the dir_path after it is saved? Defaults to False.
+
+    Returns:
+        list of dict: The manifest of save_dir.
+    """
+    Path(save_dir).mkdir(parents=True, exist_ok=True)
+    manifest = read_manifest(save_dir)
+    done = completed_names(save_dir, manifest)
+
+    list_of_files = sorted(f for f in plots.list_files(dir_path) if f not in done)
+
+    for i in range(0, len(list_of_files), chunk_size):
+        chunk = list_of_files[i:i + chunk_size]
+        labels = [0 if re.search("nobuy", Path(f).name) else 1 for f in chunk]
+
+        write_shard(plots.build_h2o_dataset(chunk, labels, chunk), save_dir, manifest)
+
+        if clear_dir:
+            [Path(f).unlink() for f in chunk]
+
+    return manifest
@@ -1,25 +1,352 @@
 """
 This script allows the user to add technical indicators to a dataset that contains open, high, low, and close values for firms. 
 
-We have functions to compute the MACD, RSI, and BB buy indicators. 
+We have functions to compute the MACD, RSI, and BB buy indicators. The indicators can be computed with pandas_ta
+one firm at a time, or for every firm in one pass with the grouped functions, which reproduce pandas_ta's formulas.
+pandas_ta is only imported by the pandas_ta engine.
 """
 
 import numpy as np
 import pandas as pd
-import pandas_ta as ta
 
+from source import metrics
 
-def build_indicator(df, indicator, window_size):
+
+def firm_segments(df):
+    """Orders the rows of a DataFrame by firm, keeping the order of the rows within each firm.
+
+    This is the one place rows are grouped by firm: the grouped indicators, plots.window_positions and
+    sampling.firm_layout all start from it.
+
+    Args:
+        df (pd.DataFrame or np.ndarray): Dataframe where "firm" is a level of the index, or the firm of every row.
+
+    Returns:
+        tuple: The positions that sort the rows by firm, the firm code of each sorted row and the rank
+        of each sorted row within its firm.
+    """
+    if not isinstance(df, pd.DataFrame):
+        codes, _ = pd.factorize(np.asarray(df))
+    elif isinstance(df.index, pd.MultiIndex):
+        codes = np.asarray(df.index.codes[df.index.names.index('firm')])
+    else:
+        codes, _ = pd.factorize(df.index.get_level_values('firm'))
+    order = np.argsort(codes, kind='stable')
+    codes = codes[order]
+
+    rows = np.arange(len(codes))
+    firm_starts = np.r_[True, codes[1:] != codes[:-1]] if len(codes) else np.array([], dtype=bool)
+    rank = rows - np.maximum.accumulate(np.where(firm_starts, rows, 0))
+
+    return order, codes, rank
+
+
+def is_grouped(firms, same_firm=None):
+    """Returns True when the rows of each firm are next to each other, so that ordering them with firm_segments
+    would not move any row.
+
+    Args:
+        firms (np.ndarray): Firm of every row.
+        same_firm (np.ndarray, optional): Whether each row after the first has the same firm as the row before it.
+            Defaults to None, which computes it.
+
+    Returns:
+        bool: True if no firm appears in two separate runs of rows.
+    """
+    if same_firm is None:
+        same_firm = firms[1:] == firms[:-1]
+
+    firsts = firms[np.flatnonzero(np.r_[True, ~same_firm])] if len(firms) else firms
+
+    return len(pd.unique(firsts)) == len(firsts)
+
+
+def unsort(values, order):
+    """Puts values computed on rows sorted by firm_segments back into the original row order."""
+    results = np.empty_like(values)
+    results[order] = values
+
+    return results
+
+
+def segment_rolling(x, rank, length, stat, **kwargs):
+    """Applies a rolling statistic to rows sorted by firm, leaving NaN wherever the window would cross into another firm.
+
+    Args:
+        x (np.ndarray): Values sorted by firm.
+        rank (np.ndarray): Rank of each row within its firm.
+        length (int): Number of rows in the window.
+        stat (str): Name of the pandas rolling statistic, e.g. "mean" or "std".
+        **kwargs: Passed on to the rolling statistic.
+
+    Returns:
+        np.ndarray: The rolling statistic.
+    """
+    results = getattr(pd.Series(x).rolling(length, min_periods=length), stat)(**kwargs).to_numpy()
+    results[rank < length - 1] = np.nan
+
+    return results
+
+
+def segment_ewm(x, codes, **kwargs):
+    """Computes an exponentially weighted mean for each firm of rows sorted by firm.
+
+    Args:
+        x (np.ndarray): Values sorted by firm.
+        codes (np.ndarray): Firm code of each row.
+        **kwargs: Passed on to pd.Series.ewm.
+
+    Returns:
+        np.ndarray: The exponentially weighted mean.
+    """
+    return pd.Series(x).groupby(codes, sort=True).ewm(**kwargs).mean().to_numpy()
+
+
+def segment_ema(x, codes, length):
+    """Computes pandas_ta's ema for each firm of rows sorted by firm: the first length valid values are replaced
+    by their mean, which seeds an exponential moving average with span=length and adjust=False.
+
+    Args:
+        x (np.ndarray): Values sorted by firm.
+        codes (np.ndarray): Firm code of each row.
+        length (int): Span of the moving average.
+
+    Returns:
+        np.ndarray: The exponential moving average.
+    """
+    valid = ~np.isnan(x)
+    firm_starts = np.r_[True, codes[1:] != codes[:-1]]
+
+    def per_firm_cumsum(values):
+        total = np.cumsum(values)
+        base = np.maximum.accumulate(np.where(firm_starts, np.arange(len(values)), 0))
+        return total - (total - values)[base]
+
+    n_valid = per_firm_cumsum(valid.astype(int))
+    seed_sum = per_firm_cumsum(np.where(valid, x, 0.0))
+
+    seeded = np.where(n_valid < length, np.nan, x)
+    is_seed = valid & (n_valid == length)
+    seeded[is_seed] = seed_sum[is_seed] / length
+
+    return segment_ewm(seeded, codes, span=length, adjust=False)
+
+
+def memoize(cache, key, fn):
+    """Returns cache[key], computing it with fn() the first time the key is requested."""
+    if key not in cache:
+        cache[key] = fn()
+
+    return cache[key]
+
+
+def rsi_columns(close, segments, cache, length):
+    """Computes pandas_ta's Relative Strength Index (rsi) on close prices sorted by firm.
+
+    Args:
+        close (np.ndarray): Close prices sorted by firm_segments.
+        segments (tuple): The output of firm_segments.
+        cache (dict): Intermediate series shared between indicators.
+        length (int): Number of prior days to use in the calculation.
+
+    Returns:
+        dict: The rsi keyed by pandas_ta's column name (e.g. "RSI_14").
+    """
+    _, codes, rank = segments
+
+    def change():
+        results = np.r_[np.nan, np.diff(close)] if len(close) else close.copy()
+        results[rank == 0] = np.nan
+        return results
+
+    def average(direction):
+        moves = memoize(cache, ('change',), change)
+        moves = np.where(moves < 0, 0, moves) if direction == 'gains' else np.where(moves > 0, 0, moves)
+        return segment_ewm(moves, codes, alpha=1 / length, min_periods=length)
+
+    gains_avg = memoize(cache, ('rma', 'gains', length), lambda: average('gains'))
+    losses_avg = memoize(cache, ('rma', 'losses', length), lambda: average('losses'))
+
+    return {f'RSI_{length}': 100 * gains_avg / (gains_avg + np.abs(losses_avg))}
+
+
+def bbands_columns(close, segments, cache, length, std=2.0, ddof=0):
+    """Computes pandas_ta's Bollinger Bands (bbands) on close prices sorted by firm.
+
+    Args:
+        close (np.ndarray): Close prices sorted by firm_segments.
+        segments (tuple): The output of firm_segments.
+        cache (dict): Intermediate series shared between indicators.
+        length (int): Number of prior days to use in the calculation.
+        std (float, optional): Number of standard deviations between the middle band and the outer bands. Defaults to 2.0.
+        ddof (int, optional): Delta degrees of freedom of the standard deviation. Defaults to 0, as in pandas_ta.
+
+    Returns:
+        dict: The lower, middle and upper bands, the bandwidth and the percent keyed by pandas_ta's column names
+        (e.g. "BBL_20_2.0").
+    """
+    _, _, rank = segments
+    std = float(std)
+
+    mid = memoize(cache, ('rolling', 'mean', length), lambda: segment_rolling(close, rank, length, 'mean'))
+    sd = memoize(cache, ('rolling', 'std', length, ddof), lambda: segment_rolling(close, rank, length, 'std', ddof=ddof))
+    lower = mid - std * sd
+    upper = mid + std * sd
+
+    band_range = upper - lower
+    if (band_range == 0).any():
+        band_range = band_range + np.finfo(float).eps
+    close_range = close - lower
+    if (close_range == 0).any():
+        close_range = close_range + np.finfo(float).eps
+
+    suffix = f'{length}_{std}'
+
+    return {
+        f'BBL_{suffix}': lower,
+        f'BBM_{suffix}': mid,
+        f'BBU_{suffix}': upper,
+        f'BBB_{suffix}': 100 * band_range / mid,
+        f'BBP_{suffix}': close_range / band_range,
+    }
+
+
+def macd_columns(close, segments, cache, fast=12, slow=26, signal=9):
+    """Computes pandas_ta's Moving Average Convergence Divergence (macd) on close prices sorted by firm.
+
+    Args:
+        close (np.ndarray): Close prices sorted by firm_segments.
+        segments (tuple): The output of firm_segments.
+        cache (dict): Intermediate series shared between indicators.
+        fast (int, optional): Span of the fast moving average. Defaults to 12.
+        slow (int, optional): Span of the slow moving average. Defaults to 26.
+        signal (int, optional): Span of the moving average of the macd that forms the signal line. Defaults to 9.
+
+    Returns:
+        dict: The macd, histogram and signal line keyed by pandas_ta's column names (e.g. "MACD_12_26_9").
+    """
+    _, codes, _ = segments
+    if slow < fast:
+        fast, slow = slow, fast
+
+    def ema(length):
+        return memoize(cache, ('ema', length), lambda: segment_ema(close, codes, length))
+
+    macd = memoize(cache, ('macd', fast, slow), lambda: ema(fast) - ema(slow))
+    signal_line = memoize(cache, ('macd_signal', fast, slow, signal), lambda: segment_ema(macd, codes, signal))
+
+    suffix = f'{fast}_{slow}_{signal}'
+
+    return {
+        f'MACD_{suffix}': macd,
+        f'MACDh_{suffix}': macd - signal_line,
+        f'MACDs_{suffix}': signal_line,
+    }
+
+
+GROUPED_INDICATORS = {"rsi": rsi_columns, "bbands": bbands_columns, "macd": macd_columns}
+
+
+def build_indicators(df, specs):
+    """Computes several indicators for every firm in one pass, sharing intermediate series between them
+    (e.g. the moving averages behind the macd and its signal line, or the rolling mean behind the bbands).
+
+    Args:
+        df (pd.DataFrame): Dataframe that contains close prices, where "firm" is a level of the index.
+        specs (list of tuple): One (name, window_size) or (name, window_size, params) tuple per indicator, where
+            name is "bbands", "macd" or "rsi" and params is a dict of extra arguments (e.g. {"std": 2.5} for bbands
+            or {"fast": 12, "signal": 9} for macd). The window_size of a macd is the span of its slow moving average.
+
+    Returns:
+        pd.DataFrame: One column per indicator series, named like pandas_ta's (e.g. "MACDs_12_26_9").
+    """
+    segments = firm_segments(df)
+    order = segments[0]
+    close = df['close'].to_numpy(dtype=float)[order]
+    cache = {}
+    columns = {}
+
+    for name, window_size, *params in specs:
+        params = params[0] if params else {}
+        if name == "macd":
+            params = {"slow": window_size, **params}
+        else:
+            params = {"length": window_size, **params}
+
+        columns.update(GROUPED_INDICATORS[name](close, segments, cache, **params))
+
+    return pd.DataFrame({name: unsort(col, order) for name, col in columns.items()}, index=df.index)
+
+
+def grouped_rsi(df, length):
+    """Computes pandas_ta's Relative Strength Index (rsi) of the close prices of every firm in one pass.
+
+    Args:
+        df (pd.DataFrame): Dataframe that contains close prices, where "firm" is a level of the index.
+        length (int): Number of prior days to use in the calculation.
+
+    Returns:
+        pd.Series: The rsi, named like pandas_ta's (e.g. "RSI_14").
+    """
+    return build_indicators(df, [("rsi", length)]).iloc[:, 0]
+
+
+def grouped_bbands(df, length, std=2.0, ddof=0):
+    """Computes pandas_ta's Bollinger Bands (bbands) of the close prices of every firm in one pass.
+
+    Args:
+        df (pd.DataFrame): Dataframe that contains close prices, where "firm" is a level of the index.
+        length (int): Number of prior days to use in the calculation.
+        std (float, optional): Number of standard deviations between the middle band and the outer bands. Defaults to 2.0.
+        ddof (int, optional): Delta degrees of freedom of the standard deviation. Defaults to 0, as in pandas_ta.
+
+    Returns:
+        pd.DataFrame: The lower, middle and upper bands, the bandwidth and the percent, named like pandas_ta's
+        (e.g. "BBL_20_2.0").
+    """
+    return build_indicators(df, [("bbands", length, {"std": std, "ddof": ddof})])
+
+
+def grouped_macd(df, fast=12, slow=26, signal=9):
+    """Computes pandas_ta's Moving Average Convergence Divergence (macd) of the close prices of every firm in one pass.
+
+    Args:
+        df (pd.DataFrame): Dataframe that contains close prices, where "firm" is a level of the index.
+        fast (int, optional): Span of the fast moving average. Defaults to 12.
+        slow (int, optional): Span of the slow moving average. Defaults to 26.
+        signal (int, optional): Span of the moving average of the macd that forms the signal line. Defaults to 9.
+
+    Returns:
+        pd.DataFrame: The macd, histogram and signal line, named like pandas_ta's (e.g. "MACD_12_26_9").
+    """
+    return build_indicators(df, [("macd", slow, {"fast": fast, "signal": signal})])
+
+
+@metrics.timed("build_indicator")
+def build_indicator(df, indicator, window_size, engine="pandas_ta"):
     """Computes a buy indicator.
 
     Args:
         df (pd.DataFrame): Dataframe that contains open, high, low, close prices.
         indicator (str: ["bbands", "macd", "rsi"]): Buy indicator to be calculated.
-        window_size (int): Number of prior days to use in the calculation.
+        window_size (int): Number of prior days to use in the calculation. Like pandas_ta, macd ignores it
+            and always uses 12, 26 and 9 days.
+        engine (str, optional): "pandas_ta" computes the indicator one firm at a time; "grouped" computes it
+            for every firm in one pass with the grouped functions. Defaults to "pandas_ta".
 
     Returns:
         pd.Series: [description]
     """
+    metrics.count(items=len(df))
+
+    if engine == "grouped" and indicator == "macd":
+        return grouped_macd(df)
+
+    elif engine == "grouped":
+        return {"rsi": grouped_rsi, "bbands": grouped_bbands}[indicator](df, window_size)
+
+    import pandas_ta  # noqa: F401, registers the DataFrame.ta accessor
+
     tickers = df.index.unique('firm')
     return pd.concat(
         [
@@ -31,56 +358,121 @@ def build_indicator(df, indicator, window_size):
     )
 
 
-def rsi_buy_indicator(rsi_col):
+def firm_labels(data):
+    """Returns an integer code for the firm of every row of data, or None when data has no "firm" index level."""
+    if isinstance(data.index, pd.MultiIndex) and "firm" in data.index.names:
+        return data.index.codes[data.index.names.index("firm")]
+
+    if data.index.name == "firm":
+        return pd.factorize(data.index)[0]
+
+    return None
+
+
+def crossover(condition, valid=None, firms=None):
+    """Flags the rows where a buy condition becomes true, i.e. holds on a row but not on the row before it.
+
+    Args:
+        condition (np.ndarray): Boolean array with the buy condition of every row, such as a threshold cross
+            (rsi >= 30) or a series cross (macd > signal). Missing values must already be resolved to True or False.
+        valid (np.ndarray, optional): Boolean array of the rows where a signal may be emitted, e.g. the rows where
+            the indicator is not missing. Defaults to None, which allows every row.
+        firms (np.ndarray, optional): Firm of every row of a stacked multi-firm dataset. Each firm's rows are
+            compared in their order, wherever they are in the dataset (see firm_segments), and the first row of
+            each firm never emits a signal, so a condition can not cross from one firm into the next. Defaults to
+            None, a single firm.
+
+    Returns:
+        np.ndarray: An int8 array of 1's and 0's to indicate whether the buy condition was reached
+    """
+    condition = np.asarray(condition, dtype=bool)
+    valid = np.asarray(valid, dtype=bool) if valid is not None else None
+    order = None
+
+    if firms is not None:
+        firms = np.asarray(firms)
+        same_firm = firms[1:] == firms[:-1]
+
+        if not is_grouped(firms, same_firm):
+            order, _, rank = firm_segments(firms)
+            condition = condition[order]
+            valid = valid[order] if valid is not None else None
+            same_firm = rank[1:] > 0
+
+    crossed = np.zeros(len(condition), dtype=bool)
+    crossed[1:] = condition[1:] & ~condition[:-1]
+
+    if valid is not None:
+        crossed[1:] &= valid[1:]
+
+    if firms is not None:
+        crossed[1:] &= same_firm
+
+    if order is not None:
+        crossed = unsort(crossed, order)
+
+    return crossed.view(np.int8)
+
+
+def rsi_buy_indicator(rsi_col, firms=None):
     """Adds a column that contains a 1 or 0 to indicate whether an Relative Strength Index (rsi) buy signal was reached
 
     Args:
         rsi_col (pd.Series): Series is expected to contain rsi signals
+        firms (np.ndarray, optional): Firm of every row, so that signals reset at firm boundaries. Defaults to None.
 
     Returns:
-        pd.Series: A series of 1's and 0's to indicate whether a buy threshold was reached
+        np.ndarray: An int8 array of 1's and 0's to indicate whether a buy threshold was reached
     """
-    temp_col = (rsi_col.fillna(1000) >= 30).astype(int).diff()
-    new_col = np.where((temp_col == 1 & rsi_col.isnull()), 0, temp_col)
-    pd.Series(new_col).replace(to_replace=[np.NaN, -1], value=0, inplace=True)
+    rsi = np.asarray(rsi_col, dtype=float)
+    missing = np.isnan(rsi)
 
-    return new_col
+    return crossover(missing | (rsi >= 30), ~missing, firms)
 
 
-def bb_buy_indicator(bb_lower_band_col, close_col):
+def bb_buy_indicator(bb_lower_band_col, close_col, firms=None):
     """Adds a column that contains a 1 or 0 to indicate whether a Bollinger Bands (bbands) buy signal was reached
 
     Args:
-        rsi_col (pd.Series): Series is expected to contain bband signals
+        bb_lower_band_col (pd.Series): Series is expected to contain the lower bband
+        close_col (pd.Series): Series is expected to contain close prices
+        firms (np.ndarray, optional): Firm of every row, so that signals reset at firm boundaries. Defaults to None.
 
     Returns:
-        pd.Series: A series of 1's and 0's to indicate whether a buy threshold was reached
+        np.ndarray: An int8 array of 1's and 0's to indicate whether a buy threshold was reached
     """
-    temp_col = (close_col < bb_lower_band_col.fillna(-1)).astype(int).diff()
-    new_col = np.where((temp_col == 1 & close_col.isnull()), 0, temp_col)
-    pd.Series(new_col).replace(to_replace=[np.NaN, -1], value=0, inplace=True)
+    close = np.asarray(close_col, dtype=float)
+    lower_band = np.asarray(bb_lower_band_col, dtype=float)
 
-    return new_col
+    return crossover(close < lower_band, ~np.isnan(close), firms)
 
 
-def macd_buy_indicator(macd_signal_col, macd_col):
+def macd_buy_indicator(macd_signal_col, macd_col, firms=None):
     """Adds a column that contains a 1 or 0 to indicate whether a Moving Average Convergence Divergence (macd) buy signal was reached
 
     Args:
-        rsi_col (pd.Series): Series is expected to contain macd signals
+        macd_signal_col (pd.Series): Series is expected to contain the macd signal line
+        macd_col (pd.Series): Series is expected to contain macd signals
+        firms (np.ndarray, optional): Firm of every row, so that signals reset at firm boundaries. Defaults to None.
 
     Returns:
-        pd.Series: A series of 1's and 0's to indicate whether a buy threshold was reached
+        np.ndarray: An int8 array of 1's and 0's to indicate whether a buy threshold was reached
     """
-    new_col = (macd_col > macd_signal_col).astype(int).diff()
-    pd.Series(new_col).replace(to_replace=[np.NaN, -1], value=0, inplace=True)
+    macd = np.asarray(macd_col, dtype=float)
+    signal = np.asarray(macd_signal_col, dtype=float)
 
-    return new_col
+    return crossover(macd > signal, None, firms)
 
 
-def compute_buy_nobuy(df, fn):
-    """
-    TODO: refactor the three buy functions
+def compute_buy_nobuy(df, fn, *columns):
+    """Computes a buy indicator for every firm of a stacked dataset, resetting it at firm boundaries.
+
+    Args:
+        df (pd.DataFrame): Dataframe that contains the indicator columns, where "firm" is a level of the index.
+        fn (function): One of rsi_buy_indicator, bb_buy_indicator or macd_buy_indicator.
+        *columns (str): Names of the columns passed on to fn, in the order of its arguments.
+
+    Returns:
+        np.ndarray: An int8 array of 1's and 0's to indicate whether a buy threshold was reached
     """
-    df['temp_name'] = df.apply(fn)
-    return df['temp_name']
+    return fn(*[df[col] for col in columns], firms=firm_labels(df))
@@ -1,36 +1,144 @@
 """
 This script allows the user to build models using h2o. 
 
-We have functions to read and concatenate parquet files, convert pandas dataframes to h2o dataframes, 
+We have functions to read and concatenate parquet files (or memory-mapped stores), convert pandas dataframes to h2o dataframes, 
 select an outcome variable to classify, and train the model using h2o.
+
+h2o is imported by the functions that talk to the cluster, so reading and filtering parquet files does not need it.
 """
 
-import h2o
-from h2o.automl import H2OAutoML
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from source import metrics
+from source import store
+
+
+NAME_PATTERN = r"(?P<firm>[^/]*)_[^_/]*_[^_/]*_(?P<start>\d{4}-\d{2}-\d{2})_[^_/]*$"
+
+
+def filter_names(table, firms=None, start=None, end=None):
+    """Keeps the rows of an arrow table whose "name" (see plots.plot_sampled) has one of the firms and a start date
+    between start and end, inclusive. Dates are "YYYY-MM-DD" strings, and None means no restriction."""
+    if firms is None and start is None and end is None:
+        return table
+
+    parts = pc.extract_regex(table.column("name").cast(pa.string()), NAME_PATTERN)
+    mask = pc.is_valid(parts)
+
+    if firms is not None:
+        mask = pc.and_(mask, pc.is_in(pc.struct_field(parts, "firm"), value_set=pa.array(list(firms), pa.string())))
+    if start is not None:
+        mask = pc.and_(mask, pc.greater_equal(pc.struct_field(parts, "start"), start))
+    if end is not None:
+        mask = pc.and_(mask, pc.less_equal(pc.struct_field(parts, "start"), end))
+
+    return table.filter(pc.fill_null(mask, False))
+
+
+def read_parquet_files(*args, columns=None, filters=None, firms=None, start=None, end=None, n_threads=None):
+    """Reads multiple parquet files concurrently and concatenates them as a single arrow table.
 
+    Args:
+        *args (list of str): Parquet file paths to be read.
+        columns (list of str, optional): Columns to read, e.g. ["label", "pixel_0", ...]. Defaults to None, all columns.
+        filters (list of tuple, optional): pyarrow row filters on the stored columns, e.g. [("label", "=", 1)].
+        firms (list of str, optional): Keep only the rows of these firms, parsed from "name". Defaults to None.
+        start (str, optional): Keep only windows that start on or after this "YYYY-MM-DD" date. Defaults to None.
+        end (str, optional): Keep only windows that start on or before this "YYYY-MM-DD" date. Defaults to None.
+        n_threads (int, optional): The number of files read at once. Defaults to None, ThreadPoolExecutor's default.
+
+    Returns:
+        pa.Table: The rows of each file, in the order of args.
+    """
+    by_name = firms is not None or start is not None or end is not None
+    read_columns = columns
+    if by_name and columns is not None and "name" not in columns:
+        read_columns = list(columns) + ["name"]
+
+    def read(file):
+        table = pq.read_table(file, columns=read_columns, filters=filters)
+        table = filter_names(table, firms, start, end)
 
-def parquet_to_h2o(*args):
+        return table.select(columns) if columns is not None else table
+
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        tables = list(executor.map(read, args))
+
+    return pa.concat_tables(tables, promote_options="permissive")
+
+
+@metrics.timed("parquet_to_h2o")
+def parquet_to_h2o(*args, columns=None, filters=None, firms=None, start=None, end=None, n_threads=None):
     """Reads multiple parquet files and converts them to a single h2o dataframe.
 
     Args:
         *args (list of str): Parquet file paths to be read.
+        See read_parquet_files for the optional arguments, which read a subset of the columns or rows.
 
     Returns:
         h2o_frame (h2o.frame.H2OFrame): An h2o dataframe containing each of the parquet files.
     """
-    list_of_dfs = []
+    import h2o
+
+    table = read_parquet_files(*args, columns=columns, filters=filters, firms=firms, start=start, end=end,
+                               n_threads=n_threads)
+    h2o_frame = h2o.H2OFrame(table.to_pandas())
+    metrics.count(items=table.num_rows, read=args)
 
-    for file in args:
-        list_of_dfs.append(pd.read_parquet(file))
+    return h2o_frame
 
-    dfs = pd.concat(list_of_dfs, ignore_index=True)
-    h2o_frame = h2o.H2OFrame(dfs)
+
+def import_parquet_to_h2o(*args, col_types=None):
+    """Imports multiple parquet files directly into the h2o cluster as a single h2o dataframe.
+
+    Unlike parquet_to_h2o, the files are parsed by the cluster itself, so the pixels never pass through pandas or
+    the Python client. The files must be readable by the cluster, e.g. local files for a local cluster.
+
+    Args:
+        *args (list of str): Parquet file paths to be imported.
+        col_types (dict, optional): h2o column types, by column name. Defaults to None, which parses "name" as a
+            string and every other column as an integer, like parquet_to_h2o.
+
+    Returns:
+        h2o_frame (h2o.frame.H2OFrame): An h2o dataframe containing each of the parquet files.
+    """
+    import h2o
+
+    paths = [Path(file).absolute().as_posix() for file in args]
+
+    if col_types is None:
+        columns = pq.read_schema(paths[0]).names
+        col_types = {col: "string" if col == "name" else "int" for col in columns}
+
+    h2o_frame = h2o.import_file(path=paths if len(paths) > 1 else paths[0], col_types=col_types)
 
     return h2o_frame
 
 
-def prepare_h2o_df(df, outcome, to_factor=True):
+def store_to_h2o(*args, **filters):
+    """Loads one or more memory-mapped stores written by plots.build_store_sampled and converts them to a single
+    h2o dataframe. Only the rows that match the filters are read from disk.
+
+    Args:
+        *args (list of str): Store directories to be read.
+        **filters: A value or list of values per store sidecar column, e.g. firm="AAPL" or signal=["buy", "nobuy"].
+
+    Returns:
+        h2o_frame (h2o.frame.H2OFrame): An h2o dataframe with the same columns as parquet_to_h2o.
+    """
+    import h2o
+
+    h2o_frame = h2o.H2OFrame(store.load_dataset(*args, **filters))
+
+    return h2o_frame
+
+
+def prepare_h2o_df(df, outcome, to_factor=True, predictors=None):
     """Converts an h2o dataframe with a specific outcome variable to an outcome and set of predictors.
         The outcome variable is converted to a factor by default. 
 
@@ -39,6 +147,8 @@ def prepare_h2o_df(df, outcome, to_factor=True):
         outcome (str): The name of the outcome variable.
         to_factor (logical): A logical indicating whether the outcome variable should be transformed to a factor. 
                             Defaults to True. 
+        predictors (list of str, optional): The predictor variables, e.g. pruning.column_names(index) to train on
+            the informative pixels only. Defaults to None, every column but the label and name.
 
     Returns:
         tuple: A tuple with three elements: the h2o data frame, the name of the outcome variable, 
@@ -48,6 +158,9 @@ def prepare_h2o_df(df, outcome, to_factor=True):
         df[outcome] = df[outcome].asfactor()
 
     y = outcome
+    if predictors is not None:
+        return (df, y, list(predictors))
+
     x = df.columns
     x.remove('label')
     x.remove('name')
@@ -55,6 +168,7 @@ def prepare_h2o_df(df, outcome, to_factor=True):
     return (df, y, x)
 
 
+@metrics.timed("train_and_save")
 def train_and_save(df, outcome, predictors, save_path, max_models=100, max_runtime_min=5, seed=1):
     """Trains and saves an h2o model using H2OAutoML. Excludes deep learning models (see README for more detail.)
 
@@ -66,12 +180,16 @@ def train_and_save(df, outcome, predictors, save_path, max_models=100, max_runti
         max_models (int): Maximum number of models to create. Defaults to 100.
         max_runtime_secs (int): Maximum run time in minutes. Defaults to 5.
     """
+    import h2o
+    from h2o.automl import H2OAutoML
+
     aml = H2OAutoML(
         max_models=max_models, 
         max_runtime_secs=60*max_runtime_min, 
         seed=seed,
         exclude_algos=["DeepLearning"])
     aml.train(x=predictors, y=outcome, training_frame=df)
+    metrics.count(items=df.nrows)
 
     SAVE_PATH = save_path
     h2o.save_model(aml.leader, path=SAVE_PATH)
@@ -0,0 +1,233 @@
+"""
+This script allows the user to download daily open, high, low, close and volume bars for many firms.
+
+Bars are cached on disk as parquet, one file per firm and calendar year (cache_dir/symbol=AAPL/2011.parquet). Each
+file records the time its bars were fetched up to, so only the years that are not cached yet, or were cached before
+they ended, are requested. Requests run in a thread pool under a token bucket rate limit
+instead of sleeping between firms. A provider is any object with a fetch(symbol, start, end) method: AlpacaProvider
+wraps the Alpaca REST api used in the notebooks and FakeProvider generates bars offline.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import os
+from pathlib import Path
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+
+TZ = "America/New_York"
+COLUMNS = ["open", "high", "low", "close", "volume"]
+
+
+class TokenBucket:
+    """Allows rate requests per second on average, with bursts of up to capacity requests.
+
+    Args:
+        rate (float): Tokens added per second.
+        capacity (float, optional): Maximum number of tokens. Defaults to rate.
+        clock (function, optional): Returns the current time in seconds. Defaults to time.monotonic.
+        sleep (function, optional): Waits a number of seconds. Defaults to time.sleep.
+    """
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Waits until a token is available and takes it."""
+        while True:
+            with self.lock:
+                now = self.clock()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = (1 - self.tokens) / self.rate
+
+            self.sleep(wait)
+
+
+class AlpacaProvider:
+    """Fetches daily bars with an alpaca_trade_api.REST api, like the 00_upload_plots notebook.
+
+    Args:
+        api (alpaca_trade_api.REST): A connected api.
+        limit (int, optional): Maximum number of bars per request. Defaults to 1000.
+    """
+
+    def __init__(self, api, limit=1000):
+        self.api = api
+        self.limit = limit
+
+    def fetch(self, symbol, start, end):
+        bars = self.api.get_barset(
+            symbols=symbol,
+            timeframe="day",
+            start=start.isoformat(),
+            end=end.isoformat(),
+            limit=self.limit,
+        ).df
+
+        return bars[symbol] if isinstance(bars.columns, pd.MultiIndex) else bars
+
+
+class FakeProvider:
+    """Generates reproducible random daily bars on business days, for tests and offline work.
+
+    Args:
+        seed (int, optional): Seed of the random prices, combined with the symbol. Defaults to 0.
+    """
+
+    def __init__(self, seed=0):
+        self.seed = seed
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def fetch(self, symbol, start, end):
+        with self.lock:
+            self.calls.append((symbol, start, end))
+
+        time_ = pd.bdate_range(start.normalize(), end, inclusive="left", tz=TZ) + pd.Timedelta(hours=9, minutes=30)
+        time_ = time_[(time_ >= start) & (time_ < end)]
+        days = (time_.tz_convert(None).normalize() - pd.Timestamp("2000-01-01")).days.to_numpy()
+
+        rng = np.random.default_rng([self.seed, sum(map(ord, symbol))])
+        steps = rng.normal(scale=1.0, size=40000)
+        close = 100 + np.cumsum(steps)[days] * 0.1
+        open_ = close + np.sin(days) * 0.3
+
+        return pd.DataFrame({
+            "open": open_,
+            "high": np.maximum(open_, close) + 0.5,
+            "low": np.minimum(open_, close) - 0.5,
+            "close": close,
+            "volume": 1000 + days % 97,
+        }, index=pd.Index(time_, name="time"))
+
+
+def year_ranges(start, end):
+    """Splits [start, end) into the calendar years it overlaps.
+
+    Returns:
+        list: (year, year_start, year_end) tuples, where year_start and year_end bound the whole calendar year.
+    """
+    return [
+        (year, pd.Timestamp(f"{year}-01-01", tz=TZ), pd.Timestamp(f"{year + 1}-01-01", tz=TZ))
+        for year in range(start.year, (end - pd.Timedelta(1)).year + 1)
+    ]
+
+
+def cache_path(cache_dir, symbol, year):
+    return Path(cache_dir) / f"symbol={symbol}" / f"{year}.parquet"
+
+
+def fetched_end(path):
+    """Returns the time the bars of a cached year were fetched up to, or None if the year is not cached (or was
+    cached without that record)."""
+    try:
+        metadata = pq.read_schema(path).metadata or {}
+    except (FileNotFoundError, pa.ArrowInvalid):
+        return None
+
+    return pd.Timestamp(metadata[b"fetched_end"].decode()) if b"fetched_end" in metadata else None
+
+
+def fetch_year(provider, bucket, cache_dir, symbol, year, year_start, year_end, now):
+    """Fetches one calendar year of bars for a symbol, up to now for the current year, and writes it to the cache
+    with the time it was fetched up to. A year without bars is written as an empty file."""
+    end = min(year_end, now)
+
+    bucket.acquire()
+    bars = provider.fetch(symbol, year_start, year_end)
+
+    bars = bars.reindex(columns=COLUMNS).astype(float)
+    time_ = pd.DatetimeIndex(bars.index)
+    bars.index = (time_.tz_localize(TZ) if time_.tz is None else time_.tz_convert(TZ)).rename("time")
+    bars = bars[bars.index < end]
+
+    table = pa.Table.from_pandas(bars)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), b"fetched_end": end.isoformat().encode()})
+
+    path = cache_path(cache_dir, symbol, year)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    pq.write_table(table, f"{path}.{threading.get_ident()}.tmp")
+    os.replace(f"{path}.{threading.get_ident()}.tmp", path)
+
+
+def load_bars(symbols, start, end, provider, cache_dir, n_threads=8, rate=3.0, capacity=None, now=None):
+    """Loads daily bars for many firms, fetching the calendar years that are not cached yet. A year that was cached
+    before it ended, such as the current year, is fetched again when more of it is requested.
+
+    Args:
+        symbols (list of str): The firms to load.
+        start (str or pd.Timestamp): The first time to load, in America/New_York if no timezone is given.
+        end (str or pd.Timestamp): The end of the range, which is not included.
+        provider: An object with a fetch(symbol, start, end) method, e.g. AlpacaProvider or FakeProvider.
+        cache_dir (str): The directory of the parquet cache.
+        n_threads (int, optional): The number of requests in flight at once. Defaults to 8.
+        rate (float, optional): The average number of requests per second. Defaults to 3.0.
+        capacity (float, optional): The largest burst of requests, see TokenBucket. Defaults to rate.
+        now (str or pd.Timestamp, optional): The current time, which bounds the bars a year can have so far.
+            Defaults to None, the time of the call.
+
+    Returns:
+        pd.DataFrame: Open, high, low, close and volume columns, where "time" and "firm" are a MultiIndex. The rows
+        of each firm are contiguous and in time order. Firms are returned with the years that could be fetched, e.g.
+        from their first trading day on, and firms without any bars are left out.
+    """
+    start = pd.Timestamp(start, tz=TZ) if pd.Timestamp(start).tzinfo is None else pd.Timestamp(start)
+    end = pd.Timestamp(end, tz=TZ) if pd.Timestamp(end).tzinfo is None else pd.Timestamp(end)
+    now = pd.Timestamp.now(tz=TZ) if now is None else pd.Timestamp(now)
+    now = now.tz_localize(TZ) if now.tzinfo is None else now
+    years = year_ranges(start, end)
+
+    def is_current(symbol, year, year_end):
+        fetched = fetched_end(cache_path(cache_dir, symbol, year))
+        return fetched is not None and fetched >= min(year_end, end, now)
+
+    missing = [(symbol, *year) for symbol in symbols for year in years if not is_current(symbol, year[0], year[2])]
+    bucket = TokenBucket(rate, capacity)
+
+    def fetch(task):
+        try:
+            fetch_year(provider, bucket, cache_dir, *task, now)
+        except Exception as e:
+            print(f'Unexpected error: {e}')
+            print(f'Bars for {task[0]} in {task[1]} not fetched.')
+
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        list(executor.map(fetch, missing))
+
+    paths = {symbol: [cache_path(cache_dir, symbol, year).as_posix() for year, _, _ in years
+                      if cache_path(cache_dir, symbol, year).is_file()] for symbol in symbols}
+    loaded = [symbol for symbol in symbols if paths[symbol]]
+    paths = [path for symbol in loaded for path in paths[symbol]]
+
+    if not paths:
+        return pd.DataFrame(columns=COLUMNS, index=pd.MultiIndex.from_arrays([[], []], names=["time", "firm"]))
+
+    dataset = ds.dataset(paths, format="parquet", partitioning="hive", partition_base_dir=Path(cache_dir).as_posix())
+    table = dataset.to_table(columns=["time", "symbol"] + COLUMNS,
+                             filter=(ds.field("time") >= start) & (ds.field("time") < end))
+
+    bars = table.to_pandas(ignore_metadata=True)
+    bars["symbol"] = pd.Categorical(bars["symbol"].astype(str), categories=loaded)
+    bars = bars.sort_values(["symbol", "time"], kind="stable")
+    bars.index = pd.MultiIndex.from_arrays([bars.pop("time").dt.tz_convert(TZ), bars.pop("symbol").astype(str)],
+                                           names=["time", "firm"])
+
+    return bars
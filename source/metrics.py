@@ -0,0 +1,243 @@
+"""
+This script allows the user to measure where the time of a long run goes.
+
+The entry points of the pipeline (features.build_indicator, plots.plot_sampled, plots.build_h2o_del_dir,
+h2o_modelling.parquet_to_h2o, h2o_modelling.train_and_save, aws.send_dir, and the rendering, encoding and decoding
+of single plots) report each call as a stage: its wall time, the number of items it processed and skipped, the
+bytes it read and wrote, and the peak resident memory of the process so far. The calls are added up per stage, so memory does not
+grow with the length of a run; the record of every call is only kept on request. Nothing is recorded until enable
+is called, and a disabled stage only checks a flag. One stage can also be profiled with cProfile, and the totals
+can be written to a json or csv report.
+
+Stages run in worker processes (e.g. plot_sampled with n_jobs > 1) are not recorded.
+"""
+
+import cProfile
+from contextlib import contextmanager
+import functools
+import json
+from pathlib import Path
+import pstats
+import sys
+import threading
+import time
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+ENABLED = False
+PROFILE_STAGE = None
+KEEP_CALLS = False
+STAGES = {}
+RECORDS = []
+FIELDS = ["stage", "seconds", "items", "skipped", "bytes_read", "bytes_written", "peak_rss_mb"]
+SUMMARY_FIELDS = ["stage", "calls", "seconds", "max_seconds", "items", "skipped", "bytes_read", "bytes_written",
+                  "peak_rss_mb", "items_per_second"]
+
+lock = threading.Lock()
+local = threading.local()
+profiler = cProfile.Profile()
+
+
+def enable(profile_stage=None, calls=False):
+    """Starts recording stages.
+
+    Args:
+        profile_stage (str, optional): The name of a stage to profile with cProfile, e.g. "plot_sampled". Defaults
+            to None.
+        calls (bool, optional): Should the record of every call be kept as well as the totals of each stage? This
+            takes memory for every plot of a run. Defaults to False.
+    """
+    global ENABLED, PROFILE_STAGE, KEEP_CALLS
+    ENABLED = True
+    PROFILE_STAGE = profile_stage
+    KEEP_CALLS = calls
+
+
+def disable():
+    """Stops recording stages. The records so far are kept."""
+    global ENABLED, PROFILE_STAGE, KEEP_CALLS
+    ENABLED = False
+    PROFILE_STAGE = None
+    KEEP_CALLS = False
+
+
+def reset():
+    """Removes the records and the profile so far."""
+    global profiler
+    with lock:
+        STAGES.clear()
+        RECORDS.clear()
+        profiler = cProfile.Profile()
+
+
+def peak_rss_mb():
+    """Returns the peak resident memory of the process in MiB, or None where the resource module is missing."""
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # ru_maxrss is in bytes on macOS and in KiB elsewhere
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+def file_bytes(files):
+    return sum(Path(f).stat().st_size for f in files if Path(f).is_file())
+
+
+@contextmanager
+def stage(name):
+    """Records the code in a with block as a stage, see count. Stages can be nested.
+
+    Args:
+        name (str): The name of the stage.
+
+    Yields:
+        dict: The record of the stage, or None when recording is disabled.
+    """
+    if not ENABLED:
+        yield None
+        return
+
+    record = {"stage": name, "seconds": 0.0, "items": 0, "skipped": 0, "bytes_read": 0, "bytes_written": 0,
+              "peak_rss_mb": None}
+    stack = local.__dict__.setdefault("stack", [])
+    stack.append(record)
+
+    profiling = name == PROFILE_STAGE and not local.__dict__.get("profiling", False)
+    if profiling:
+        local.profiling = True
+        profiler.enable()
+
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["seconds"] = time.perf_counter() - start
+
+        if profiling:
+            profiler.disable()
+            local.profiling = False
+
+        record["peak_rss_mb"] = peak_rss_mb()
+        stack.pop()
+
+        with lock:
+            add(record)
+            if KEEP_CALLS:
+                RECORDS.append(record)
+
+
+def add(record):
+    """Adds the record of a call to the totals of its stage."""
+    totals = STAGES.get(record["stage"])
+    if totals is None:
+        totals = STAGES[record["stage"]] = {"stage": record["stage"], "calls": 0, "seconds": 0.0, "max_seconds": 0.0,
+                                            "items": 0, "skipped": 0, "bytes_read": 0, "bytes_written": 0,
+                                            "peak_rss_mb": None}
+
+    totals["calls"] += 1
+    totals["seconds"] += record["seconds"]
+    totals["max_seconds"] = max(totals["max_seconds"], record["seconds"])
+    for field in ["items", "skipped", "bytes_read", "bytes_written"]:
+        totals[field] += record[field]
+    if record["peak_rss_mb"] is not None:
+        totals["peak_rss_mb"] = max(totals["peak_rss_mb"] or 0, record["peak_rss_mb"])
+
+
+def timed(name):
+    """Decorates a function so that each of its calls is recorded as a stage.
+
+    Args:
+        name (str): The name of the stage.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return fn(*args, **kwargs)
+
+            with stage(name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def count(items=0, bytes_read=0, bytes_written=0, read=(), written=(), skipped=0):
+    """Adds to the counts of the innermost stage of this thread. Does nothing outside of a stage.
+
+    Args:
+        items (int, optional): The number of items processed, e.g. rows or plots. Defaults to 0.
+        bytes_read (int, optional): The number of bytes read. Defaults to 0.
+        bytes_written (int, optional): The number of bytes written. Defaults to 0.
+        read (list of str, optional): Files that were read, whose sizes are added to bytes_read. Defaults to ().
+        written (list of str, optional): Files that were written, whose sizes are added to bytes_written.
+            Defaults to ().
+        skipped (int, optional): The number of items left out, e.g. sampled rows without a full window. Defaults
+            to 0.
+    """
+    if not ENABLED or not local.__dict__.get("stack"):
+        return
+
+    record = local.stack[-1]
+    record["items"] += items
+    record["skipped"] += skipped
+    record["bytes_read"] += bytes_read + file_bytes(read)
+    record["bytes_written"] += bytes_written + file_bytes(written)
+
+
+def records():
+    """Returns one row per recorded call, in the order the calls finished. Calls are only kept after
+    enable(calls=True); otherwise the result is empty and summary has the totals."""
+    with lock:
+        return pd.DataFrame(list(RECORDS), columns=FIELDS)
+
+
+def summary():
+    """Returns one row per stage with its number of calls, total and slowest seconds, items, skipped items, bytes
+    and items per second, and the highest peak resident memory, slowest stage first."""
+    with lock:
+        stages = pd.DataFrame([dict(totals) for totals in STAGES.values()], columns=SUMMARY_FIELDS)
+
+    stages["items_per_second"] = stages["items"] / stages["seconds"].where(stages["seconds"] > 0)
+
+    return stages.sort_values("seconds", ascending=False).reset_index(drop=True)
+
+
+def profile_stats(sort="cumulative"):
+    """Returns the cProfile statistics of the profiled stage as pstats.Stats, or None if it was never called."""
+    if not profiler.getstats():
+        return None
+
+    return pstats.Stats(profiler).sort_stats(sort)
+
+
+def write_report(path):
+    """Writes the records to path. A ".csv" path gets the summary, one row per stage; any other path gets json with
+    the summary and the calls kept by enable(calls=True). The profile of the profiled stage, if any, is dumped next
+    to it with a ".prof" suffix, to be read with pstats or snakeviz.
+
+    Args:
+        path (str): The filepath of the report.
+    """
+    if Path(path).suffix == ".csv":
+        summary().to_csv(path, index=False)
+    else:
+        report = {
+            "summary": summary().to_dict(orient="records"),
+            "calls": records().to_dict(orient="records"),
+        }
+        with open(path, "w") as f:
+            json.dump(report, f, indent=1)
+
+    stats = profile_stats()
+    if stats is not None:
+        stats.dump_stats(Path(path).with_suffix(".prof"))
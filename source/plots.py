@@ -1,17 +1,39 @@
 """
 This script allows the user to randomly select a subset of buy indicators and non-buy indicators, 
 create line and OHLC plots, and convert the images to an h2o dataset. 
+
+matplotlib, mplfinance and PIL are imported by the functions that draw or read images, so modules that only sample
+signals or build datasets from pixels do not pay for importing them.
 """
 
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+import io
 from pathlib import Path
 import random
 import re
+import tempfile
 
-import matplotlib.pyplot as plt
-import mplfinance as mpf
 import numpy as np
 import pandas as pd
-from PIL import Image
+
+from source.cache import RenderCache
+from source import features
+from source import metrics
+from source import raster
+from source import store
+
+
+PLOT_TYPES = ("line", "candle")
+
+
+def group_keys(data, group_name):
+    """Returns the group of every row, from a column or an index level of data."""
+    if group_name in data.columns:
+        return data[group_name].to_numpy()
+
+    return data.index.get_level_values(group_name).to_numpy()
 
 
 def check_signals(data, group_name, col_name, value, n):
@@ -20,7 +42,7 @@ def check_signals(data, group_name, col_name, value, n):
 
     Args:
         data (pd.DataFrame): A DataFrame to subset. 
-        group_name (str): A grouping column in the DataFrame.
+        group_name (str): A grouping column (or index level) in the DataFrame.
         col_name (str): The column in the DataFrame that should be checked.
         value (any): The value to match.
         n (int): The minimum number of times the value can appear in the specified column.
@@ -28,7 +50,43 @@ def check_signals(data, group_name, col_name, value, n):
     Returns:
         pd.DataFrame: A subsetted pandas DataFrame. 
     """
-    return data.groupby(group_name).filter(lambda x: x[x[col_name] == value].shape[0] >= n)
+    codes, uniques = pd.factorize(group_keys(data, group_name), use_na_sentinel=False)
+    counts = np.bincount(codes[(data[col_name] == value).to_numpy()], minlength=len(uniques))
+
+    return data[counts[codes] >= n]
+
+
+def sample_mask(data, group_name, col_name, value, n, random_state=None):
+    """Randomly samples n rows with the specified value from every group that has at least n of them,
+        in one vectorized draw. This is check_signals followed by a groupby sample, without the copies.
+
+    Args:
+        data (pd.DataFrame): A DataFrame to sample from.
+        group_name (str): A grouping column (or index level, such as "firm") in the DataFrame.
+        col_name (str): The column in the DataFrame that should be sampled.
+        value (any): The value to sample from.
+        n (int): The number of rows to sample per group. Groups with fewer matching rows are not sampled.
+        random_state (int, optional): The seed for numpy's random number generator. Defaults to None.
+
+    Returns:
+        np.ndarray: A boolean array aligned to the rows of data, True for the sampled rows.
+    """
+    codes, uniques = pd.factorize(group_keys(data, group_name), use_na_sentinel=False)
+    eligible = np.flatnonzero((data[col_name] == value).to_numpy())
+    eligible_codes = codes[eligible]
+    counts = np.bincount(eligible_codes, minlength=len(uniques))
+
+    rng = np.random.default_rng(random_state)
+    order = np.lexsort((rng.random(len(eligible)), eligible_codes))
+    sorted_codes = eligible_codes[order]
+    group_start = np.searchsorted(sorted_codes, sorted_codes)
+    rank = np.arange(len(order)) - group_start
+
+    chosen = (rank < n) & (counts[sorted_codes] >= n)
+    mask = np.zeros(len(data), dtype=bool)
+    mask[eligible[order[chosen]]] = True
+
+    return mask
 
 
 def sample_signals(data, col_name, value, n, new_col_name, random_state=None):
@@ -46,34 +104,42 @@ def sample_signals(data, col_name, value, n, new_col_name, random_state=None):
     Returns:
         pd.DataFrame: A pandas DataFrame that contains an added column of boolean values.
     """
-    data['row_num'] = list(range(0, len(data.index)))
-    potential_choices = list(data['row_num'][data[col_name] == value])
+    potential_choices = list(np.flatnonzero((data[col_name] == value).to_numpy()))
 
     random.seed(random_state)
     sampled_choices = random.sample(potential_choices, k=n)
-    sampled_list = [True if i in sampled_choices else False for i in range(0, len(data.index))]
+    sampled_list = np.zeros(len(data.index), dtype=bool)
+    sampled_list[sampled_choices] = True
     data[new_col_name] = sampled_list
-    data.drop('row_num', axis=1, inplace=True)
 
     return data
 
 
 def sample_groups(data, group_name, col_name, value, n, new_col_name, random_state=None):
-    """Applies a a pandas groupby() function to the sample_signals() function.  
+    """Adds a column to a pandas DataFrame that contains a True value for n randomly sampled
+        values of every group, see sample_mask.
 
     Args:
         data (pd.DataFrame): A DataFrame to sample from.
-        group_name (str): A grouping column in the DataFrame.
+        group_name (str): A grouping column (or index level) in the DataFrame.
         col_name (str): The column in the DataFrame that should be sampled.
         value ([type]): The value to sample from. 
-        n ([type]): The minimum number of times the value can appear in the specified column.
+        n ([type]): The number of values to sample per group. Run check_signals first to drop groups with fewer.
         new_col_name (str): The name of the newly created column.
         random_state (int, optional): The seed for the random number generator. Defaults to None.
 
+    Raises:
+        ValueError: If a group has fewer than n values to sample from.
+
     Returns:
-        pd.DataFrame: A pandas DataFrame that contains an added column of boolean values.
+        pd.DataFrame: A copy of data that contains an added column of boolean values.
     """
-    return data.groupby(group_name).apply(sample_signals, col_name, value, n, new_col_name, random_state)
+    codes, uniques = pd.factorize(group_keys(data, group_name), use_na_sentinel=False)
+    counts = np.bincount(codes[(data[col_name] == value).to_numpy()], minlength=len(uniques))
+    if (counts < n).any():
+        raise ValueError(f'Sample larger than population for groups {list(uniques[counts < n])}')
+
+    return data.assign(**{new_col_name: sample_mask(data, group_name, col_name, value, n, random_state)})
 
 
 def create_line_plot(x, y):
@@ -86,6 +152,8 @@ def create_line_plot(x, y):
     Returns:
         List[Line2D]: A matplotlib line plot object.
     """
+    import matplotlib.pyplot as plt
+
     fig, ax = plt.subplots(figsize=(.3, .3))
     ax.scatter(x, y, marker='.')
     ax.axis('off')
@@ -101,10 +169,84 @@ def save_plot(fig, savepath):
         fig (any): A matplotlib plot object to be saved.
         savepath (str): A filepath to specify where the plot will be saved.
     """
+    import matplotlib.pyplot as plt
+
     fig.savefig(savepath, bbox_inches='tight', pad_inches=0)
     plt.close(fig)
 
 
+def plot_to_buffer(fig):
+    """Given a matplotlib plot object, saves the object as a JPEG to an in-memory buffer and closes the plot object.
+
+    Args:
+        fig (any): A matplotlib plot object to be saved.
+
+    Returns:
+        io.BytesIO: A buffer holding the same bytes that save_plot would write to a file.
+    """
+    import matplotlib.pyplot as plt
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='jpg', bbox_inches='tight', pad_inches=0)
+    plt.close(fig)
+    buffer.seek(0)
+
+    return buffer
+
+
+def save_array(img, savepath):
+    """Saves a grayscale pixel array, such as one drawn by the raster module, to an image file.
+
+    Args:
+        img (np.ndarray): A 2-D uint8 array.
+        savepath (str): A filepath to specify where the image will be saved.
+    """
+    from PIL import Image
+
+    Image.fromarray(img, mode='L').save(savepath)
+
+
+def encode_array(img):
+    """Encodes a grayscale pixel array as the JPEG file save_array writes for it.
+
+    Args:
+        img (np.ndarray): A 2-D uint8 array.
+
+    Returns:
+        io.BytesIO: The JPEG buffer.
+    """
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.fromarray(img, mode='L').save(buffer, format='JPEG')
+    buffer.seek(0)
+
+    return buffer
+
+
+def saved_pixels(img):
+    """Returns the grayscale pixels a plot drawn by render_window has once save_image writes it to a .jpg file
+    and build_h2o_dataset reads it back, without touching the disk.
+
+    Args:
+        img (io.BytesIO or np.ndarray): A JPEG buffer or a 2-D uint8 array.
+
+    Returns:
+        np.ndarray: A 2-D uint8 array.
+    """
+    return image_array(encode_array(img) if isinstance(img, np.ndarray) else img)
+
+
+@lru_cache(maxsize=None)
+def candle_style():
+    """Returns the mplfinance style with white up candles and grey down candles, built once per process."""
+    import mplfinance as mpf
+
+    mc = mpf.make_marketcolors(up='white', down='grey')
+
+    return mpf.make_mpf_style(marketcolors=mc)
+
+
 def create_candlestick_plot(data, file):
     """Creates a candlestick plot given open, high, low, close data and returns an image file stored in a 
     specified filepath.
@@ -116,42 +258,430 @@ def create_candlestick_plot(data, file):
     Returns:
         image file: An image file stored in a specified filepath.
     """
-    mc = mpf.make_marketcolors(up='white', down='grey')
-    s = mpf.make_mpf_style(marketcolors=mc)
+    import mplfinance as mpf
+
     fig = mpf.plot(data, type='candle', axisoff=True,
-                   style=s, figsize=(.3, .3), savefig=file)
+                   style=candle_style(), figsize=(.3, .3), savefig=file)
 
     return fig
 
 
-def flatten_image(image_path):
+def candlestick_to_buffer(data):
+    """Creates a candlestick plot like create_candlestick_plot, but saves the JPEG to an in-memory buffer.
+
+    Args:
+        data (pd.DataFrame): A pandas DataFrame that contains columns called "open", "high", "low", and "close".
+
+    Returns:
+        io.BytesIO: A buffer holding the same bytes that create_candlestick_plot would write to a file.
     """
-    Converts the image file at image_path to a 1-D numpy array
+    buffer = io.BytesIO()
+    create_candlestick_plot(data, dict(fname=buffer, format='jpg'))
+    buffer.seek(0)
+
+    return buffer
+
+
+@metrics.timed("decode_image")
+def image_array(image_path):
+    """
+    Converts the image file (or in-memory buffer) at image_path to a 2-D uint8 numpy array
 
     The array is a grayscale version of the image
     """
+    metrics.count(items=1, read=[image_path] if isinstance(image_path, (str, Path)) else ())
+    from PIL import Image
+
     with Image.open(image_path).convert('L') as img:
-        return np.array(img.getdata())
+        return np.asarray(img, dtype=np.uint8)
 
 
-def build_h2o_dataset(image_files, labels):
+def flatten_image(image_path):
+    """
+    Converts the image file (or in-memory buffer) at image_path to a 1-D uint8 numpy array
+
+    The array is a grayscale version of the image
+    """
+    return image_array(image_path).ravel()
+
+
+def build_h2o_dataset(image_files, labels, names=None):
     """
     Returns a DataFrame where the first column is the label and
     subsequent colums are the elements of the flattened image
+
+    The images are read into a single preallocated uint8 array, see pixels_to_dataset
+    """
+    imgs = None
+
+    for row, f in enumerate(image_files):
+        pixels = flatten_image(f)
+        if imgs is None:
+            imgs = np.empty((len(image_files), pixels.size), dtype=np.uint8)
+        imgs[row] = pixels
+
+    if imgs is None:
+        imgs = np.empty((0, 0), dtype=np.uint8)
+
+    return pixels_to_dataset(imgs, labels, names)
+
+
+def pixels_to_dataset(imgs, labels, names=None):
+    """
+    Returns a DataFrame where the first column is the label and
+    subsequent colums are the pixels, given one flattened image per row of imgs
+
+    The pixels are kept as uint8 and the label as int8 (when it fits), and the optional names
+    become a categorical "name" column, so each image takes one byte per pixel
+    in memory and in the parquet schema
     """
-    imgs = [flatten_image(f) for f in image_files]
-    imgs = np.row_stack(imgs)
     _, num_features = imgs.shape
+    column_names = [f"pixel_{i}" for i in range(num_features)]
 
-    labels = np.array(labels).astype('int')
+    results = pd.DataFrame(np.asarray(imgs, dtype=np.uint8), columns=column_names, copy=False)
+    labels = np.asarray(labels, dtype='int')
+    if labels.size == 0 or (labels.min() >= -128 and labels.max() <= 127):
+        labels = labels.astype(np.int8)
+    results.insert(0, "label", labels)
 
-    results = np.column_stack([labels, imgs])
-    column_names = ["label"] + [f"pixel_{i}" for i in range(num_features)]
+    if names is not None:
+        results["name"] = pd.Categorical(names)
 
-    return pd.DataFrame(results, columns=column_names)
+    return results
     
 
-def plot_sampled(data, sampled_col, indicator, signal, window_size, dir_path, plot_var, plot_type):
+@metrics.timed("save_image")
+def save_image(img, savepath):
+    """Saves a plot drawn by render_window to an image file.
+
+    Args:
+        img (io.BytesIO or np.ndarray): A JPEG buffer or a 2-D uint8 array.
+        savepath (str): A filepath to specify where the image will be saved.
+    """
+    if isinstance(img, np.ndarray):
+        save_array(img, savepath)
+    else:
+        Path(savepath).write_bytes(img.getvalue())
+
+    metrics.count(items=1, written=[savepath])
+
+
+def window_positions(data, sampled_col, window_size):
+    """Finds the row positions of the window that ends at every sampled row, without iterating over the frame.
+
+    Rows are grouped by firm (keeping their order within each firm), so a window never spans two firms.
+    Sampled rows with fewer than window_size - 1 prior rows for their firm are skipped; their number is printed
+    and added to the skipped count of the current metrics stage.
+
+    Args:
+        data (pd.DataFrame): A pandas DataFrame where "time" and "firm" are a MultiIndex.
+        sampled_col (str): A column of boolean values in the pandas DataFrame, where only True values will be plotted.
+        window_size (int): The number of rows in each window, ending with the sampled row.
+
+    Returns:
+        np.ndarray: An integer array of shape (n_windows, window_size) with positions in data, with the
+        windows in the order their sampled rows appear in data.
+    """
+    order, _, rank = features.firm_segments(data)
+
+    sampled = data[sampled_col].fillna(False).to_numpy(dtype=bool)[order]
+    ends = np.flatnonzero(sampled & (rank >= window_size - 1))
+    ends = ends[np.argsort(order[ends], kind="stable")]
+
+    skipped = int(sampled.sum()) - len(ends)
+    if skipped:
+        print(f'Skipped {skipped} sampled rows with fewer than {window_size - 1} prior rows for their firm.')
+        metrics.count(skipped=skipped)
+
+    return order[ends[:, None] + np.arange(1 - window_size, 1)]
+
+
+def extract_windows(data, sampled_col, window_size, columns=("open", "high", "low", "close")):
+    """Slices the window of prior rows for every sampled row into a compact array.
+
+    Args:
+        data (pd.DataFrame): A pandas DataFrame where "time" and "firm" are a MultiIndex.
+        sampled_col (str): A column of boolean values in the pandas DataFrame, where only True values will be plotted.
+        window_size (int): The number of rows in each window, ending with the sampled row.
+        columns (list of str, optional): The columns to extract. Defaults to open, high, low and close.
+
+    Returns:
+        tuple: A float array of shape (n_windows, window_size, len(columns)), a datetime64 array of shape
+        (n_windows, window_size) with the time of each row, and a pandas DataFrame with the "firm", the "start"
+        and end "time" and the "row" position of the sampled row for each window. See window_positions.
+    """
+    positions = window_positions(data, sampled_col, window_size)
+    time = data.index.get_level_values("time")
+
+    windows = np.stack([data[col].to_numpy(dtype=float)[positions] for col in columns], axis=-1)
+    times = time.values[positions]
+    meta = pd.DataFrame({
+        "firm": data.index.get_level_values("firm")[positions[:, -1]],
+        "start": time[positions[:, 0]],
+        "time": time[positions[:, -1]],
+        "row": positions[:, -1],
+    })
+
+    return windows, times, meta
+
+
+def window_filename(dir_path, firm, indicator, signal, start):
+    """Returns the filename, without the plot type suffix, of the plot of a window that begins at start."""
+    return f'{dir_path}/{firm}_{indicator}_{signal}_{start.strftime("%Y-%m-%d")}'
+
+
+def sampled_windows(data, sampled_col, indicator, signal, window_size, dir_path):
+    """Finds the window of prior rows for every sampled row and the filename its plot is saved under.
+
+    Args:
+        data (pd.DataFrame): A pandas DataFrame where "time" and "firm" are a MultiIndex.
+        sampled_col (str): A column of boolean values in the pandas DataFrame, where only True values will be plotted.
+        indicator (str): The indicator being plotted, to be used in the naming of the file.
+        signal (str): The signal to be used when naming the plot: "buy"  or "nobuy".
+        window_size (int): The number of rows in each window, ending with the sampled row. See window_positions.
+        dir_path (str): The directory to save the files.
+
+    Yields:
+        tuple: The filename without the plot type suffix and the window as a pandas DataFrame.
+    """
+    for positions in window_positions(data, sampled_col, window_size):
+        window = data.iloc[positions]
+        firm = window.index.get_level_values("firm")[0]
+        start = window.index.get_level_values("time")[0]
+
+        yield window_filename(dir_path, firm, indicator, signal, start), window
+
+
+@metrics.timed("render_window")
+def render_window(window, plot_var, plot_type, engine="matplotlib"):
+    """Draws a window in memory. The matplotlib engine returns the encoded JPEG and the numpy engine
+    returns the pixels drawn by the raster module.
+
+    Args:
+        window (pd.DataFrame): The rows to be plotted, with "time" and "firm" as a MultiIndex.
+        plot_var (str): The column name of the values to be plotted.
+        plot_type (str): The type of plot to make: "line" or "candle".
+        engine (str, optional): The library used to draw the plot: "matplotlib" or "numpy". Defaults to "matplotlib".
+
+    Returns:
+        io.BytesIO or np.ndarray: A JPEG buffer for the matplotlib engine or a 2-D uint8 array for the numpy engine.
+    """
+    if plot_type == "line" and engine == "numpy":
+        return raster.line_array(window.index.get_level_values("time"), window[plot_var])
+
+    elif plot_type == "line":
+        return plot_to_buffer(create_line_plot(window.index.get_level_values("time"), window[plot_var]))
+
+    elif plot_type == "candle" and engine == "numpy":
+        return raster.candle_array(window)
+
+    elif plot_type == "candle":
+        return candlestick_to_buffer(window.reset_index(level="firm", drop=True))
+
+    check_plot_type(plot_type)
+
+
+def check_plot_type(plot_type):
+    """Raises a ValueError unless plot_type is one of PLOT_TYPES."""
+    if plot_type not in PLOT_TYPES:
+        raise ValueError(f"Unknown plot_type {plot_type!r}, expected one of {PLOT_TYPES}")
+
+
+def window_key(window, plot_var, plot_type, engine):
+    """Returns the cache.RenderCache key of a window, from the values it plots and its dates."""
+    columns = [plot_var] if plot_type == "line" else ["open", "high", "low", "close"]
+
+    return RenderCache.key(window[columns].to_numpy(dtype=float), window.index.get_level_values("time").values,
+                           plot_type, engine)
+
+
+def render_cached(window, plot_var, plot_type, engine, cache, savepath=None):
+    """Draws a window with render_window unless it is already in the cache.
+
+    The cache keeps the plot as render_window drew it (the JPEG bytes of a matplotlib plot or the pixels of a
+    raster plot), so the saved image and the returned pixels are the same whether or not the plot was cached.
+    The pixels are those of the saved image, see saved_pixels.
+
+    Args:
+        cache (cache.RenderCache): The cache of rendered plots.
+        savepath (str, optional): A filepath to save the image to. Defaults to None, which does not save the image.
+        See render_window for the other arguments.
+
+    Returns:
+        np.ndarray: A 2-D uint8 array of grayscale pixels.
+    """
+    key = window_key(window, plot_var, plot_type, engine)
+    plot = cache.get(key)
+
+    if plot is None:
+        img = render_window(window, plot_var, plot_type, engine)
+        plot = img if isinstance(img, np.ndarray) else img.getvalue()
+        cache.put(key, plot)
+
+    img = plot if isinstance(plot, np.ndarray) else io.BytesIO(plot)
+    if savepath is not None:
+        save_image(img, savepath)
+
+    return saved_pixels(img)
+
+
+def render_shard(windows, plot_var, plot_type, engine="matplotlib", save_images=False, keep_pixels=True, cache=None):
+    """Draws a list of windows, typically all of the sampled windows of one firm. This runs inside the
+    worker processes of a parallel plot_sampled or render_sampled.
+
+    Args:
+        windows (list): Tuples of the window's position in the serial run, its filename and the window.
+        plot_var (str): The column name of the values to be plotted.
+        plot_type (str): The type of plot to make: "line" or "candle".
+        engine (str, optional): The library used to draw the plots: "matplotlib" or "numpy". Defaults to "matplotlib".
+        save_images (bool, optional): Should the images be saved to their filepaths? Defaults to False.
+        keep_pixels (bool, optional): Should the flattened pixels be returned? Defaults to True.
+        cache (cache.RenderCache, optional): A cache of rendered plots, see render_cached. Defaults to None.
+
+    Returns:
+        list: Tuples of the window's position, the absolute filepath of the image and its pixels (or None).
+    """
+    results = []
+
+    for order, filename, window in windows:
+        savepath = f'{filename}_{plot_type}.jpg'
+
+        if cache is not None:
+            pixels = render_cached(window, plot_var, plot_type, engine, cache, savepath if save_images else None)
+            results.append((order, Path(savepath).absolute().as_posix(), pixels.ravel() if keep_pixels else None))
+            continue
+
+        img = render_window(window, plot_var, plot_type, engine)
+
+        if save_images:
+            save_image(img, savepath)
+
+        pixels = None
+        if keep_pixels:
+            pixels = saved_pixels(img).ravel()
+
+        results.append((order, Path(savepath).absolute().as_posix(), pixels))
+
+    return results
+
+
+def render_worker(windows, cache=None, started=None, **kwargs):
+    """Runs render_shard in a worker process.
+
+    Args:
+        started (str, optional): A file to create before drawing, so the parent process knows which firms were
+            being drawn if the worker dies. Defaults to None.
+        See render_shard for the other arguments.
+
+    Returns:
+        tuple: The render_shard results and the usage of the worker's copy of the cache (or None), which the
+        parent process merges into its own cache.
+    """
+    if started is not None:
+        Path(started).touch()
+
+    results = render_shard(windows, cache=cache, **kwargs)
+
+    return results, cache.usage() if cache is not None else None
+
+
+def shard_by_firm(data, sampled_col, indicator, signal, window_size, dir_path):
+    """Groups the sampled windows by the firm of the sampled row, remembering the order of the serial run.
+
+    Returns:
+        dict: Lists of (position, filename, window) tuples keyed by firm. See sampled_windows for the arguments.
+    """
+    shards = {}
+    windows = sampled_windows(data, sampled_col, indicator, signal, window_size, dir_path)
+
+    for order, (filename, window) in enumerate(windows):
+        firm = window.index.get_level_values("firm")[-1]
+        shards.setdefault(firm, []).append((order, filename, window))
+
+    return shards
+
+
+def map_shards(shards, n_jobs, progress=False, **kwargs):
+    """Runs render_shard for every firm in a pool of worker processes.
+
+    A firm whose plots raise an error is reported and skipped. If a worker process dies, the firms that were
+    being drawn at the time are retried one at a time in their own process, so that only the firm that
+    crashed is lost, and the firms that had not started yet go to a new pool of n_jobs workers. The workers'
+    cache hits, misses and writes are merged into the cache passed in kwargs, which also enforces its size
+    limit for every process.
+
+    Args:
+        shards (dict): Lists of windows keyed by firm, as returned by shard_by_firm.
+        n_jobs (int): The number of worker processes.
+        progress (bool, optional): Should a line be printed as each firm finishes? Defaults to False.
+        **kwargs: Passed on to render_shard.
+
+    Returns:
+        tuple: The render_shard results keyed by firm and the errors keyed by the firms that failed.
+    """
+    results = {}
+    failed = {}
+    cache = kwargs.get("cache")
+
+    def collect(firm, future):
+        try:
+            results[firm], usage = future.result()
+        except BrokenProcessPool:
+            raise
+        except Exception as e:
+            print(f'Unexpected error: {e}')
+            print(f'Plots for {firm} not created.')
+            failed[firm] = e
+            return
+
+        if usage is not None:
+            cache.merge(usage)
+
+    def report(firm):
+        if progress:
+            print(f'{len(results) + len(failed)}/{len(shards)} firms rendered ({firm})')
+
+    pending = list(shards)
+
+    while pending:
+        broken = []
+
+        with tempfile.TemporaryDirectory() as started_dir, ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            started = {firm: f'{started_dir}/{i}' for i, firm in enumerate(pending)}
+            futures = {pool.submit(render_worker, shards[firm], started=started[firm], **kwargs): firm
+                       for firm in pending}
+
+            for future in as_completed(futures):
+                firm = futures[future]
+                try:
+                    collect(firm, future)
+                except BrokenProcessPool:
+                    broken.append(firm)
+                    continue
+
+                report(firm)
+
+            suspects = [firm for firm in broken if Path(started[firm]).exists()] or broken
+
+        for firm in suspects:
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                try:
+                    collect(firm, pool.submit(render_worker, shards[firm], **kwargs))
+                except BrokenProcessPool as e:
+                    print(f'Unexpected error: {e}')
+                    print(f'Plots for {firm} not created.')
+                    failed[firm] = e
+
+            report(firm)
+
+        pending = [firm for firm in broken if firm not in suspects]
+
+    return results, failed
+
+
+@metrics.timed("plot_sampled")
+def plot_sampled(data, sampled_col, indicator, signal, window_size, dir_path, plot_var, plot_type, engine="matplotlib",
+                 n_jobs=1, progress=False, cache=None):
     """Given a pandas DataFrame where "time" is a MultiIndex and a specified column, creates a line plot and candlestick
     plot for a specified window size. The plots are then saved to a filepath and the plot
     objects are closed.
@@ -165,18 +695,149 @@ def plot_sampled(data, sampled_col, indicator, signal, window_size, dir_path, pl
         dir_path (str): The directory to save the files.
         plot_var (str): The column name of the values to be plotted.
         plot_type (str): The type of plot to make: "line" or "candle".
+        engine (str, optional): The library used to draw the plots: "matplotlib" (with mplfinance for candles)
+            or "numpy", which draws the pixels directly with the raster module. Defaults to "matplotlib".
+        n_jobs (int, optional): The number of worker processes. With more than one, the sampled windows are
+            split by firm and drawn in parallel. Defaults to 1.
+        progress (bool, optional): Should a line be printed as each firm finishes when n_jobs > 1? Defaults to False.
+        cache (cache.RenderCache, optional): A cache of rendered plots. Plots found in it are not drawn again, but
+            saved as they were drawn, see render_cached. Defaults to None.
+
+    Returns:
+        list: The firms whose plots could not be created when n_jobs > 1. A serial run raises the error instead.
+    """
+    if n_jobs > 1:
+        shards = shard_by_firm(data, sampled_col, indicator, signal, window_size, dir_path)
+        results, failed = map_shards(shards, n_jobs, progress, plot_var=plot_var, plot_type=plot_type, engine=engine,
+                                     save_images=True, keep_pixels=False, cache=cache)
+        metrics.count(items=sum(len(shard) for shard in results.values()))
+
+        return list(failed)
+
+    for filename, window in sampled_windows(data, sampled_col, indicator, signal, window_size, dir_path):
+        if cache is not None:
+            render_cached(window, plot_var, plot_type, engine, cache, f'{filename}_{plot_type}.jpg')
+        else:
+            save_image(render_window(window, plot_var, plot_type, engine), f'{filename}_{plot_type}.jpg')
+        metrics.count(items=1)
+
+    return []
+
+
+def render_sampled_arrays(data, sampled_col, indicator, signal, window_size, dir_path, plot_var, plot_type,
+                          save_images=False, cache=None):
+    """Draws every sampled window at once with the raster module. See render_sampled for the arguments
+    and return values.
     """
-    for idx, window in enumerate(data.rolling(window=window_size)):
-        if data[sampled_col][idx] == True: 
-            filename = f'{dir_path}/{window.index.get_level_values("firm")[0]}_{indicator}_{signal}_{window.index.get_level_values("time")[0].strftime("%Y-%m-%d")}'
+    check_plot_type(plot_type)
 
-            if plot_type == "line":
-                line_plot = create_line_plot(window.index.get_level_values("time"), window[plot_var])
-                save_plot(line_plot, f'{filename}_line.jpg')
+    columns = [plot_var] if plot_type == "line" else ["open", "high", "low", "close"]
+    windows, times, meta = extract_windows(data, sampled_col, window_size, columns)
 
-            elif plot_type == "candle":
-                candle_plot = create_candlestick_plot(window.reset_index(level="firm", drop=True), f'{filename}_candle.jpg')
-                plt.close(candle_plot)
+    def draw(rows):
+        if plot_type == "line":
+            return raster.line_arrays(times[rows], windows[rows, :, 0])
+
+        return raster.candle_arrays(windows[rows])
+
+    if cache is None:
+        imgs = draw(slice(None))
+    else:
+        keys = [RenderCache.key(window, time, plot_type, "numpy") for window, time in zip(windows, times)]
+        cached = [cache.get(key) for key in keys]
+        missing = [row for row, pixels in enumerate(cached) if pixels is None]
+        drawn = draw(missing) if missing else []
+
+        imgs = np.empty((len(keys),) + (raster.LINE_SHAPE if plot_type == "line" else raster.CANDLE_SHAPE),
+                        dtype=np.uint8)
+        for row, pixels in enumerate(cached):
+            if pixels is not None:
+                imgs[row] = pixels
+        for row, pixels in zip(missing, drawn):
+            imgs[row] = pixels
+            cache.put(keys[row], pixels)
+
+    names = []
+    pixels = np.empty((len(imgs), imgs[0].size if len(imgs) else 0), dtype=np.uint8)
+    for row, (img, firm, start) in enumerate(zip(imgs, meta["firm"], meta["start"])):
+        savepath = f'{window_filename(dir_path, firm, indicator, signal, start)}_{plot_type}.jpg'
+        names.append(Path(savepath).absolute().as_posix())
+        pixels[row] = saved_pixels(img).ravel()
+
+        if save_images:
+            save_array(img, savepath)
+
+    return pixels, names
+
+
+def render_sampled(data, sampled_col, indicator, signal, window_size, dir_path, plot_var, plot_type,
+                   engine="matplotlib", save_images=False, n_jobs=1, progress=False, cache=None):
+    """The in-memory counterpart of plot_sampled: draws the same plots, but keeps their grayscale pixels
+    in a preallocated array instead of writing image files. The pixels are JPEG encoded and decoded in
+    memory (see saved_pixels), so they are the pixels build_h2o_dataset reads from the saved images.
+
+    Args:
+        data (pd.DataFrame): A pandas DataFrame containing the data to be plotted.
+        sampled_col (str): A column of boolean values in the pandas DataFrame, where only True values will be plotted.
+        indicator (str): The indicator being plotted, to be used in the naming of the file.
+        signal (str): The signal to be used when naming the plot: "buy"  or "nobuy".
+        window_size (int): The number of prior rows to be used in the pd.DataFrame.rolling method.
+        dir_path (str): The directory plot_sampled would save the files to, used to name each image.
+        plot_var (str): The column name of the values to be plotted.
+        plot_type (str): The type of plot to make: "line" or "candle".
+        engine (str, optional): The library used to draw the plots: "matplotlib" or "numpy". Defaults to "matplotlib".
+        save_images (bool, optional): Should the images also be saved to dir_path for inspection? Defaults to False.
+        n_jobs (int, optional): The number of worker processes, see plot_sampled. Defaults to 1.
+        progress (bool, optional): Should a line be printed as each firm finishes when n_jobs > 1? Defaults to False.
+        cache (cache.RenderCache, optional): A cache of rendered plots. Plots found in it are not drawn again.
+            Defaults to None.
+
+    Returns:
+        tuple: A 2-D uint8 array with one flattened image per row, and a list with the absolute filepath
+        each image has (or would have) on disk. Rows are in the order of a serial run; the rows of firms
+        that failed in a parallel run are left out.
+    """
+    if n_jobs > 1:
+        shards = shard_by_firm(data, sampled_col, indicator, signal, window_size, dir_path)
+        results, _ = map_shards(shards, n_jobs, progress, plot_var=plot_var, plot_type=plot_type, engine=engine,
+                                save_images=save_images, cache=cache)
+        rendered = sorted(item for shard in results.values() for item in shard)
+
+        imgs = np.empty((len(rendered), rendered[0][2].size if rendered else 0), dtype=np.uint8)
+        for row, (_, _, pixels) in enumerate(rendered):
+            imgs[row] = pixels
+
+        return imgs, [name for _, name, _ in rendered]
+
+    if engine == "numpy":
+        return render_sampled_arrays(data, sampled_col, indicator, signal, window_size, dir_path, plot_var, plot_type,
+                                     save_images, cache)
+
+    n = int(data[sampled_col].fillna(False).sum())
+    imgs = None
+    names = []
+
+    for filename, window in sampled_windows(data, sampled_col, indicator, signal, window_size, dir_path):
+        savepath = f'{filename}_{plot_type}.jpg'
+
+        if cache is not None:
+            pixels = render_cached(window, plot_var, plot_type, engine, cache, savepath if save_images else None).ravel()
+        else:
+            img = render_window(window, plot_var, plot_type, engine)
+            if save_images:
+                save_image(img, savepath)
+            pixels = saved_pixels(img).ravel()
+
+        if imgs is None:
+            imgs = np.empty((n, pixels.size), dtype=np.uint8)
+
+        imgs[len(names)] = pixels
+        names.append(Path(savepath).absolute().as_posix())
+
+    if imgs is None:
+        imgs = np.empty((0, 0), dtype=np.uint8)
+
+    return imgs[:len(names)], names
 
 
 def list_files(dir_path):
@@ -200,6 +861,7 @@ def clear_files(dir_path):
     [f.unlink() for f in p.glob("[!.]*") if f.is_file()] 
 
 
+@metrics.timed("build_h2o_del_dir")
 def build_h2o_del_dir(dir_path, save_path, clear_dir=False):
     """Builds an h2o DataFrame and removes all files from the directory.
 
@@ -215,10 +877,54 @@ def build_h2o_del_dir(dir_path, save_path, clear_dir=False):
     else:
         signal = 1
 
-    h2o_df = build_h2o_dataset(list_of_files, [signal]*len(list_of_files))
-    h2o_df["name"] = list_of_files
+    h2o_df = build_h2o_dataset(list_of_files, [signal]*len(list_of_files), list_of_files)
 
     h2o_df.to_parquet(save_path)
+    metrics.count(items=len(list_of_files), read=list_of_files, written=[save_path])
 
     if clear_dir:
         clear_files(dir_path) 
+
+
+def build_h2o_sampled(data, sampled_col, indicator, signal, window_size, dir_path, plot_var, plot_type, save_path,
+                      engine="matplotlib", save_images=False, n_jobs=1, progress=False, cache=None):
+    """Builds the same h2o DataFrame as plot_sampled followed by build_h2o_del_dir, for either engine,
+    without writing, re-reading and deleting an image file for every plot.
+
+    Args:
+        data (pd.DataFrame): A pandas DataFrame containing the data to be plotted.
+        sampled_col (str): A column of boolean values in the pandas DataFrame, where only True values will be plotted.
+        indicator (str): The indicator being plotted, to be used in the naming of the file.
+        signal (str): The signal to be used when naming the plot: "buy"  or "nobuy".
+        window_size (int): The number of prior rows to be used in the pd.DataFrame.rolling method.
+        dir_path (str): The directory used to name each image, and to save them to if save_images is True.
+        plot_var (str): The column name of the values to be plotted.
+        plot_type (str): The type of plot to make: "line" or "candle".
+        save_path (str): The filepath of the parquet file.
+        engine (str, optional): The library used to draw the plots: "matplotlib" or "numpy". Defaults to "matplotlib".
+        save_images (bool, optional): Should the images also be saved to dir_path for inspection? Defaults to False.
+        n_jobs (int, optional): The number of worker processes, see plot_sampled. Defaults to 1.
+        progress (bool, optional): Should a line be printed as each firm finishes when n_jobs > 1? Defaults to False.
+        cache (cache.RenderCache, optional): A cache of rendered plots, see render_sampled. Defaults to None.
+    """
+    imgs, names = render_sampled(data, sampled_col, indicator, signal, window_size, dir_path, plot_var, plot_type,
+                                 engine, save_images, n_jobs, progress, cache)
+
+    h2o_df = pixels_to_dataset(imgs, [0 if signal == "nobuy" else 1]*len(names), names)
+
+    h2o_df.to_parquet(save_path)
+
+
+def build_store_sampled(data, sampled_col, indicator, signal, window_size, dir_path, plot_var, plot_type, save_dir,
+                        engine="matplotlib", save_images=False, n_jobs=1, progress=False, cache=None):
+    """Like build_h2o_sampled, but writes the images to a memory-mapped store (see source.store) instead of a
+    parquet file, so they can be loaded for training without parsing one column per pixel.
+
+    Args:
+        save_dir (str): The directory of the store.
+        See build_h2o_sampled for the other arguments.
+    """
+    imgs, names = render_sampled(data, sampled_col, indicator, signal, window_size, dir_path, plot_var, plot_type,
+                                 engine, save_images, n_jobs, progress, cache)
+
+    store.write_store(save_dir, imgs, [0 if signal == "nobuy" else 1]*len(names), names)
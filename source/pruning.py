@@ -0,0 +1,201 @@
+"""
+This script allows the user to drop the pixel columns that carry no information before training.
+
+The plots are small grayscale charts that are mostly background, so many pixel_i columns are constant or nearly
+constant across the dataset. A pixel index is built by scanning the pixels in batches (from arrays, a store or
+parquet files) and keeping the columns whose variance is above a threshold, optionally followed by a PCA of the
+kept columns. The index is saved as a .npz file and applied in the same way to the training data and to the
+windows scored by scoring.Scorer.
+"""
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from source import store
+
+
+class PixelStats:
+    """Accumulates the mean and variance of every pixel column, and optionally the covariance of a subset of the
+    columns, one batch of images at a time.
+
+    Args:
+        n_pixels (int): The number of pixel columns.
+        columns (np.ndarray, optional): The columns whose covariance is accumulated, for a PCA. Defaults to None.
+    """
+
+    def __init__(self, n_pixels, columns=None):
+        self.n = 0
+        self.sum = np.zeros(n_pixels)
+        self.sum_sq = np.zeros(n_pixels)
+        self.columns = columns
+        self.cross = np.zeros((len(columns), len(columns))) if columns is not None else None
+
+    def update(self, imgs):
+        """Adds a 2-D array with one flattened image per row."""
+        imgs = np.asarray(imgs, dtype=np.float64)
+        self.n += len(imgs)
+        self.sum += imgs.sum(axis=0)
+        self.sum_sq += np.square(imgs).sum(axis=0)
+
+        if self.columns is not None:
+            kept = imgs[:, self.columns]
+            self.cross += kept.T @ kept
+
+    def mean(self):
+        return self.sum / max(self.n, 1)
+
+    def variance(self):
+        return np.maximum(self.sum_sq / max(self.n, 1) - np.square(self.mean()), 0)
+
+    def covariance(self):
+        mean = self.mean()[self.columns]
+        return self.cross / max(self.n, 1) - np.outer(mean, mean)
+
+
+def iter_arrays(imgs, batch_size=1024):
+    """Splits a 2-D array with one flattened image per row, e.g. a store's memmap, into batches."""
+    for i in range(0, len(imgs), batch_size):
+        yield imgs[i:i + batch_size]
+
+
+def iter_parquet(*files, batch_size=1024):
+    """Reads the pixel columns of parquet files written by plots.build_h2o_del_dir (or datasets.build_h2o_shards)
+    batch_size rows at a time.
+
+    Yields:
+        np.ndarray: A 2-D uint8 array with one flattened image per row.
+    """
+    for file in files:
+        parquet_file = pq.ParquetFile(file)
+        columns = [name for name in parquet_file.schema_arrow.names if name.startswith("pixel_")]
+
+        for batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+            yield np.column_stack([col.to_numpy(zero_copy_only=False) for col in batch.columns]).astype(np.uint8)
+
+
+def iter_stores(*save_dirs, batch_size=1024):
+    """Reads the pixels of memory-mapped stores (see source.store) batch_size rows at a time."""
+    for save_dir in save_dirs:
+        for imgs, _ in store.iter_batches(save_dir, batch_size):
+            yield imgs
+
+
+def scan(batches, n_pixels=None, columns=None):
+    """Computes the PixelStats of a stream of pixel batches, e.g. from iter_parquet or iter_stores.
+
+    Args:
+        batches (iterable of np.ndarray): 2-D arrays with one flattened image per row.
+        n_pixels (int, optional): The number of pixel columns. Defaults to None, the width of the first batch.
+        columns (np.ndarray, optional): The columns whose covariance is accumulated. Defaults to None.
+
+    Returns:
+        PixelStats: The statistics of every batch.
+    """
+    stats = None
+
+    for imgs in batches:
+        if stats is None:
+            stats = PixelStats(n_pixels or imgs.shape[1], columns)
+        stats.update(imgs)
+
+    return stats if stats is not None else PixelStats(n_pixels or 0, columns)
+
+
+def build_index(batches, threshold=1.0, n_components=None):
+    """Builds a pixel index: the columns whose variance is above the threshold and, optionally, the principal
+    components of those columns.
+
+    Args:
+        batches (function): Returns a new iterable of pixel batches each time it is called, e.g.
+            lambda: iter_parquet(*files). It is called once, or twice when n_components is given.
+        threshold (float, optional): The smallest variance of a kept column, in squared gray levels. Defaults to
+            1.0, which drops the columns that are (nearly) the same in every image.
+        n_components (int, optional): The number of principal components to keep. Defaults to None, no PCA.
+
+    Returns:
+        dict: The "columns" kept (positions of pixel_i columns), the number of "n_pixels", the "threshold", and
+        the "mean" and "components" of the PCA (None without a PCA).
+    """
+    stats = scan(batches())
+    columns = np.flatnonzero(stats.variance() > threshold)
+    index = {"columns": columns, "n_pixels": len(stats.sum), "threshold": threshold, "mean": None, "components": None}
+
+    if n_components is not None and len(columns):
+        pca_stats = scan(batches(), len(stats.sum), columns)
+        values, vectors = np.linalg.eigh(pca_stats.covariance())
+        top = np.argsort(values)[::-1][:n_components]
+        index["mean"] = stats.mean()[columns]
+        index["components"] = vectors[:, top].T
+
+    return index
+
+
+def save_index(path, index):
+    """Saves a pixel index to a .npz file."""
+    arrays = {key: np.asarray(value) for key, value in index.items() if value is not None}
+    np.savez(path, **arrays)
+
+
+def load_index(path):
+    """Loads a pixel index saved by save_index."""
+    with np.load(path) as f:
+        return {
+            "columns": f["columns"],
+            "n_pixels": int(f["n_pixels"]),
+            "threshold": float(f["threshold"]),
+            "mean": f["mean"] if "mean" in f else None,
+            "components": f["components"] if "components" in f else None,
+        }
+
+
+def column_names(index):
+    """Returns the names of the predictors an index produces: the kept pixel_i columns, or pc_0, pc_1, ..."""
+    if index["components"] is not None:
+        return [f"pc_{i}" for i in range(len(index["components"]))]
+
+    return [f"pixel_{i}" for i in index["columns"]]
+
+
+def apply_index(imgs, index):
+    """Reduces a 2-D array with one flattened image per row to the predictors of an index.
+
+    Returns:
+        np.ndarray: The kept uint8 pixels, or the float32 principal component scores.
+    """
+    kept = np.asarray(imgs)[:, index["columns"]]
+
+    if index["components"] is None:
+        return kept
+
+    return ((kept - index["mean"]) @ index["components"].T).astype(np.float32)
+
+
+def apply_index_to_dataset(df, index):
+    """Reduces a DataFrame built by plots.build_h2o_dataset (or read from its parquet files) to the label, the
+    predictors of an index and the name, keeping the other columns where they were."""
+    pixel_columns = [f"pixel_{i}" for i in range(index["n_pixels"])]
+    reduced = pd.DataFrame(apply_index(df[pixel_columns].to_numpy(), index), columns=column_names(index),
+                           index=df.index)
+
+    first = df.columns.get_loc(pixel_columns[0])
+    before = [col for col in df.columns[:first] if not col.startswith("pixel_")]
+    after = [col for col in df.columns[first:] if not col.startswith("pixel_")]
+
+    return pd.concat([df[before], reduced, df[after]], axis=1)
+
+
+def describe(index):
+    """Summarises how many pixel columns an index drops, e.g. to estimate the training time it saves.
+
+    Returns:
+        dict: The number of "pixels", "kept" columns and "predictors", and the "fraction_dropped" of predictors.
+    """
+    predictors = len(column_names(index))
+
+    return {
+        "pixels": index["n_pixels"],
+        "kept": len(index["columns"]),
+        "predictors": predictors,
+        "fraction_dropped": 1 - predictors / index["n_pixels"] if index["n_pixels"] else 0.0,
+    }
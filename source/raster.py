@@ -0,0 +1,307 @@
+"""
+This script allows the user to draw line plots and candlestick plots straight into grayscale pixel arrays with NumPy.
+
+The arrays mimic the images produced by plots.create_line_plot, plots.save_plot and plots.create_candlestick_plot,
+without creating a matplotlib figure or encoding a JPEG for every window. Candlestick windows are drawn in batches.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+# A .3 x .3 inch figure at 100 dpi saved with bbox_inches='tight' crops to the 23 x 23 pixel axes.
+LINE_SHAPE = (23, 23)
+
+# matplotlib pads the data limits by 5% on each side of the axes.
+MARGIN = 0.05
+
+# Line width (1.5 pt) and scatter marker diameter ('.' is a 3 pt dot with a 1 pt edge) in pixels at 100 dpi.
+LINE_WIDTH = 2.1
+MARKER_SIZE = 5.6
+
+# Grayscale value of matplotlib's default blue ('C0', #1f77b4) and of the white background.
+LINE_GRAY = 100
+BACKGROUND = 255
+
+
+def to_numeric(x):
+    """Converts x-axis values (numbers, datetimes or a DatetimeIndex) to floats.
+
+    Args:
+        x (ArrayLike): Values passed to the x-axis.
+
+    Returns:
+        np.ndarray: A float array with the same shape as x.
+    """
+    if isinstance(x, pd.Index) and isinstance(x, pd.DatetimeIndex):
+        return x.asi8.astype(float)
+
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        return x.astype('datetime64[ns]').astype('int64').astype(float)
+
+    if x.dtype == object:
+        return pd.DatetimeIndex(x.ravel()).asi8.astype(float).reshape(x.shape)
+
+    return x.astype(float)
+
+
+def scale_to_canvas(values, length, flip=False):
+    """Maps each row of values onto pixel coordinates, leaving a matplotlib-style margin.
+
+    Args:
+        values (np.ndarray): A 2-D array with one series per row.
+        length (int): Number of pixels along the axis.
+        flip (bool, optional): Should the axis increase downwards, as image rows do? Defaults to False.
+
+    Returns:
+        np.ndarray: Pixel coordinates with the same shape as values.
+    """
+    low = np.nanmin(values, axis=1, keepdims=True)
+    high = np.nanmax(values, axis=1, keepdims=True)
+    span = high - low
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scaled = np.where(span > 0, (values - low) / np.where(span > 0, span, 1), 0.5)
+
+    if flip:
+        scaled = 1 - scaled
+
+    return (MARGIN + (1 - 2 * MARGIN) * scaled) * length
+
+
+def segment_distances(points, starts, ends):
+    """Computes the distance from every point to the closest of a set of line segments.
+
+    Args:
+        points (np.ndarray): Array of shape (n_points, 2).
+        starts (np.ndarray): Array of shape (n_series, n_segments, 2) with the segment start points.
+        ends (np.ndarray): Array of shape (n_series, n_segments, 2) with the segment end points.
+
+    Returns:
+        np.ndarray: Array of shape (n_series, n_points) with the distance to the nearest segment.
+    """
+    p = points[None, :, None, :]
+    a = starts[:, None, :, :]
+    ab = (ends - starts)[:, None, :, :]
+
+    length_sq = np.sum(ab ** 2, axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = np.sum((p - a) * ab, axis=-1) / np.where(length_sq > 0, length_sq, 1)
+    t = np.clip(t, 0, 1)
+
+    nearest = a + t[..., None] * ab
+    dist = np.sqrt(np.sum((p - nearest) ** 2, axis=-1))
+
+    return np.fmin.reduce(np.where(np.isnan(dist), np.inf, dist), axis=-1)
+
+
+def coverage(distance, width):
+    """Converts distances to an anti-aliased stroke of the given width into pixel coverage in [0, 1]."""
+    return np.clip(width / 2 + 0.5 - distance, 0, 1)
+
+
+def draw_lines(x, y, shape, line_width, marker_size, gray):
+    """Draws a stack of line plots. See line_arrays."""
+    height, width = shape
+
+    cols = scale_to_canvas(x, width)
+    rows = scale_to_canvas(y, height, flip=True)
+    vertices = np.stack([rows, cols], axis=-1)
+
+    grid_rows, grid_cols = np.mgrid[0:height, 0:width] + 0.5
+    pixels = np.column_stack([grid_rows.ravel(), grid_cols.ravel()])
+
+    ink = coverage(segment_distances(pixels, vertices[:, :-1], vertices[:, 1:]), line_width)
+    if marker_size > 0:
+        ink = np.maximum(ink, coverage(segment_distances(pixels, vertices, vertices), marker_size))
+
+    img = BACKGROUND - ink * (BACKGROUND - gray)
+
+    return np.rint(img).astype(np.uint8).reshape(-1, height, width)
+
+
+def line_arrays(x, y, shape=LINE_SHAPE, line_width=LINE_WIDTH, marker_size=MARKER_SIZE, gray=LINE_GRAY,
+                chunk_size=64):
+    """Draws a batch of line plots with markers into grayscale pixel arrays.
+
+    Args:
+        x (ArrayLike): Values passed to the x-axis, either shared (window_size,) or per series (n, window_size).
+        y (ArrayLike): Values passed to the y-axis with shape (n, window_size).
+        shape (tuple, optional): Height and width of each image. Defaults to LINE_SHAPE.
+        line_width (float, optional): Width of the line in pixels. Defaults to LINE_WIDTH.
+        marker_size (float, optional): Diameter of the markers in pixels. Defaults to MARKER_SIZE.
+        gray (int, optional): Grayscale value of the line and markers. Defaults to LINE_GRAY.
+        chunk_size (int, optional): Number of series drawn at once, which bounds the memory used. Defaults to 64.
+
+    Returns:
+        np.ndarray: A uint8 array of shape (n, height, width).
+    """
+    y = np.atleast_2d(np.asarray(y, dtype=float))
+    x = np.broadcast_to(np.atleast_2d(to_numeric(x)), y.shape)
+
+    imgs = np.empty((len(y),) + tuple(shape), dtype=np.uint8)
+    for start in range(0, len(y), chunk_size):
+        stop = start + chunk_size
+        imgs[start:stop] = draw_lines(x[start:stop], y[start:stop], shape, line_width, marker_size, gray)
+
+    return imgs
+
+
+def line_array(x, y, **kwargs):
+    """Draws a single line plot into a grayscale pixel array. See line_arrays for the keyword arguments.
+
+    Args:
+        x (ArrayLike): ArrayLike object passed to the x-axis.
+        y (ArrayLike): ArrayLike object passed to the y-axis.
+
+    Returns:
+        np.ndarray: A uint8 array of shape (height, width).
+    """
+    return line_arrays(x, y, **kwargs)[0]
+
+
+# mplfinance draws the axes of a .3 x .3 inch figure (saved without cropping) from 18% to 90% of the width
+# and from 18% to 88% of the height.
+CANDLE_SHAPE = (30, 30)
+CANDLE_AXES = (0.18, 0.18, 0.90, 0.88)
+
+# Candle body widths (in days) and edge/wick widths (in points) that mplfinance interpolates by window size.
+CANDLE_POINTS = np.arange(30, 241, 30)
+CANDLE_WIDTHS = np.array([0.65, 0.575, 0.50, 0.445, 0.435, 0.425, 0.420, 0.415])
+CANDLE_LINEWIDTHS = np.array([1.00, 0.875, 0.75, 0.625, 0.500, 0.438, 0.435, 0.435])
+POINTS_TO_PIXELS = 100 / 72
+
+# Agg snaps the thin candle strokes onto pixel centres, which moves them about half a pixel right and down.
+SNAP = 0.5
+
+# Grayscale values of the 'white' up candles, 'grey' down candles and black edges and wicks.
+UP_GRAY = 255
+DOWN_GRAY = 128
+EDGE_GRAY = 0
+FILL_ALPHA = 0.9
+
+
+def interval_coverage(low, high, length):
+    """Computes the fraction of each pixel along an axis that lies inside [low, high].
+
+    Args:
+        low (np.ndarray): Start of each interval in pixel coordinates.
+        high (np.ndarray): End of each interval in pixel coordinates.
+        length (int): Number of pixels along the axis.
+
+    Returns:
+        np.ndarray: An array of shape low.shape + (length,) with values in [0, 1].
+    """
+    edges = np.arange(length)
+    covered = np.minimum(high[..., None], edges + 1) - np.maximum(low[..., None], edges)
+
+    return np.nan_to_num(np.clip(covered, 0, 1))
+
+
+def rect_coverage(left, right, top, bottom, shape):
+    """Computes the pixel coverage of axis-aligned rectangles.
+
+    Args:
+        left, right, top, bottom (np.ndarray): Rectangle sides in pixel coordinates, all with the same shape.
+        shape (tuple): Height and width of the image.
+
+    Returns:
+        np.ndarray: An array of shape left.shape + shape with values in [0, 1].
+    """
+    height, width = shape
+
+    return interval_coverage(top, bottom, height)[..., :, None] * interval_coverage(left, right, width)[..., None, :]
+
+
+def draw_candles(ohlc, shape):
+    """Draws a stack of candlestick windows. See candle_arrays."""
+    height, width = shape
+    n_candles = ohlc.shape[1]
+    opens, highs, lows, closes = np.moveaxis(ohlc, -1, 0)
+
+    left, bottom, right, top = CANDLE_AXES
+    x0, x1 = left * width, right * width
+    y0, y1 = (1 - top) * height, (1 - bottom) * height
+
+    # mplfinance pads the x-axis by the average distance between candles and matplotlib adds its 5% margins.
+    spacing = (n_candles - 1) / n_candles
+    xlim = np.array([-spacing, n_candles - 1 + spacing])
+    xlim += np.array([-MARGIN, MARGIN]) * (xlim[1] - xlim[0])
+    day = (x1 - x0) / (xlim[1] - xlim[0])
+    centers = x0 + (np.arange(n_candles) - xlim[0]) * day + SNAP
+
+    ymin = np.nanmin(lows, axis=1, keepdims=True)
+    ymax = np.nanmax(highs, axis=1, keepdims=True)
+    span = np.where(ymax > ymin, ymax - ymin, 1)
+    ymin, ymax = ymin - MARGIN * span, ymax + MARGIN * span
+
+    def to_row(price):
+        return y0 + (ymax - price) / (ymax - ymin) * (y1 - y0) + SNAP
+
+    half_width = np.interp(n_candles, CANDLE_POINTS, CANDLE_WIDTHS) / 2 * day
+    line_width = np.interp(n_candles, CANDLE_POINTS, CANDLE_LINEWIDTHS) * POINTS_TO_PIXELS
+    half_line = line_width / 2
+
+    centers = np.broadcast_to(centers, opens.shape)
+    body_top = to_row(np.maximum(opens, closes))
+    body_bottom = to_row(np.minimum(opens, closes))
+
+    wicks = rect_coverage(centers - half_line, centers + half_line, to_row(highs), to_row(lows), shape)
+    bodies = rect_coverage(centers - half_width, centers + half_width, body_top, body_bottom, shape)
+    edges = (
+        rect_coverage(centers - half_width - half_line, centers + half_width + half_line,
+                      body_top - half_line, body_bottom + half_line, shape)
+        - rect_coverage(centers - half_width + half_line, centers + half_width - half_line,
+                        body_top + half_line, body_bottom - half_line, shape)
+    )
+
+    fill = np.where(opens < closes, UP_GRAY, DOWN_GRAY)[..., None, None]
+    body_ink = np.minimum(bodies.sum(axis=1), 1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        body_gray = np.where(body_ink > 0, (bodies * fill).sum(axis=1) / bodies.sum(axis=1), BACKGROUND)
+
+    img = BACKGROUND + wicks.max(axis=1) * (EDGE_GRAY - BACKGROUND)
+    img += FILL_ALPHA * body_ink * (body_gray - img)
+    img += edges.max(axis=1) * (EDGE_GRAY - img)
+
+    return np.rint(img).astype(np.uint8)
+
+
+def candle_arrays(ohlc, shape=CANDLE_SHAPE, chunk_size=64):
+    """Draws a batch of candlestick plots into grayscale pixel arrays, using white up candles, grey down
+    candles and black edges and wicks like plots.create_candlestick_plot.
+
+    Args:
+        ohlc (ArrayLike): Open, high, low and close prices with shape (n_windows, window_size, 4).
+        shape (tuple, optional): Height and width of each image. Defaults to CANDLE_SHAPE.
+        chunk_size (int, optional): Number of windows drawn at once, which bounds the memory used. Defaults to 64.
+
+    Returns:
+        np.ndarray: A uint8 array of shape (n_windows, height, width).
+    """
+    ohlc = np.asarray(ohlc, dtype=float)
+    if ohlc.ndim == 2:
+        ohlc = ohlc[None]
+
+    imgs = np.empty((len(ohlc),) + tuple(shape), dtype=np.uint8)
+    for start in range(0, len(ohlc), chunk_size):
+        imgs[start:start + chunk_size] = draw_candles(ohlc[start:start + chunk_size], shape)
+
+    return imgs
+
+
+def candle_array(ohlc, **kwargs):
+    """Draws a single candlestick plot into a grayscale pixel array. See candle_arrays for the keyword arguments.
+
+    Args:
+        ohlc (ArrayLike): Open, high, low and close prices with shape (window_size, 4), or a pandas DataFrame
+            that contains columns called "open", "high", "low", and "close".
+
+    Returns:
+        np.ndarray: A uint8 array of shape (height, width).
+    """
+    if isinstance(ohlc, pd.DataFrame):
+        ohlc = ohlc[["open", "high", "low", "close"]].to_numpy()
+
+    return candle_arrays(ohlc, **kwargs)[0]
@@ -0,0 +1,221 @@
+"""
+This script allows the user to sample the windows to be plotted for buy and nobuy signals.
+
+Samples can be stratified (e.g. n windows per firm and year), kept a minimum number of rows apart within a firm,
+and kept away from the signals of the opposite class, so that a nobuy window never overlaps a buy window of the
+same firm. The result is a small manifest with one row per sampled window, which can be turned back into a
+sampled column for plots.plot_sampled or plots.render_sampled, or rendered window by window.
+"""
+
+from bisect import bisect_left
+
+import numpy as np
+import pandas as pd
+
+from source import features
+from source import plots
+
+
+def firm_layout(data):
+    """Orders the rows of data by firm, keeping their order within each firm.
+
+    Returns:
+        tuple: The order (positions in data), the firm code, the rank within the firm and the first and last
+        sorted position of the firm, for each sorted row.
+    """
+    order, codes, rank = features.firm_segments(data)
+
+    rows = np.arange(len(codes))
+    first = rows - rank
+    firm_ends = np.r_[codes[1:] != codes[:-1], True] if len(codes) else np.array([], dtype=bool)
+    last = np.minimum.accumulate(np.where(firm_ends, rows, len(rows))[::-1])[::-1]
+
+    return order, codes, rank, first, last
+
+
+def count_nearby(mask, first, last, radius):
+    """Counts the True values of mask within radius rows of each row, without crossing into another firm.
+    All arrays are in the sorted order of firm_layout."""
+    cumsum = np.r_[0, np.cumsum(mask)]
+    rows = np.arange(len(mask))
+    lo = np.maximum(rows - radius, first)
+    hi = np.minimum(rows + radius, last)
+
+    return cumsum[hi + 1] - cumsum[lo]
+
+
+def stratum_values(data, key):
+    """Returns the value of a stratification key for every row: a column, an index level, or "year"."""
+    if key == "year":
+        return data.index.get_level_values("time").year.to_numpy()
+
+    return plots.group_keys(data, key)
+
+
+def strata_codes(data, strata, order, firms):
+    """Numbers the strata of the sorted rows of firm_layout, combining the codes of every key."""
+    codes = np.zeros(len(order), dtype=np.int64)
+
+    for key in strata:
+        if key == "firm":
+            key_codes, n_codes = firms, firms.max() + 1 if len(firms) else 0
+        else:
+            key_codes, uniques = pd.factorize(stratum_values(data, key)[order])
+            n_codes = len(uniques)
+        codes = codes * n_codes + key_codes
+
+    return codes
+
+
+def spaced_picks(candidates, strata, firms, ranks, n, min_spacing):
+    """Accepts candidates in order, skipping any that is closer than min_spacing rows to an accepted candidate of
+    the same firm, until n are accepted in each stratum. candidates must be grouped by stratum."""
+    accepted = {}
+    picks = []
+    bounds = np.flatnonzero(np.r_[True, strata[1:] != strata[:-1], True]) if len(strata) else [0]
+
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        taken = 0
+        for i in range(start, stop):
+            firm_ranks = accepted.setdefault(firms[i], [])
+            at = bisect_left(firm_ranks, ranks[i])
+
+            if at > 0 and ranks[i] - firm_ranks[at - 1] < min_spacing:
+                continue
+            if at < len(firm_ranks) and firm_ranks[at] - ranks[i] < min_spacing:
+                continue
+
+            firm_ranks.insert(at, ranks[i])
+            picks.append(candidates[i])
+            taken += 1
+            if taken == n:
+                break
+
+    return np.array(picks, dtype=int)
+
+
+def sample_windows(data, col_name, value, n, window_size, strata=("firm",), min_spacing=0, exclude=None,
+                   random_state=None, require_full=True):
+    """Randomly samples n windows per stratum that end on a row with the specified value.
+
+    Args:
+        data (pd.DataFrame): A DataFrame where "time" and "firm" are a MultiIndex, with the rows of each firm in
+            time order.
+        col_name (str): The column in the DataFrame that should be sampled.
+        value (any): The value to sample from.
+        n (int): The number of windows to sample per stratum.
+        window_size (int): The number of rows in each window, ending with the sampled row. Rows with fewer prior
+            rows for their firm are not sampled, as in plots.window_positions.
+        strata (tuple of str, optional): Columns, index levels or "year" to stratify by. Defaults to ("firm",).
+        min_spacing (int, optional): The minimum number of rows between two sampled rows of the same firm, e.g.
+            window_size for windows that do not overlap. Defaults to 0.
+        exclude (str or np.ndarray, optional): A boolean column (or array) of rows whose windows the sampled
+            windows must not overlap, such as the signals of the opposite class. Defaults to None.
+        random_state (int, optional): The seed for numpy's random number generator. Defaults to None.
+        require_full (bool, optional): Should strata with fewer than n windows be left out, as in
+            plots.check_signals? Defaults to True.
+
+    Returns:
+        pd.DataFrame: The manifest, with the "row" position in data, the "firm", the "start" and end "time" of
+        each window and its strata, ordered by row.
+    """
+    order, firms, ranks, first, last = firm_layout(data)
+
+    eligible = (data[col_name] == value).to_numpy()[order] & (ranks >= window_size - 1)
+    if exclude is not None:
+        excluded = data[exclude].to_numpy() if isinstance(exclude, str) else np.asarray(exclude)
+        eligible &= count_nearby(excluded.astype(bool)[order], first, last, window_size - 1) == 0
+
+    codes = strata_codes(data, strata, order, firms)
+
+    candidates = np.flatnonzero(eligible)
+    rng = np.random.default_rng(random_state)
+    shuffled = candidates[np.lexsort((rng.random(len(candidates)), codes[candidates]))]
+
+    if min_spacing > 1:
+        picks = spaced_picks(shuffled, codes[shuffled], firms[shuffled], ranks[shuffled], n, min_spacing)
+    else:
+        sorted_strata = codes[shuffled]
+        rank_in_stratum = np.arange(len(shuffled)) - np.searchsorted(sorted_strata, sorted_strata)
+        picks = shuffled[rank_in_stratum < n]
+
+    if require_full and len(picks):
+        _, inverse, counts = np.unique(codes[picks], return_inverse=True, return_counts=True)
+        picks = picks[counts[inverse] >= n]
+
+    picks = picks[np.argsort(order[picks], kind="stable")]
+    rows = order[picks]
+    time = data.index.get_level_values("time")
+    manifest = pd.DataFrame({
+        "row": rows,
+        "firm": pd.Categorical(data.index.get_level_values("firm")[rows]),
+        "start": time[order[picks - (window_size - 1)]],
+        "time": time[rows],
+    })
+    for key in strata:
+        if key != "firm":
+            manifest[key] = stratum_values(data, key)[rows]
+
+    return manifest
+
+
+def sample_buy_nobuy(data, col_name, n, window_size, strata=("firm",), min_spacing=0, random_state=None,
+                     buy_value=1, nobuy_value=0):
+    """Samples balanced buy and nobuy windows: n of each per stratum, where no nobuy window overlaps a buy signal,
+    and only strata with n windows of both classes are kept.
+
+    Args:
+        col_name (str): The column of buy signals, e.g. "macd_buy".
+        buy_value (any, optional): The value of a buy signal. Defaults to 1.
+        nobuy_value (any, optional): The value of a nobuy signal. Defaults to 0.
+        See sample_windows for the other arguments.
+
+    Returns:
+        pd.DataFrame: The manifest of both classes, with a "signal" column of "buy" or "nobuy".
+    """
+    buy = sample_windows(data, col_name, buy_value, n, window_size, strata, min_spacing, None, random_state)
+    nobuy = sample_windows(data, col_name, nobuy_value, n, window_size, strata, min_spacing,
+                           (data[col_name] == buy_value).to_numpy(), random_state)
+
+    keys = list(strata)
+    both = buy[keys].drop_duplicates().merge(nobuy[keys].drop_duplicates())
+    buy = buy.merge(both).assign(signal="buy")
+    nobuy = nobuy.merge(both).assign(signal="nobuy")
+
+    manifest = pd.concat([buy, nobuy], ignore_index=True)
+    manifest["firm"] = manifest["firm"].astype("category")
+    manifest["signal"] = manifest["signal"].astype("category")
+
+    return manifest
+
+
+def manifest_mask(data, manifest):
+    """Returns a boolean array aligned to data that is True for the sampled rows of a manifest, to be used as the
+    sampled_col of plots.plot_sampled or plots.render_sampled."""
+    mask = np.zeros(len(data), dtype=bool)
+    mask[manifest["row"].to_numpy()] = True
+
+    return mask
+
+
+def manifest_windows(data, manifest, indicator, window_size, dir_path, signal=None):
+    """Yields the filename and window of every row of a manifest, like plots.sampled_windows, so that windows can
+    be rendered one at a time without building a sampled column.
+
+    Args:
+        signal (str, optional): The signal used to name the files. Defaults to None, which uses the "signal"
+            column of the manifest.
+        See plots.sampled_windows for the other arguments.
+
+    Yields:
+        tuple: The filename without the plot type suffix and the window as a pandas DataFrame.
+    """
+    order, _, _, _, _ = firm_layout(data)
+    sorted_position = np.empty_like(order)
+    sorted_position[order] = np.arange(len(order))
+
+    for entry in manifest.itertuples(index=False):
+        positions = order[sorted_position[entry.row] + np.arange(1 - window_size, 1)]
+        window = data.iloc[positions]
+
+        yield plots.window_filename(dir_path, entry.firm, indicator, signal or entry.signal, entry.start), window
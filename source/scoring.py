@@ -0,0 +1,174 @@
+"""
+This script allows the user to score new windows of prices with a model saved by h2o_modelling.train_and_save.
+
+The model is loaded once and kept in a Scorer, which renders windows in memory into the pixel layout of
+plots.build_h2o_dataset and scores them in micro-batches, so new data never goes through image files or parquet.
+The result is the buy probability of each (firm, time).
+"""
+
+import time
+
+import numpy as np
+import pandas as pd
+
+from source import metrics
+from source import plots
+from source import pruning
+
+
+def load_model(path):
+    """Loads a model saved by h2o_modelling.train_and_save, or a MOJO (a ".zip" file) exported from one. The h2o
+    cluster must already be running, e.g. after h2o.init().
+
+    Args:
+        path (str): The filepath of the saved model or the MOJO.
+
+    Returns:
+        h2o.model.ModelBase: The model.
+    """
+    import h2o
+
+    if str(path).endswith(".zip"):
+        return h2o.import_mojo(str(path))
+
+    return h2o.load_model(str(path))
+
+
+def h2o_frame(df):
+    import h2o
+
+    return h2o.H2OFrame(df)
+
+
+class Scorer:
+    """Scores windows of prices with a warm model.
+
+    Args:
+        model: A model with a predict method, e.g. from load_model.
+        plot_var (str, optional): The column name of the values to be plotted. Defaults to "close".
+        plot_type (str, optional): The type of plot the model was trained on: "line" or "candle". Defaults to "line".
+        window_size (int, optional): The number of rows in each window. Defaults to 26.
+        engine (str, optional): The library used to draw the plots, which must be the one used for the training
+            plots: "matplotlib" or "numpy". Defaults to "matplotlib".
+        batch_size (int, optional): The number of windows sent to the model at once. Defaults to 256.
+        cache (cache.RenderCache, optional): A cache of rendered plots, see plots.render_cached. Defaults to None.
+        positive (str, optional): The prediction column of the buy class. Defaults to "p1", h2o's column for
+            label 1.
+        to_frame (function, optional): Converts a pandas DataFrame of pixels to the model's input. Defaults to
+            h2o_frame.
+        index (dict, optional): The pixel index the model was trained with, see pruning.build_index. Defaults to
+            None, every pixel.
+    """
+
+    def __init__(self, model, plot_var="close", plot_type="line", window_size=26, engine="matplotlib", batch_size=256,
+                 cache=None, positive="p1", to_frame=h2o_frame, index=None):
+        self.model = model
+        self.plot_var = plot_var
+        self.plot_type = plot_type
+        self.window_size = window_size
+        self.engine = engine
+        self.batch_size = batch_size
+        self.cache = cache
+        self.positive = positive
+        self.to_frame = to_frame
+        self.index = index
+
+    def pixels(self, windows):
+        """Renders windows in memory. The plots are JPEG encoded and decoded like the training images (see
+        plots.saved_pixels), so the pixels are those of plots.build_h2o_dataset and plots.build_h2o_sampled.
+
+        Args:
+            windows (list of pd.DataFrame): The windows, with "time" and "firm" as a MultiIndex.
+
+        Returns:
+            np.ndarray: A 2-D uint8 array with one flattened image per row, as in plots.build_h2o_dataset.
+        """
+        imgs = None
+
+        for row, window in enumerate(windows):
+            if self.cache is not None:
+                pixels = plots.render_cached(window, self.plot_var, self.plot_type, self.engine, self.cache).ravel()
+            else:
+                img = plots.render_window(window, self.plot_var, self.plot_type, self.engine)
+                pixels = plots.saved_pixels(img).ravel()
+
+            if imgs is None:
+                imgs = np.empty((len(windows), pixels.size), dtype=np.uint8)
+            imgs[row] = pixels
+
+        return imgs if imgs is not None else np.empty((0, 0), dtype=np.uint8)
+
+    def score_pixels(self, imgs):
+        """Returns the buy probability of each row of flattened images."""
+        if len(imgs) == 0:
+            return np.empty(0)
+
+        if self.index is not None:
+            df = pd.DataFrame(pruning.apply_index(imgs, self.index), columns=pruning.column_names(self.index))
+        else:
+            df = plots.pixels_to_dataset(imgs, np.zeros(len(imgs), dtype=np.int8)).drop(columns="label")
+        predictions = self.model.predict(self.to_frame(df))
+
+        if hasattr(predictions, "as_data_frame"):
+            predictions = predictions[self.positive].as_data_frame(use_pandas=True)
+
+        return predictions[self.positive].to_numpy(dtype=float)
+
+    @metrics.timed("score_windows")
+    def score_windows(self, windows):
+        """Returns the buy probability of each window, scoring batch_size windows at a time."""
+        metrics.count(items=len(windows))
+
+        return np.concatenate([np.empty(0)] + [
+            self.score_pixels(self.pixels(windows[i:i + self.batch_size]))
+            for i in range(0, len(windows), self.batch_size)
+        ])
+
+    def score(self, data, sampled_col):
+        """Scores the window that ends at every sampled row.
+
+        Args:
+            data (pd.DataFrame): A pandas DataFrame where "time" and "firm" are a MultiIndex.
+            sampled_col (str): A column of boolean values, where only True values are scored. Rows with fewer than
+                window_size - 1 prior rows for their firm are skipped, as in plots.window_positions.
+
+        Returns:
+            pd.DataFrame: The "firm", "time" and "buy_probability" of each scored row, in the order of data.
+        """
+        positions = plots.window_positions(data, sampled_col, self.window_size)
+        windows = [data.iloc[p] for p in positions]
+        time_ = data.index.get_level_values("time")
+
+        return pd.DataFrame({
+            "firm": data.index.get_level_values("firm")[positions[:, -1]],
+            "time": time_[positions[:, -1]],
+            "buy_probability": self.score_windows(windows),
+        })
+
+
+def benchmark(scorer, windows, n_single=20):
+    """Measures the throughput of batch scoring and the latency of scoring a single window.
+
+    Args:
+        scorer (Scorer): A scorer with a warm model.
+        windows (list of pd.DataFrame): The windows to score.
+        n_single (int, optional): The number of single-window requests to time. Defaults to 20.
+
+    Returns:
+        dict: The "windows_per_second" of scoring every window in batches, and the median "latency_ms" of
+        scoring one window.
+    """
+    start = time.perf_counter()
+    scorer.score_windows(windows)
+    seconds = time.perf_counter() - start
+
+    latencies = []
+    for window in windows[:n_single]:
+        start = time.perf_counter()
+        scorer.score_windows([window])
+        latencies.append(time.perf_counter() - start)
+
+    return {
+        "windows_per_second": len(windows) / seconds if seconds else float("inf"),
+        "latency_ms": 1000 * float(np.median(latencies)) if latencies else float("nan"),
+    }
@@ -0,0 +1,128 @@
+"""
+This script allows the user to store the grayscale pixels of the plots as a memory-mapped tensor.
+
+A store is a directory with the uint8 pixel matrix in pixels.npy, one flattened image per row, and a small sidecar
+meta.parquet with the label, name, firm, indicator, signal, start date and plot type of each row. Opening a store
+maps pixels.npy without reading it, so rows can be selected from the sidecar and only those rows are loaded.
+"""
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+PIXELS = "pixels.npy"
+SIDECAR = "meta.parquet"
+NAME_PARTS = ["firm", "indicator", "signal", "start", "plot_type"]
+
+
+def parse_names(names):
+    """Splits image names like plot_sampled's "{firm}_{indicator}_{signal}_{date}_{plot_type}.jpg" into a
+    DataFrame with one column per part. Names that do not follow the pattern get missing values."""
+    parts = pd.Series([Path(name).stem for name in names], dtype=object).str.rsplit("_", n=4, expand=True)
+    parts = parts.reindex(columns=range(len(NAME_PARTS)))
+    parts.columns = NAME_PARTS
+
+    return parts.astype("category")
+
+
+def write_store(save_dir, imgs, labels, names):
+    """Writes a store of flattened images.
+
+    Args:
+        save_dir (str): The directory of the store.
+        imgs (np.ndarray): A 2-D uint8 array with one flattened image per row, e.g. from plots.render_sampled.
+        labels (list of int): The label of each image.
+        names (list of str): The filepath of each image, used to fill in the firm, indicator, signal and plot type.
+    """
+    Path(save_dir).mkdir(parents=True, exist_ok=True)
+    np.save(Path(save_dir) / PIXELS, np.ascontiguousarray(imgs, dtype=np.uint8))
+
+    meta = pd.concat([
+        pd.DataFrame({"label": np.asarray(labels, dtype=np.int8), "name": pd.Categorical(names)}),
+        parse_names(names),
+    ], axis=1)
+    meta.to_parquet(Path(save_dir) / SIDECAR)
+
+
+def open_store(save_dir):
+    """Opens a store without reading its pixels.
+
+    Args:
+        save_dir (str): The directory of the store.
+
+    Returns:
+        tuple: A read-only np.memmap of the pixels and the sidecar as a pandas DataFrame.
+    """
+    pixels = np.load(Path(save_dir) / PIXELS, mmap_mode="r")
+    meta = pd.read_parquet(Path(save_dir) / SIDECAR)
+
+    return pixels, meta
+
+
+def select_rows(meta, **filters):
+    """Finds the rows of a store that match every filter.
+
+    Args:
+        meta (pd.DataFrame): The sidecar of a store, see open_store.
+        **filters: A value or list of values per sidecar column, e.g. firm=["AAPL", "GOOG"] or signal="buy".
+
+    Returns:
+        np.ndarray: The positions of the matching rows, in order.
+    """
+    mask = np.ones(len(meta), dtype=bool)
+
+    for col, values in filters.items():
+        values = values if isinstance(values, (list, tuple, set)) else [values]
+        mask &= meta[col].isin(values).to_numpy()
+
+    return np.flatnonzero(mask)
+
+
+def iter_batches(save_dir, batch_size=1024, **filters):
+    """Loads the matching rows of a store batch_size at a time.
+
+    Args:
+        save_dir (str): The directory of the store.
+        batch_size (int, optional): The number of images per batch. Defaults to 1024.
+        **filters: See select_rows.
+
+    Yields:
+        tuple: A 2-D uint8 array of pixels and a 1-D int8 array of labels.
+    """
+    pixels, meta = open_store(save_dir)
+    rows = select_rows(meta, **filters)
+    labels = meta["label"].to_numpy()
+
+    for i in range(0, len(rows), batch_size):
+        batch = rows[i:i + batch_size]
+        yield np.asarray(pixels[batch]), labels[batch]
+
+
+def load_dataset(*save_dirs, **filters):
+    """Loads the matching rows of one or more stores (e.g. a buy and a nobuy store) into a DataFrame laid out like
+    plots.pixels_to_dataset: the label, one column per pixel and the name.
+
+    Args:
+        *save_dirs (str): The directories of the stores.
+        **filters: See select_rows.
+
+    Returns:
+        pd.DataFrame: One row per matching image, in the order of the stores.
+    """
+    imgs, labels, names = [], [], []
+
+    for save_dir in save_dirs:
+        pixels, meta = open_store(save_dir)
+        rows = select_rows(meta, **filters)
+        imgs.append(pixels[rows])
+        labels.append(meta["label"].to_numpy()[rows])
+        names.append(meta["name"].astype(str).to_numpy()[rows])
+
+    imgs = np.concatenate(imgs)
+    results = pd.DataFrame(imgs, columns=[f"pixel_{i}" for i in range(imgs.shape[1])], copy=False)
+    results.insert(0, "label", np.concatenate(labels))
+    results["name"] = pd.Categorical(np.concatenate(names))
+
+    return results
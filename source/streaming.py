@@ -0,0 +1,244 @@
+"""
+This script allows the user to update the RSI, BB and MACD indicators and their buy signals one trading day at a time.
+
+Each firm keeps a small state (moving averages, the last rolling window and the previous buy conditions) that can be
+saved to disk, so a refresh only processes the new rows instead of recomputing years of history. The values match
+features.build_indicators computed over the same rows.
+"""
+
+from collections import deque
+import math
+import pickle
+
+import pandas as pd
+
+
+COLUMNS = ["rsi", "rsi_buy", "bb_lower_band", "bb_buy", "macd", "macd_signal", "macd_buy"]
+
+
+class EMA:
+    """pandas_ta's exponential moving average: the first length values are averaged to seed an
+    exponential moving average with span=length and adjust=False. Like pandas, a missing value keeps
+    the average but still decays its weight, so the next value counts for more after a gap."""
+
+    def __init__(self, length):
+        self.length = length
+        self.alpha = 2 / (length + 1)
+        self.seed = []
+        self.value = math.nan
+        self.weight = 1.0
+
+    def update(self, x):
+        if len(self.seed) < self.length:
+            if not math.isnan(x):
+                self.seed.append(x)
+                if len(self.seed) == self.length:
+                    self.value = sum(self.seed) / self.length
+            return self.value
+
+        self.weight *= 1 - self.alpha
+        if math.isnan(x):
+            return self.value
+
+        self.value = (self.weight * self.value + self.alpha * x) / (self.weight + self.alpha)
+        self.weight = 1.0
+
+        return self.value
+
+
+class WilderAverage:
+    """pandas_ta's rma: an exponentially weighted mean with alpha=1/length, adjust=True and min_periods=length."""
+
+    def __init__(self, length):
+        self.length = length
+        self.decay = 1 - 1 / length
+        self.numerator = 0.0
+        self.denominator = 0.0
+        self.count = 0
+
+    def update(self, x):
+        self.numerator *= self.decay
+        self.denominator *= self.decay
+
+        if not math.isnan(x):
+            self.numerator += x
+            self.denominator += 1
+            self.count += 1
+
+        if self.count < self.length:
+            return math.nan
+
+        return self.numerator / self.denominator
+
+
+class RSI:
+    """pandas_ta's Relative Strength Index."""
+
+    def __init__(self, length):
+        self.gains = WilderAverage(length)
+        self.losses = WilderAverage(length)
+        self.previous = math.nan
+
+    def update(self, close):
+        change = close - self.previous
+        self.previous = close
+
+        gains_avg = self.gains.update(max(change, 0) if not math.isnan(change) else change)
+        losses_avg = self.losses.update(min(change, 0) if not math.isnan(change) else change)
+
+        if math.isnan(gains_avg) or math.isnan(losses_avg) or gains_avg + abs(losses_avg) == 0:
+            return math.nan
+
+        return 100 * gains_avg / (gains_avg + abs(losses_avg))
+
+
+class RollingStats:
+    """The mean and standard deviation of the last length values, updated by adding the newest value and
+    removing the oldest one, like pandas' rolling windows. Both are NaN while the window holds a missing value."""
+
+    def __init__(self, length, ddof=0):
+        self.length = length
+        self.ddof = ddof
+        self.window = deque()
+        self.n = 0
+        self.nans = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, x, sign):
+        """Adds (sign=1) or removes (sign=-1) a value from the running mean and sum of squares."""
+        if math.isnan(x):
+            self.nans += sign
+            return
+
+        self.n += sign
+        if self.n == 0:
+            self.mean, self.m2 = 0.0, 0.0
+            return
+
+        delta = x - self.mean
+        self.mean += sign * delta / self.n
+        self.m2 += sign * delta * (x - self.mean)
+
+    def update(self, x):
+        self.window.append(x)
+        self.add(x, 1)
+
+        if len(self.window) > self.length:
+            self.add(self.window.popleft(), -1)
+
+        if len(self.window) < self.length or self.nans:
+            return math.nan, math.nan
+
+        return self.mean, math.sqrt(max(self.m2, 0) / (self.length - self.ddof))
+
+
+class BBands:
+    """pandas_ta's Bollinger Bands: the lower, middle and upper bands."""
+
+    def __init__(self, length, std=2.0, ddof=0):
+        self.stats = RollingStats(length, ddof)
+        self.std = std
+
+    def update(self, close):
+        mid, sd = self.stats.update(close)
+
+        return mid - self.std * sd, mid, mid + self.std * sd
+
+
+class MACD:
+    """pandas_ta's Moving Average Convergence Divergence: the macd and its signal line."""
+
+    def __init__(self, fast=12, slow=26, signal=9):
+        self.fast = EMA(fast)
+        self.slow = EMA(slow)
+        self.signal = EMA(signal)
+
+    def update(self, close):
+        macd = self.fast.update(close) - self.slow.update(close)
+
+        return macd, self.signal.update(macd)
+
+
+class Crossover:
+    """Emits 1 on the first row where a buy condition holds after a row where it did not, and 0 otherwise.
+    Rows where the indicator is not available yet emit 0."""
+
+    def __init__(self):
+        self.previous = None
+
+    def update(self, condition, valid=True):
+        crossed = self.previous is not None and not self.previous and condition and valid
+        self.previous = condition
+
+        return int(crossed)
+
+
+class FirmState:
+    """The indicator and buy signal state of one firm."""
+
+    def __init__(self, rsi_length=27, bb_length=20, bb_std=2.0, fast=12, slow=26, signal=9):
+        self.rsi = RSI(rsi_length)
+        self.bbands = BBands(bb_length, bb_std)
+        self.macd = MACD(fast, slow, signal)
+        self.rsi_cross = Crossover()
+        self.bb_cross = Crossover()
+        self.macd_cross = Crossover()
+
+    def update(self, close):
+        """Adds one trading day and returns the indicators and buy signals for it."""
+        rsi = self.rsi.update(close)
+        bb_lower_band, _, _ = self.bbands.update(close)
+        macd, macd_signal = self.macd.update(close)
+
+        return {
+            "rsi": rsi,
+            "rsi_buy": self.rsi_cross.update(math.isnan(rsi) or rsi >= 30, not math.isnan(rsi)),
+            "bb_lower_band": bb_lower_band,
+            "bb_buy": self.bb_cross.update(not math.isnan(bb_lower_band) and close < bb_lower_band),
+            "macd": macd,
+            "macd_signal": macd_signal,
+            "macd_buy": self.macd_cross.update(macd > macd_signal),
+        }
+
+
+class StreamingIndicators:
+    """Keeps a FirmState for every firm and updates them with new rows of prices.
+
+    Args:
+        **params: Passed on to FirmState, e.g. rsi_length=27 or bb_length=20.
+    """
+
+    def __init__(self, **params):
+        self.params = params
+        self.firms = {}
+
+    def update(self, df):
+        """Adds new trading days for any number of firms.
+
+        Args:
+            df (pd.DataFrame): Dataframe that contains close prices, where "firm" is a level of the index. The rows of
+                each firm must be in time order and come after the rows of earlier updates.
+
+        Returns:
+            pd.DataFrame: The COLUMNS for the new rows, with the same index as df.
+        """
+        rows = []
+
+        for firm, close in zip(df.index.get_level_values("firm"), df["close"].to_numpy(dtype=float)):
+            if firm not in self.firms:
+                self.firms[firm] = FirmState(**self.params)
+            rows.append(self.firms[firm].update(close))
+
+        return pd.DataFrame(rows, index=df.index, columns=COLUMNS)
+
+    def save(self, path):
+        """Saves the state of every firm to a checkpoint file."""
+        with open(path, "wb") as f:
+            pickle.dump(self, f)
+
+    @staticmethod
+    def load(path):
+        """Loads a checkpoint file written by save."""
+        with open(path, "rb") as f:
+            return pickle.load(f)
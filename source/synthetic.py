@@ -0,0 +1,48 @@
+"""
+This script allows the user to generate a synthetic dataset of daily open, high, low, and close prices for many firms.
+
+The dataset has the same layout as the one downloaded from Alpaca in the notebooks: a "time" and "firm" MultiIndex
+with the rows of each firm stored together. It is used by the tests and benchmarks, which must run offline.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def make_ohlc(n_firms, n_days, seed=0, start="2011-01-03"):
+    """Simulates daily prices for a number of firms as geometric random walks.
+
+    Args:
+        n_firms (int): Number of firms, named FIRM0, FIRM1, ...
+        n_days (int): Number of trading days for each firm.
+        seed (int, optional): The seed for the random number generator. Defaults to 0.
+        start (str, optional): The first trading day. Defaults to "2011-01-03".
+
+    Returns:
+        pd.DataFrame: A DataFrame with "open", "high", "low", "close" and "volume" columns and a "time" and
+        "firm" MultiIndex.
+    """
+    rng = np.random.default_rng(seed)
+    shape = (n_firms, n_days)
+
+    start_price = rng.uniform(20, 300, size=(n_firms, 1))
+    returns = rng.normal(0.0003, 0.015, size=shape)
+    close = start_price * np.exp(np.cumsum(returns, axis=1))
+    open_ = close * np.exp(rng.normal(0, 0.005, size=shape))
+    high = np.maximum(open_, close) * np.exp(np.abs(rng.normal(0, 0.005, size=shape)))
+    low = np.minimum(open_, close) * np.exp(-np.abs(rng.normal(0, 0.005, size=shape)))
+    volume = rng.integers(100_000, 10_000_000, size=shape)
+
+    time = pd.bdate_range(start, periods=n_days, tz="America/New_York")
+    firms = [f"FIRM{i}" for i in range(n_firms)]
+    index = pd.MultiIndex.from_arrays(
+        [np.tile(time, n_firms), np.repeat(firms, n_days)], names=["time", "firm"]
+    )
+
+    return pd.DataFrame({
+        "open": open_.ravel(),
+        "high": high.ravel(),
+        "low": low.ravel(),
+        "close": close.ravel(),
+        "volume": volume.ravel(),
+    }, index=index)
@@ -0,0 +1,160 @@
+from pathlib import Path
+
+import boto3
+import pytest
+from moto import mock_aws
+from PIL import Image
+from source import aws
+from source import metrics
+
+
+@pytest.fixture
+def s3_client(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_SESSION_TOKEN", "testing")
+
+    with mock_aws():
+        s3_client = aws.get_s3_client()
+        s3_client.create_bucket(Bucket="plots", CreateBucketConfiguration={"LocationConstraint": "us-east-2"})
+        yield s3_client
+
+
+def bucket_keys(s3_client):
+    return sorted(obj["Key"] for obj in s3_client.list_objects_v2(Bucket="plots").get("Contents", []))
+
+
+def test_upload_files_deletes_after_upload(tmp_path, s3_client):
+    files = []
+    for i in range(5):
+        f = tmp_path / f"plot_{i}.jpg"
+        f.write_bytes(bytes(range(i + 1)))
+        files.append(f.as_posix())
+
+    failed = aws.upload_files("plots", files, [f"plots/plot_{i}.jpg" for i in range(5)], s3_client,
+                              n_threads=3, delete=True)
+
+    assert failed == []
+    assert bucket_keys(s3_client) == [f"plots/plot_{i}.jpg" for i in range(5)]
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_upload_files_retries_and_keeps_failed_files(tmp_path, s3_client, monkeypatch):
+    good, bad = tmp_path / "good.jpg", tmp_path / "bad.jpg"
+    good.write_bytes(b"good")
+    bad.write_bytes(b"bad")
+    upload_file = s3_client.upload_file
+    calls = []
+
+    def flaky_upload_file(Filename, **kwargs):
+        calls.append(Filename)
+        if Filename == bad.as_posix() or calls.count(Filename) == 1:
+            raise boto3.exceptions.S3UploadFailedError("connection reset")
+        return upload_file(Filename=Filename, **kwargs)
+
+    monkeypatch.setattr(s3_client, "upload_file", flaky_upload_file)
+    monkeypatch.setattr(aws.time, "sleep", lambda seconds: None)
+
+    failed = aws.upload_files("plots", [good.as_posix(), bad.as_posix()], ["good.jpg", "bad.jpg"], s3_client,
+                              max_retries=2, delete=True)
+
+    assert failed == [bad.as_posix()]
+    assert calls.count(bad.as_posix()) == 3
+    assert bucket_keys(s3_client) == ["good.jpg"]
+    assert not good.exists() and bad.exists()
+
+
+def test_send_dir(tmp_path, s3_client):
+    for i in range(3):
+        Image.new("L", (23, 23), color=i).save(tmp_path / f"plot_{i}.jpg")
+
+    failed, prefix = aws.send_dir("plots", str(tmp_path), s3_client=s3_client)
+
+    assert failed == [] and prefix is None
+    assert bucket_keys(s3_client) == ["df.gzip", "plot_0.jpg", "plot_1.jpg", "plot_2.jpg"]
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_pack_files_and_read_packed(tmp_path, s3_client):
+    files = []
+    for i in range(6):
+        f = tmp_path / f"plot_{i}.jpg"
+        f.write_bytes(bytes([i]) * (300 + i))
+        files.append(f.as_posix())
+
+    packs = aws.pack_files(files, tmp_path / "packs", max_bytes=2048)
+    aws.upload_files("plots", packs, [f"run/{f.rsplit('/', 1)[-1]}" for f in packs], s3_client)
+    index = aws.read_index("plots", s3_client, key="run/index.json")
+
+    assert 1 < len(packs) - 1 < len(files)
+    assert sorted(index) == [f"plot_{i}.jpg" for i in range(6)]
+    for i in range(6):
+        assert aws.read_packed("plots", f"plot_{i}.jpg", index, s3_client, prefix="run/") == bytes([i]) * (300 + i)
+
+
+def test_send_dir_pack(tmp_path, s3_client):
+    for i in range(3):
+        Image.new("L", (23, 23), color=i).save(tmp_path / f"plot_{i}.jpg")
+    expected_output = (tmp_path / "plot_1.jpg").read_bytes()
+
+    failed, prefix = aws.send_dir("plots", str(tmp_path), s3_client=s3_client, pack=True)
+    index = aws.read_index("plots", s3_client, prefix)
+
+    assert failed == []
+    assert prefix.startswith(f"{tmp_path.name}/")
+    assert bucket_keys(s3_client) == [f"{prefix}index.json", f"{prefix}pack_00000.tar"]
+    assert sorted(index) == ["df.gzip", "plot_0.jpg", "plot_1.jpg", "plot_2.jpg"]
+    assert aws.read_packed("plots", "plot_1.jpg", index, s3_client, prefix) == expected_output
+    assert list(tmp_path.iterdir()) == []
+
+    Image.new("L", (23, 23), color=9).save(tmp_path / "plot_9.jpg")
+    _, second_prefix = aws.send_dir("plots", str(tmp_path), s3_client=s3_client, pack=True)
+
+    assert second_prefix != prefix
+    assert len(bucket_keys(s3_client)) == 4
+    assert aws.read_packed("plots", "plot_1.jpg", index, s3_client, prefix) == expected_output
+    assert sorted(aws.read_index("plots", s3_client, second_prefix)) == ["df.gzip", "plot_9.jpg"]
+
+
+def test_send_dir_pack_reports_files_of_failed_shards(tmp_path, s3_client, monkeypatch):
+    dir_path = tmp_path / "plots"
+    dir_path.mkdir()
+    for i in range(4):
+        Image.new("L", (23, 23), color=i).save(dir_path / f"plot_{i}.jpg")
+    upload_file = aws.upload_file
+
+    def fail_first_shard(bucket_name, file, key, *args):
+        return False if key.endswith("pack_00000.tar") else upload_file(bucket_name, file, key, *args)
+
+    monkeypatch.setattr(aws, "upload_file", fail_first_shard)
+    failed, prefix = aws.send_dir("plots", str(dir_path), s3_client=s3_client, pack=True, max_pack_bytes=2048)
+    index = aws.read_index("plots", s3_client, prefix)
+
+    assert failed and len(failed) < 5
+    assert sorted(Path(f).name for f in failed) == sorted(n for n, e in index.items() if e["shard"] == "pack_00000.tar")
+    assert len(list(dir_path.iterdir())) == 5
+
+
+def test_send_dir_counts_only_uploaded_files(tmp_path, s3_client, monkeypatch):
+    for i in range(3):
+        Image.new("L", (23, 23), color=i).save(tmp_path / f"plot_{i}.jpg")
+    uploaded_bytes = sum((tmp_path / f"plot_{i}.jpg").stat().st_size for i in (1, 2))
+    upload_file = aws.upload_file
+
+    def fail_plot_0(bucket_name, file, key, *args):
+        return False if key == "plot_0.jpg" else upload_file(bucket_name, file, key, *args)
+
+    monkeypatch.setattr(aws, "upload_file", fail_plot_0)
+    metrics.reset()
+    metrics.enable()
+    try:
+        failed, _ = aws.send_dir("plots", str(tmp_path), s3_client=s3_client)
+        summary = metrics.summary().set_index("stage")
+    finally:
+        metrics.disable()
+        metrics.reset()
+
+    assert [Path(f).name for f in failed] == ["plot_0.jpg"]
+    assert summary.loc["send_dir", "items"] == 3
+    assert summary.loc["send_dir", "bytes_written"] == uploaded_bytes + s3_client.head_object(
+        Bucket="plots", Key="df.gzip")["ContentLength"]
@@ -0,0 +1,59 @@
+import pickle
+
+import numpy as np
+from source.cache import RenderCache
+
+
+def test_render_cache_hits_and_misses(tmp_path):
+    cache = RenderCache(tmp_path)
+    times = np.arange("2021-01-04", "2021-01-09", dtype="datetime64[D]")
+    key = RenderCache.key(np.arange(5.0), times, "line", "numpy")
+    pixels = np.arange(6, dtype=np.uint8).reshape(2, 3)
+
+    assert cache.get(key) is None
+    cache.put(key, pixels)
+
+    np.testing.assert_array_equal(cache.get(key), pixels)
+    np.testing.assert_array_equal(RenderCache(tmp_path).get(key), pixels)
+    assert key != RenderCache.key(np.arange(5.0), times, "candle", "numpy")
+    assert key != RenderCache.key(np.arange(5.0), times + 1, "line", "numpy")
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_render_cache_evicts_least_recently_used(tmp_path):
+    pixels = np.zeros((10, 10), dtype=np.uint8)
+    keys = [RenderCache.key([float(i)], [0], "line", "numpy") for i in range(3)]
+    cache = RenderCache(tmp_path)
+    cache.put(keys[0], pixels)
+    entry_bytes = cache.stats()["bytes"]
+    cache.max_bytes = 2 * entry_bytes
+
+    cache.put(keys[1], pixels)
+    cache.get(keys[0])
+    cache.put(keys[2], pixels)
+
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None and cache.get(keys[2]) is not None
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["bytes"] == 2 * entry_bytes
+
+
+def test_render_cache_merges_worker_usage(tmp_path):
+    pixels = np.zeros((10, 10), dtype=np.uint8)
+    keys = [RenderCache.key([float(i)], [0], "line", "numpy") for i in range(3)]
+    cache = RenderCache(tmp_path)
+    cache.put(keys[0], pixels)
+    cache.max_bytes = 2 * cache.stats()["bytes"]
+
+    worker = pickle.loads(pickle.dumps(cache))
+    assert worker.stats()["entries"] == 0
+    worker.get(keys[0])
+    worker.put(keys[1], pixels)
+    worker.put(keys[2], b"jpeg bytes")
+    assert worker.get(keys[2]) == b"jpeg bytes"
+
+    cache.merge(worker.usage())
+
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 0
+    assert cache.stats()["entries"] == 2 and cache.stats()["evictions"] == 1
+    assert cache.get(keys[0]) is None
@@ -0,0 +1,60 @@
+import pandas as pd
+import pytest
+from source import datasets
+from source import plots
+from source import synthetic
+
+
+def make_plots(dir_path, n_days=40):
+    data = synthetic.make_ohlc(2, n_days)
+    data["sampled"] = [i % 7 == 0 for i in range(len(data))]
+    plots.plot_sampled(data, "sampled", "rsi", "nobuy", 10, str(dir_path), "close", "line", engine="numpy")
+
+
+def test_build_h2o_shards_matches_build_h2o_del_dir(tmp_path):
+    dir_path = tmp_path / "plots"
+    dir_path.mkdir()
+    make_plots(dir_path)
+    n_files = len(plots.list_files(dir_path))
+
+    plots.build_h2o_del_dir(str(dir_path), f"{tmp_path}/df.parquet")
+    manifest = datasets.build_h2o_shards(str(dir_path), f"{tmp_path}/shards", chunk_size=4)
+
+    expected_output = pd.read_parquet(f"{tmp_path}/df.parquet").sort_values("name", ignore_index=True)
+    actual_output = datasets.read_shards(f"{tmp_path}/shards")
+
+    assert len(manifest) == -(-n_files // 4)
+    assert manifest == datasets.read_manifest(f"{tmp_path}/shards")
+    assert [(entry["start"], entry["stop"]) for entry in manifest[:2]] == [(0, 4), (4, 8)]
+    assert manifest[-1]["stop"] == n_files
+    assert manifest[0]["firms"] == ["FIRM0"] and manifest[0]["signals"] == ["nobuy"]
+    assert manifest[0]["indicators"] == ["rsi"] and manifest[0]["plot_types"] == ["line"]
+    pd.testing.assert_frame_equal(expected_output, actual_output)
+
+
+def test_build_h2o_shards_resumes(tmp_path, monkeypatch):
+    dir_path = tmp_path / "plots"
+    dir_path.mkdir()
+    make_plots(dir_path)
+    files = plots.list_files(dir_path)
+    save_dir = f"{tmp_path}/shards"
+    write_shard = datasets.write_shard
+
+    def crash_after_two_shards(h2o_df, save_dir, manifest):
+        if len(manifest) == 2:
+            raise RuntimeError("crash")
+        return write_shard(h2o_df, save_dir, manifest)
+
+    monkeypatch.setattr(datasets, "write_shard", crash_after_two_shards)
+    with pytest.raises(RuntimeError):
+        datasets.build_h2o_shards(str(dir_path), save_dir, chunk_size=3, clear_dir=True)
+
+    assert len(datasets.read_manifest(save_dir)) == 2
+    assert len(plots.list_files(dir_path)) == len(files) - 6
+
+    monkeypatch.setattr(datasets, "write_shard", write_shard)
+    manifest = datasets.build_h2o_shards(str(dir_path), save_dir, chunk_size=3, clear_dir=True)
+
+    assert manifest[-1]["stop"] == len(files)
+    assert sorted(datasets.read_shards(save_dir)["name"]) == sorted(files)
+    assert plots.list_files(dir_path) == []
@@ -1,6 +1,8 @@
 import numpy as np
 import pandas as pd
+import pytest
 from source import features
+from source import synthetic
 
 
 def test_rsi_buy_indicator_is_correct():
@@ -10,3 +12,109 @@ def test_rsi_buy_indicator_is_correct():
     actual_output = features.rsi_buy_indicator(test_rsi_col)
 
     np.testing.assert_array_equal(expected_output, actual_output)
+
+
+def test_buy_indicators_reset_at_firm_boundaries():
+    index = pd.MultiIndex.from_product([["AAPL", "GOOG"], range(4)], names=["firm", "time"])
+    df = pd.DataFrame({
+        "rsi": [np.NaN, 20.0, 40.0, 50.0, 45.0, 20.0, 25.0, 35.0],
+        "close": [9.0, 11.0, 8.0, 12.0, 7.0, 9.0, 10.0, 5.0],
+        "bb_lower_band": [np.NaN, 10.0, 10.0, 10.0, 8.0, 8.0, 8.0, 8.0],
+        "macd": [1.0, 0.5, 2.0, 0.5, 4.0, 1.0, 2.0, 3.0],
+        "macd_signal": [np.NaN, 1.0, 1.0, 1.0, 1.0, 2.0, 1.0, 1.0],
+    }, index=index)
+
+    rsi_buy = features.compute_buy_nobuy(df, features.rsi_buy_indicator, "rsi")
+    bb_buy = features.compute_buy_nobuy(df, features.bb_buy_indicator, "bb_lower_band", "close")
+    macd_buy = features.compute_buy_nobuy(df, features.macd_buy_indicator, "macd_signal", "macd")
+
+    assert rsi_buy.dtype == np.int8
+    np.testing.assert_array_equal(rsi_buy, [0, 0, 1, 0, 0, 0, 0, 1])
+    np.testing.assert_array_equal(bb_buy, [0, 0, 1, 0, 0, 0, 0, 1])
+    np.testing.assert_array_equal(macd_buy, [0, 0, 1, 0, 0, 0, 1, 0])
+    np.testing.assert_array_equal(features.macd_buy_indicator(df["macd_signal"], df["macd"]), [0, 0, 1, 0, 1, 0, 1, 0])
+    np.testing.assert_array_equal(features.bb_buy_indicator(df["bb_lower_band"], df["close"]), [0, 0, 1, 0, 1, 0, 0, 1])
+
+    by_time = df.swaplevel().sort_index(kind="stable")
+    assert features.is_grouped(features.firm_labels(df))
+    assert not features.is_grouped(features.firm_labels(by_time))
+    order = by_time.index.swaplevel().get_indexer(df.index)
+    for fn, columns, expected_output in [(features.rsi_buy_indicator, ["rsi"], rsi_buy),
+                                         (features.bb_buy_indicator, ["bb_lower_band", "close"], bb_buy),
+                                         (features.macd_buy_indicator, ["macd_signal", "macd"], macd_buy)]:
+        actual_output = features.compute_buy_nobuy(by_time, fn, *columns)
+        np.testing.assert_array_equal(actual_output[order], expected_output)
+
+
+def reference_ema(close, length):
+    close = close.copy()
+    sma_nth = close[0:length].mean()
+    close[:length - 1] = np.nan
+    close.iloc[length - 1] = sma_nth
+
+    return close.ewm(span=length, adjust=False).mean()
+
+
+def reference_indicators(close):
+    change = close.diff()
+    gains = change.where(change > 0, 0).where(change.notnull())
+    losses = change.where(change < 0, 0).where(change.notnull())
+    gains_avg = gains.ewm(alpha=1 / 14, min_periods=14).mean()
+    losses_avg = losses.ewm(alpha=1 / 14, min_periods=14).mean()
+
+    mid = close.rolling(20).mean()
+    std = close.rolling(20).std(ddof=0)
+
+    macd = reference_ema(close, 12) - reference_ema(close, 26)
+    signal = reference_ema(macd.loc[macd.first_valid_index():], 9).reindex(close.index)
+
+    return pd.DataFrame({
+        "RSI_14": 100 * gains_avg / (gains_avg + losses_avg.abs()),
+        "BBL_20_2.0": mid - 2 * std,
+        "BBU_20_2.0": mid + 2 * std,
+        "MACD_12_26_9": macd,
+        "MACDs_12_26_9": signal,
+    })
+
+
+def test_grouped_indicators_match_per_firm_formulas():
+    df = synthetic.make_ohlc(n_firms=4, n_days=120, seed=3)
+    firms = df.index.get_level_values("firm")
+    df = pd.concat([df[firms == firm] for firm in ["FIRM2", "FIRM0", "FIRM3", "FIRM1"]])
+
+    expected_output = pd.concat([reference_indicators(data["close"]) for _, data in df.groupby("firm", sort=False)])
+    actual_output = pd.concat([
+        features.grouped_rsi(df, 14),
+        features.grouped_bbands(df, 20)[["BBL_20_2.0", "BBU_20_2.0"]],
+        features.grouped_macd(df)[["MACD_12_26_9", "MACDs_12_26_9"]],
+    ], axis=1)
+
+    pd.testing.assert_frame_equal(expected_output.reindex(df.index), actual_output, check_names=False)
+
+
+@pytest.mark.parametrize("indicator,window_size", [("rsi", 27), ("bbands", 20), ("macd", 26)])
+def test_grouped_engine_matches_pandas_ta(indicator, window_size):
+    pytest.importorskip("pandas_ta")
+    df = synthetic.make_ohlc(n_firms=3, n_days=200, seed=1)
+
+    expected_output = features.build_indicator(df, indicator, window_size).reindex(df.index)
+    actual_output = features.build_indicator(df, indicator, window_size, engine="grouped")
+
+    pd.testing.assert_frame_equal(pd.DataFrame(expected_output), pd.DataFrame(actual_output), rtol=1e-6)
+
+
+def test_build_indicators_matches_single_indicators():
+    df = synthetic.make_ohlc(n_firms=3, n_days=100, seed=2)
+    specs = [("rsi", 27), ("bbands", 20), ("macd", 26), ("bbands", 20, {"std": 3})]
+
+    expected_output = pd.concat([
+        features.grouped_rsi(df, 27),
+        features.grouped_bbands(df, 20),
+        features.grouped_macd(df),
+        features.grouped_bbands(df, 20, std=3),
+    ], axis=1)
+    actual_output = features.build_indicators(df, specs)
+
+    assert "MACDs_12_26_9" in actual_output.columns
+    assert "BBL_20_3.0" in actual_output.columns
+    pd.testing.assert_frame_equal(expected_output, actual_output)
@@ -4,6 +4,7 @@ import h2o
 from h2o.exceptions import H2OTypeError
 
 from source import h2o_modelling
+from source import store
 
 @pytest.fixture(scope="session", autouse=True)
 def init_h2o_cluster():
@@ -22,3 +23,79 @@ def test_parquet_to_h2o(init_h2o_cluster):
     
     H2OTypeError(actual_output, 'H2OFrame')
     pd.testing.assert_frame_equal(expected_output, actual_output.as_data_frame())
+
+
+def test_store_to_h2o(init_h2o_cluster, tmp_path):
+    df = pd.read_parquet('tests/parquet_files/buy.parquet.gzip')
+    names = [f"/plots/AAPL_rsi_buy_2021-01-0{i}_line.jpg" for i in range(len(df))]
+    store.write_store(tmp_path, df[['pixel_0', 'pixel_1']].to_numpy(), df['label'], names)
+
+    actual_output = h2o_modelling.store_to_h2o(tmp_path, firm='AAPL')
+
+    H2OTypeError(actual_output, 'H2OFrame')
+    assert actual_output.columns == ['label', 'pixel_0', 'pixel_1', 'name']
+    assert actual_output.nrows == len(df)
+
+
+def test_read_parquet_files_filters_names(tmp_path):
+    df = pd.DataFrame({
+        'label': [1, 1, 0, 0],
+        'pixel_0': [1, 2, 3, 4],
+        'name': [f"/plots/{firm}_rsi_buy_{date}_line.jpg" for firm, date in
+                 [("AAPL", "2021-01-04"), ("GOOG", "2021-02-01"), ("AAPL", "2021-03-01"), ("BRK_B", "2021-01-05")]],
+    })
+    df.to_parquet(f"{tmp_path}/df.parquet")
+
+    actual_output = h2o_modelling.read_parquet_files(
+        f"{tmp_path}/df.parquet", f"{tmp_path}/df.parquet", columns=['label', 'pixel_0'], firms=["AAPL", "BRK_B"],
+        end="2021-02-15").to_pandas()
+
+    assert actual_output.columns.tolist() == ['label', 'pixel_0']
+    assert actual_output['pixel_0'].tolist() == [1, 4, 1, 4]
+
+
+def test_parquet_to_h2o_projects_columns(init_h2o_cluster):
+    actual_output = h2o_modelling.parquet_to_h2o('tests/parquet_files/no_buy.parquet.gzip',
+                                                 'tests/parquet_files/buy.parquet.gzip',
+                                                 columns=['label', 'pixel_1'], filters=[('label', '=', 1)])
+
+    assert actual_output.columns == ['label', 'pixel_1']
+    assert actual_output.as_data_frame()['pixel_1'].tolist() == [253, 229, 253]
+
+
+def test_import_parquet_to_h2o_matches_parquet_to_h2o(init_h2o_cluster):
+    files = ['tests/parquet_files/no_buy.parquet.gzip', 'tests/parquet_files/buy.parquet.gzip']
+
+    expected_output = h2o_modelling.parquet_to_h2o(*files)
+    actual_output = h2o_modelling.import_parquet_to_h2o(*files)
+
+    assert actual_output.columns == expected_output.columns
+    pd.testing.assert_frame_equal(expected_output.as_data_frame().sort_values(expected_output.columns, ignore_index=True),
+                                  actual_output.as_data_frame().sort_values(expected_output.columns, ignore_index=True))
+
+    df, y, _ = h2o_modelling.prepare_h2o_df(actual_output.cbind(h2o.H2OFrame({'name': ['a'] * 6})), 'label')
+    assert df[y].isfactor()[0]
+
+
+def test_scorer_scores_with_saved_model(init_h2o_cluster, tmp_path):
+    from h2o.estimators import H2OGradientBoostingEstimator
+    from source import plots, scoring, synthetic
+
+    data = synthetic.make_ohlc(2, 80)
+    data["sampled"] = [i % 3 == 0 for i in range(len(data))]
+    positions = plots.window_positions(data, "sampled", 10)
+    scorer = scoring.Scorer(None, window_size=10, engine="numpy")
+    imgs = scorer.pixels([data.iloc[p] for p in positions])
+
+    df = plots.pixels_to_dataset(imgs, [i % 2 for i in range(len(imgs))])
+    train, y, x = h2o_modelling.prepare_h2o_df(h2o.H2OFrame(df).cbind(h2o.H2OFrame({'name': ['a'] * len(df)})),
+                                               'label')
+    model = H2OGradientBoostingEstimator(ntrees=3, seed=1)
+    model.train(x=x, y=y, training_frame=train)
+
+    scorer.model = scoring.load_model(h2o.save_model(model, path=str(tmp_path)))
+    actual_output = scorer.score(data, "sampled")
+
+    expected_output = model.predict(h2o.H2OFrame(df.drop(columns="label")))['p1'].as_data_frame()['p1']
+    assert len(actual_output) == len(positions)
+    assert actual_output['buy_probability'].tolist() == pytest.approx(expected_output.tolist())
@@ -0,0 +1,15 @@
+import subprocess
+import sys
+
+import pytest
+
+
+@pytest.mark.parametrize("module", ["aws", "datasets", "features", "h2o_modelling", "plots", "sampling", "store"])
+def test_import_does_not_load_heavy_backends(module):
+    script = (
+        f"import sys; import source.{module}; "
+        "print(*[m for m in ['matplotlib', 'mplfinance', 'PIL', 'h2o', 'pandas_ta'] if m in sys.modules])"
+    )
+    output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True).stdout
+
+    assert output.split() == []
@@ -0,0 +1,97 @@
+import pandas as pd
+from source import market_data
+
+
+def test_load_bars_fetches_only_missing_years(tmp_path):
+    provider = market_data.FakeProvider()
+
+    first = market_data.load_bars(["AAPL", "GOOG"], "2011-01-01", "2013-01-01", provider, tmp_path, rate=100)
+    assert len(provider.calls) == 4
+
+    second = market_data.load_bars(["AAPL", "GOOG"], "2011-01-01", "2013-01-01", provider, tmp_path, rate=100)
+    assert len(provider.calls) == 4
+    pd.testing.assert_frame_equal(first, second)
+
+    third = market_data.load_bars(["AAPL", "MSFT"], "2012-06-01", "2014-01-01", provider, tmp_path, rate=100)
+    assert sorted((symbol, start.year) for symbol, start, _ in provider.calls[4:]) == [
+        ("AAPL", 2013), ("MSFT", 2012), ("MSFT", 2013)]
+
+    assert first.index.names == ["time", "firm"]
+    assert list(first.columns) == market_data.COLUMNS
+    assert list(first.index.get_level_values("firm").unique()) == ["AAPL", "GOOG"]
+    assert first.index.get_level_values("time").min() >= pd.Timestamp("2011-01-01", tz="America/New_York")
+    assert third.index.get_level_values("time").min() >= pd.Timestamp("2012-06-01", tz="America/New_York")
+    pd.testing.assert_frame_equal(first.xs("AAPL", level="firm").loc["2012-06-01":],
+                                  third.xs("AAPL", level="firm").loc[:"2012-12-31"])
+
+
+def test_load_bars_skips_failed_firms(tmp_path):
+    class FailingProvider(market_data.FakeProvider):
+        def fetch(self, symbol, start, end):
+            if symbol == "BAD":
+                raise ConnectionError("rate limited")
+            return super().fetch(symbol, start, end)
+
+    bars = market_data.load_bars(["AAPL", "BAD"], "2011-01-01", "2012-01-01", FailingProvider(), tmp_path, rate=100)
+
+    assert list(bars.index.get_level_values("firm").unique()) == ["AAPL"]
+
+
+def test_load_bars_refetches_years_cached_before_they_ended(tmp_path):
+    provider = market_data.FakeProvider()
+
+    first = market_data.load_bars(["AAPL"], "2011-01-01", "2013-01-01", provider, tmp_path, rate=100,
+                                  now="2012-06-01")
+    second = market_data.load_bars(["AAPL"], "2011-01-01", "2013-01-01", provider, tmp_path, rate=100,
+                                   now="2012-06-01")
+    assert len(provider.calls) == 2
+
+    third = market_data.load_bars(["AAPL"], "2011-01-01", "2013-01-01", provider, tmp_path, rate=100,
+                                  now="2012-09-01")
+    assert [start.year for _, start, _ in provider.calls[2:]] == [2012]
+
+    pd.testing.assert_frame_equal(first, second)
+    assert first.index.get_level_values("time").max() < pd.Timestamp("2012-06-01", tz="America/New_York")
+    assert third.index.get_level_values("time").max() >= pd.Timestamp("2012-08-31", tz="America/New_York")
+    pd.testing.assert_frame_equal(first, third.iloc[:len(first)])
+
+
+def test_load_bars_returns_partial_histories(tmp_path):
+    requests = []
+
+    class ListingProvider(market_data.FakeProvider):
+        def fetch(self, symbol, start, end):
+            requests.append((symbol, start.year))
+            if symbol == "NEW" and start.year == 2011:
+                return pd.DataFrame()
+            if symbol == "FLAKY" and start.year == 2012:
+                raise ConnectionError("rate limited")
+            return super().fetch(symbol, start, end)
+
+    provider = ListingProvider()
+    bars = market_data.load_bars(["NEW", "FLAKY"], "2011-01-01", "2013-01-01", provider, tmp_path, rate=100)
+    assert len(requests) == 4
+    years = bars.index.get_level_values("time").year
+
+    assert list(bars.index.get_level_values("firm").unique()) == ["NEW", "FLAKY"]
+    assert set(years[bars.index.get_level_values("firm") == "NEW"]) == {2012}
+    assert set(years[bars.index.get_level_values("firm") == "FLAKY"]) == {2011}
+
+    market_data.load_bars(["NEW", "FLAKY"], "2011-01-01", "2013-01-01", provider, tmp_path, rate=100)
+    assert requests[4:] == [("FLAKY", 2012)]
+
+
+def test_token_bucket_limits_rate():
+    now = [0.0]
+    waits = []
+
+    def sleep(seconds):
+        waits.append(seconds)
+        now[0] += seconds
+
+    bucket = market_data.TokenBucket(rate=2, capacity=2, clock=lambda: now[0], sleep=sleep)
+    for _ in range(6):
+        bucket.acquire()
+
+    assert now[0] == 2.0
+    assert len(waits) == 4
@@ -0,0 +1,101 @@
+import json
+
+import pandas as pd
+import pytest
+
+from source import metrics
+from source import plots
+from source import synthetic
+
+
+@pytest.fixture
+def recording():
+    metrics.reset()
+    yield metrics
+    metrics.disable()
+    metrics.reset()
+
+
+def test_metrics_disabled_records_nothing(recording):
+    @metrics.timed("work")
+    def work():
+        metrics.count(items=3)
+        return 1
+
+    assert work() == 1
+    assert metrics.records().empty
+    assert metrics.summary().empty
+
+
+def test_metrics_record_plot_sampled(recording, tmp_path):
+    data = synthetic.make_ohlc(2, 60)
+    data["sampled"] = [i in (25, 31, 70) for i in range(len(data))]
+
+    metrics.enable()
+    plots.plot_sampled(data, "sampled", "macd", "buy", 10, str(tmp_path), "close", "line", engine="numpy")
+    plots.build_h2o_del_dir(str(tmp_path), str(tmp_path / "df.parquet"))
+    summary = metrics.summary().set_index("stage")
+
+    image_bytes = sum(f.stat().st_size for f in tmp_path.glob("*.jpg"))
+    assert summary.loc["plot_sampled", "calls"] == 1 and summary.loc["plot_sampled", "items"] == 3
+    assert summary.loc["save_image", "items"] == 3
+    assert summary.loc["save_image", "bytes_written"] == image_bytes
+    assert summary.loc["decode_image", "bytes_read"] == image_bytes
+    assert summary.loc["build_h2o_del_dir", "bytes_written"] == (tmp_path / "df.parquet").stat().st_size
+    assert summary.loc["plot_sampled", "seconds"] >= summary.loc["save_image", "seconds"]
+    assert summary["peak_rss_mb"].gt(0).all()
+    assert metrics.records().empty
+
+
+def test_metrics_report_and_profile(recording, tmp_path):
+    @metrics.timed("work")
+    def work(n):
+        metrics.count(items=n)
+        return sum(range(n))
+
+    metrics.enable(profile_stage="work", calls=True)
+    work(10)
+    work(20)
+    metrics.write_report(tmp_path / "report.json")
+    metrics.write_report(tmp_path / "report.csv")
+
+    with open(tmp_path / "report.json") as f:
+        report = json.load(f)
+
+    assert report["summary"][0]["stage"] == "work" and report["summary"][0]["items"] == 30
+    assert report["summary"][0]["calls"] == 2
+    assert [call["items"] for call in report["calls"]] == [10, 20]
+    assert pd.read_csv(tmp_path / "report.csv")[["stage", "calls", "items"]].values.tolist() == [["work", 2, 30]]
+    assert (tmp_path / "report.prof").is_file()
+    assert metrics.profile_stats().total_calls > 0
+
+
+def test_metrics_count_rendered_plots_in_parallel(recording, tmp_path):
+    data = synthetic.make_ohlc(3, 40)
+    data["sampled"] = [i % 40 in (3, 20, 35) for i in range(len(data))]
+    (tmp_path / "serial").mkdir()
+    (tmp_path / "parallel").mkdir()
+
+    metrics.enable()
+    plots.plot_sampled(data, "sampled", "macd", "buy", 10, str(tmp_path / "serial"), "close", "line", engine="numpy")
+    serial = metrics.summary().set_index("stage").loc["plot_sampled", "items"]
+    metrics.reset()
+    plots.plot_sampled(data, "sampled", "macd", "buy", 10, str(tmp_path / "parallel"), "close", "line",
+                       engine="numpy", n_jobs=2)
+    parallel = metrics.summary().set_index("stage").loc["plot_sampled", "items"]
+
+    assert serial == parallel == 6
+
+
+def test_metrics_count_windows_skipped_for_short_history(recording, capsys):
+    data = synthetic.make_ohlc(2, 10)
+    # Rows 3 and 13 have window_size - 2 prior rows for their firm, rows 4 and 14 exactly window_size - 1
+    data["sampled"] = [i in (3, 4, 13, 14) for i in range(len(data))]
+    metrics.enable()
+
+    with metrics.stage("windows"):
+        positions = plots.window_positions(data, "sampled", 5)
+
+    assert positions[:, -1].tolist() == [4, 14]
+    assert metrics.summary().set_index("stage").loc["windows", "skipped"] == 2
+    assert "Skipped 2 sampled rows" in capsys.readouterr().out
@@ -1,10 +1,17 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
 from pathlib import Path
 
 import numpy as np
 import pandas as pd
+import pyarrow.parquet as pq
 import pytest
 from PIL import Image
 from source import plots
+from source import store
+from source import synthetic
+from source.cache import RenderCache
 
 
 def count_pixels(img_file):
@@ -54,6 +61,39 @@ def test_sample_groups():
     pd.testing.assert_frame_equal(expected_output, actual_output)
 
 
+def test_sample_groups_leaves_input_unchanged():
+    test_df = pd.DataFrame({'firm':['AAPL','AAPL','GOOG','GOOG'], 'buy_signal':[1,0,1,0]})
+
+    plots.sample_groups(test_df, 'firm', 'buy_signal', 1, 1, 'sampled')
+
+    assert list(test_df.columns) == ['firm', 'buy_signal']
+
+
+def test_sample_groups_raises_on_short_group():
+    test_df = pd.DataFrame({'firm':['AAPL','AAPL','GOOG','GOOG'], 'buy_signal':[1,1,1,0]})
+
+    with pytest.raises(ValueError, match='GOOG'):
+        plots.sample_groups(test_df, 'firm', 'buy_signal', 1, 2, 'sampled')
+
+    checked = plots.check_signals(test_df, 'firm', 'buy_signal', 1, 2)
+    actual_output = plots.sample_groups(checked, 'firm', 'buy_signal', 1, 2, 'sampled')
+    assert actual_output['sampled'].tolist() == [True, True]
+
+
+def test_sample_mask():
+    index = pd.MultiIndex.from_product([range(50), ["AAPL", "GOOG", "MSFT"]], names=["time", "firm"])
+    test_df = pd.DataFrame({"buy_signal": [1.0 if i % 3 != 2 or i < 9 else 0.0 for i in range(150)]}, index=index)
+
+    actual_output = plots.sample_mask(test_df, "firm", "buy_signal", 1.0, 4, random_state=1)
+    sampled = test_df[actual_output]
+
+    assert actual_output.dtype == bool
+    assert (sampled["buy_signal"] == 1.0).all()
+    assert sampled.groupby("firm").size().to_dict() == {"AAPL": 4, "GOOG": 4}
+    np.testing.assert_array_equal(actual_output, plots.sample_mask(test_df, "firm", "buy_signal", 1.0, 4, 1))
+    assert not np.array_equal(actual_output, plots.sample_mask(test_df, "firm", "buy_signal", 1.0, 4, 2))
+
+
 def test_flatten_image():
     imgpath = './tests/data/test_image.jpg'
 
@@ -83,6 +123,21 @@ def test_build_h2o_dataset():
     feature_columns = results.columns[1:]
     assert len(feature_columns) == num_features
 
+
+def test_pixels_to_dataset_is_compact(tmp_path):
+    imgs = np.arange(12, dtype=np.uint8).reshape(2, 6)
+
+    results = plots.pixels_to_dataset(imgs, [1, 0], ["a.jpg", "b.jpg"])
+    results.to_parquet(f"{tmp_path}/df.parquet")
+    schema = pq.read_schema(f"{tmp_path}/df.parquet")
+
+    assert results["label"].dtype == np.int8
+    assert (results.filter(like="pixel_").dtypes == np.uint8).all()
+    assert results["name"].dtype == "category"
+    assert str(schema.field("label").type) == "int8"
+    assert str(schema.field("pixel_5").type) == "uint8"
+    assert pd.read_parquet(f"{tmp_path}/df.parquet").equals(results)
+
 def test_list_files():
     test_dir_path = "./tests/data/"
 
@@ -124,3 +179,225 @@ def test_build_h2o_del_dir(tmp_path):
     plots.build_h2o_del_dir(dir_path, save_path, False)
 
     assert Path(f"{d}/test_df.parquet.gzip").is_file()
+
+
+def test_build_h2o_sampled_matches_build_h2o_del_dir(tmp_path):
+    data = synthetic.make_ohlc(2, 40)
+    data["sampled"] = [i in (25, 31, 70) for i in range(len(data))]
+    dir_path = tmp_path / "plots"
+    dir_path.mkdir()
+
+    for engine, plot_type in [(e, p) for e in ["matplotlib", "numpy"] for p in ["line", "candle"]]:
+        plots.plot_sampled(data, "sampled", "macd", "buy", 10, str(dir_path), "close", plot_type, engine=engine)
+        plots.build_h2o_del_dir(str(dir_path), f"{tmp_path}/files.parquet", clear_dir=True)
+        plots.build_h2o_sampled(data, "sampled", "macd", "buy", 10, str(dir_path), "close", plot_type,
+                                f"{tmp_path}/memory.parquet", engine=engine)
+
+        expected_output = pd.read_parquet(f"{tmp_path}/files.parquet").sort_values("name", ignore_index=True)
+        actual_output = pd.read_parquet(f"{tmp_path}/memory.parquet").sort_values("name", ignore_index=True)
+
+        assert len(actual_output) == 3
+        assert list(dir_path.iterdir()) == []
+        pd.testing.assert_frame_equal(expected_output, actual_output)
+
+
+def test_render_sampled_save_images(tmp_path):
+    data = synthetic.make_ohlc(2, 40)
+    data["sampled"] = [i in (25, 70) for i in range(len(data))]
+
+    imgs, names = plots.render_sampled(data, "sampled", "bb", "nobuy", 10, str(tmp_path), "close", "candle",
+                                       engine="numpy", save_images=True)
+
+    assert imgs.shape == (2, 900)
+    assert imgs.dtype == np.uint8
+    assert sorted(names) == sorted(plots.list_files(tmp_path))
+    assert all("_bb_nobuy_" in name and name.endswith("_candle.jpg") for name in names)
+
+
+def test_plot_sampled_parallel_matches_serial(tmp_path):
+    data = synthetic.make_ohlc(3, 40)
+    data["sampled"] = [i % 7 == 3 and i % 40 >= 10 for i in range(len(data))]
+
+    serial_imgs, serial_names = plots.render_sampled(data, "sampled", "macd", "buy", 10, str(tmp_path), "close", "line")
+    parallel_imgs, parallel_names = plots.render_sampled(data, "sampled", "macd", "buy", 10, str(tmp_path), "close",
+                                                         "line", n_jobs=2)
+
+    assert parallel_names == serial_names
+    np.testing.assert_array_equal(parallel_imgs, serial_imgs)
+
+    failed = plots.plot_sampled(data, "sampled", "macd", "buy", 10, str(tmp_path), "close", "candle", engine="numpy",
+                                n_jobs=2, progress=True)
+
+    assert failed == []
+    assert len(plots.list_files(tmp_path)) == data["sampled"].sum()
+
+
+def test_plot_sampled_parallel_skips_failed_firm(tmp_path, capsys):
+    data = synthetic.make_ohlc(2, 40)
+    data["sampled"] = [i in (25, 31, 70) for i in range(len(data))]
+    data["open"] = data["open"].astype(object)
+    data.loc[data.index.get_level_values("firm") == "FIRM1", "open"] = "missing"
+
+    imgs, names = plots.render_sampled(data, "sampled", "bb", "buy", 10, str(tmp_path), "close", "candle",
+                                       engine="numpy", n_jobs=2)
+
+    assert imgs.shape[0] == 2
+    assert all("FIRM0" in name for name in names)
+    assert "Plots for FIRM1 not created." in capsys.readouterr().out
+
+
+render_shard = plots.render_shard
+
+
+def crash_on_firm1(windows, *args, **kwargs):
+    if windows[0][2].index.get_level_values("firm")[-1] == "FIRM1":
+        os._exit(1)
+
+    return render_shard(windows, *args, **kwargs)
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != "fork", reason="needs forked worker processes")
+def test_plot_sampled_parallel_survives_worker_crash(tmp_path, monkeypatch):
+    data = synthetic.make_ohlc(3, 40)
+    data["sampled"] = [i % 40 == 30 for i in range(len(data))]
+
+    monkeypatch.setattr(plots, "render_shard", crash_on_firm1)
+    failed = plots.plot_sampled(data, "sampled", "bb", "buy", 10, str(tmp_path), "close", "line", engine="numpy",
+                                n_jobs=2)
+
+    assert failed == ["FIRM1"]
+    assert len(plots.list_files(tmp_path)) == 2
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != "fork", reason="needs forked worker processes")
+def test_map_shards_isolates_only_the_crashing_firm(tmp_path, monkeypatch):
+    data = synthetic.make_ohlc(6, 40)
+    data["sampled"] = [i % 40 in (15, 30) for i in range(len(data))]
+    pools = []
+
+    class CountingPool(ProcessPoolExecutor):
+        def __init__(self, max_workers):
+            pools.append(max_workers)
+            super().__init__(max_workers)
+
+    monkeypatch.setattr(plots, "render_shard", crash_on_firm1)
+    monkeypatch.setattr(plots, "ProcessPoolExecutor", CountingPool)
+    failed = plots.plot_sampled(data, "sampled", "bb", "buy", 10, str(tmp_path), "close", "line", engine="numpy",
+                                n_jobs=2)
+
+    assert failed == ["FIRM1"]
+    assert len(plots.list_files(tmp_path)) == 10
+    assert pools[0] == 2 and pools.count(1) <= 2
+
+
+def test_unknown_plot_type_raises():
+    data = synthetic.make_ohlc(2, 40)
+    data["sampled"] = [i in (25, 31) for i in range(len(data))]
+
+    with pytest.raises(ValueError, match="'bar'"):
+        plots.render_window(data.iloc[:10], "close", "bar", engine="numpy")
+    with pytest.raises(ValueError, match="'bar'"):
+        plots.render_sampled(data, "sampled", "rsi", "buy", 10, "plots", "close", "bar", engine="numpy")
+
+
+def test_window_positions_stay_within_firm():
+    data = synthetic.make_ohlc(2, 20)
+    data = data.iloc[np.r_[0:10, 20:30, 10:20, 30:40]]
+    data["sampled"] = False
+    data.iloc[[2, 12, 22, 25, 38], data.columns.get_loc("sampled")] = True
+
+    positions = plots.window_positions(data, "sampled", 5)
+    firms = data.index.get_level_values("firm").to_numpy()[positions]
+
+    np.testing.assert_array_equal(positions, [[8, 9, 20, 21, 22], [21, 22, 23, 24, 25], [34, 35, 36, 37, 38]])
+    assert (firms == firms[:, [0]]).all()
+
+
+def test_extract_windows():
+    data = synthetic.make_ohlc(2, 40)
+    data["sampled"] = [i in (9, 25, 45, 49) for i in range(len(data))]
+
+    windows, times, meta = plots.extract_windows(data, "sampled", 10)
+
+    assert windows.shape == (3, 10, 4)
+    np.testing.assert_array_equal(windows[2], data.iloc[40:50][["open", "high", "low", "close"]].to_numpy())
+    np.testing.assert_array_equal(times[1], data.index.get_level_values("time")[16:26].values)
+    assert meta["firm"].tolist() == ["FIRM0", "FIRM0", "FIRM1"]
+    assert meta["row"].tolist() == [9, 25, 49]
+    assert meta["start"].iloc[1] == data.index.get_level_values("time")[16]
+
+
+def test_build_store_sampled_matches_build_h2o_sampled(tmp_path):
+    data = synthetic.make_ohlc(2, 40)
+    data["sampled"] = [i in (25, 31, 70) for i in range(len(data))]
+
+    plots.build_h2o_sampled(data, "sampled", "rsi", "buy", 10, str(tmp_path), "close", "line",
+                            f"{tmp_path}/df.parquet", engine="numpy")
+    plots.build_store_sampled(data, "sampled", "rsi", "buy", 10, str(tmp_path), "close", "line",
+                              f"{tmp_path}/store", engine="numpy")
+
+    expected_output = pd.read_parquet(f"{tmp_path}/df.parquet")
+    actual_output = store.load_dataset(f"{tmp_path}/store")
+
+    pd.testing.assert_frame_equal(expected_output, actual_output)
+
+
+def test_render_sampled_cache(tmp_path):
+    data = synthetic.make_ohlc(2, 40)
+    data["sampled"] = [i in (25, 31, 70) for i in range(len(data))]
+
+    for engine in ["numpy", "matplotlib"]:
+        cache = RenderCache(tmp_path / engine)
+        for plot_type in ["line", "candle"]:
+            expected_output, _ = plots.render_sampled(data, "sampled", "rsi", "buy", 10, str(tmp_path), "close",
+                                                      plot_type, engine=engine)
+            first, _ = plots.render_sampled(data, "sampled", "rsi", "buy", 10, str(tmp_path), "close", plot_type,
+                                            engine=engine, cache=cache)
+            second, _ = plots.render_sampled(data, "sampled", "rsi", "buy", 10, str(tmp_path), "close", plot_type,
+                                             engine=engine, cache=cache)
+
+            np.testing.assert_array_equal(expected_output, first)
+            np.testing.assert_array_equal(expected_output, second)
+
+        assert cache.stats()["hits"] == 6
+        assert cache.stats()["misses"] == 6
+
+    cache = RenderCache(tmp_path / "numpy")
+    data["sampled"] = [i in (25, 50) for i in range(len(data))]
+    plots.render_sampled(data, "sampled", "rsi", "buy", 10, str(tmp_path), "close", "line", engine="numpy",
+                         cache=cache)
+
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_render_cached_saves_the_same_image_on_a_hit(tmp_path):
+    data = synthetic.make_ohlc(2, 40)
+    window = data.iloc[10:20]
+
+    for engine in ["numpy", "matplotlib"]:
+        cache = RenderCache(tmp_path / engine)
+        miss = plots.render_cached(window, "close", "line", engine, cache, f"{tmp_path}/{engine}_miss.jpg")
+        hit = plots.render_cached(window, "close", "line", engine, cache, f"{tmp_path}/{engine}_hit.jpg")
+
+        np.testing.assert_array_equal(miss, hit)
+        assert Path(f"{tmp_path}/{engine}_miss.jpg").read_bytes() == Path(f"{tmp_path}/{engine}_hit.jpg").read_bytes()
+        assert cache.stats()["hits"] == 1
+
+
+def test_render_sampled_parallel_merges_cache_usage(tmp_path):
+    data = synthetic.make_ohlc(3, 40)
+    data["sampled"] = [i % 40 in (15, 30) for i in range(len(data))]
+    cache = RenderCache(tmp_path / "cache")
+
+    plots.render_sampled(data, "sampled", "rsi", "buy", 10, str(tmp_path), "close", "line", engine="numpy",
+                         n_jobs=2, cache=cache)
+    assert cache.stats()["misses"] == 6 and cache.stats()["entries"] == 6
+
+    cache.max_bytes = 4 * cache.stats()["bytes"] // 6
+    plots.render_sampled(data, "sampled", "rsi", "buy", 10, str(tmp_path), "close", "line", engine="numpy",
+                         n_jobs=2, cache=cache)
+
+    assert cache.stats()["hits"] + cache.stats()["misses"] == 12 and cache.stats()["hits"] > 0
+    assert cache.stats()["entries"] == 4 and cache.stats()["bytes"] <= cache.max_bytes
+    assert len(list((tmp_path / "cache").glob("*/*.npy"))) == 4
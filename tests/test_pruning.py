@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+
+from source import plots
+from source import pruning
+from source import scoring
+from source import synthetic
+
+
+def make_imgs(n=50, seed=0):
+    rng = np.random.default_rng(seed)
+    imgs = np.full((n, 12), 255, dtype=np.uint8)
+    imgs[:, [2, 5, 7]] = rng.integers(0, 256, size=(n, 3))
+    imgs[:, 9] = 254 + (np.arange(n) == 0)
+
+    return imgs
+
+
+def test_build_index_drops_constant_pixels():
+    imgs = make_imgs()
+
+    index = pruning.build_index(lambda: pruning.iter_arrays(imgs, batch_size=7))
+
+    np.testing.assert_allclose(pruning.scan(pruning.iter_arrays(imgs, 7)).variance(), imgs.var(axis=0))
+    np.testing.assert_array_equal(index["columns"], [2, 5, 7])
+    assert pruning.column_names(index) == ["pixel_2", "pixel_5", "pixel_7"]
+    assert pruning.describe(index) == {"pixels": 12, "kept": 3, "predictors": 3, "fraction_dropped": 0.75}
+
+
+def test_build_index_from_parquet_matches_arrays(tmp_path):
+    imgs = make_imgs()
+    plots.pixels_to_dataset(imgs, np.arange(len(imgs)) % 2).to_parquet(tmp_path / "df.parquet")
+
+    expected_output = pruning.build_index(lambda: pruning.iter_arrays(imgs), n_components=2)
+    actual_output = pruning.build_index(lambda: pruning.iter_parquet(tmp_path / "df.parquet", batch_size=16),
+                                        n_components=2)
+    pruning.save_index(tmp_path / "index.npz", actual_output)
+    loaded = pruning.load_index(tmp_path / "index.npz")
+
+    np.testing.assert_array_equal(actual_output["columns"], expected_output["columns"])
+    np.testing.assert_allclose(np.abs(actual_output["components"]), np.abs(expected_output["components"]))
+    np.testing.assert_allclose(pruning.apply_index(imgs, loaded), pruning.apply_index(imgs, actual_output))
+    assert pruning.column_names(loaded) == ["pc_0", "pc_1"]
+
+    # The components are the leading eigenvectors of the covariance of the kept pixels
+    values, vectors = np.linalg.eigh(np.cov(imgs[:, [2, 5, 7]].T, bias=True))
+    np.testing.assert_allclose(np.abs(loaded["components"]), np.abs(vectors[:, [2, 1]].T), atol=1e-8)
+
+
+def test_apply_index_to_dataset_and_scorer():
+    imgs = make_imgs()
+    names = [f"plot_{i}.jpg" for i in range(len(imgs))]
+    index = pruning.build_index(lambda: pruning.iter_arrays(imgs))
+
+    actual_output = pruning.apply_index_to_dataset(plots.pixels_to_dataset(imgs, [1] * len(imgs), names), index)
+
+    assert actual_output.columns.tolist() == ["label", "pixel_2", "pixel_5", "pixel_7", "name"]
+    np.testing.assert_array_equal(actual_output[["pixel_2", "pixel_5", "pixel_7"]].to_numpy(), imgs[:, [2, 5, 7]])
+
+    class ColumnsModel:
+        def predict(self, df):
+            self.columns = df.columns.tolist()
+            return pd.DataFrame({"p1": np.zeros(len(df))})
+
+    data = synthetic.make_ohlc(1, 40)
+    data["sampled"] = [i in (20, 30) for i in range(len(data))]
+    line_index = {"columns": np.array([0, 5]), "n_pixels": 529, "threshold": 1.0, "mean": None, "components": None}
+    model = ColumnsModel()
+    scoring.Scorer(model, window_size=10, engine="numpy", to_frame=lambda df: df, index=line_index).score(data, "sampled")
+
+    assert model.columns == ["pixel_0", "pixel_5"]
@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+from source import plots
+from source import raster
+from source import synthetic
+
+
+def test_line_array_shape_and_dtype():
+    x = pd.bdate_range("2021-01-04", periods=26, tz="America/New_York")
+    y = np.linspace(10, 20, 26)
+
+    results = raster.line_array(x, y)
+
+    assert results.shape == raster.LINE_SHAPE
+    assert results.dtype == np.uint8
+    assert results.min() == raster.LINE_GRAY
+    assert results.max() == raster.BACKGROUND
+
+
+def test_line_arrays_matches_line_array():
+    x = np.arange(26)
+    y = np.random.default_rng(1).normal(size=(3, 26)).cumsum(axis=1)
+
+    results = raster.line_arrays(x, y)
+
+    assert results.shape == (3,) + raster.LINE_SHAPE
+    np.testing.assert_array_equal(results[1], raster.line_array(x, y[1]))
+
+
+def test_line_array_matches_matplotlib(tmp_path):
+    rng = np.random.default_rng(0)
+    x = pd.bdate_range("2021-01-04", periods=26, tz="America/New_York")
+
+    for i in range(5):
+        y = 100 + rng.normal(size=26).cumsum()
+        savepath = f"{tmp_path}/line_{i}.jpg"
+        plots.save_plot(plots.create_line_plot(x, y), savepath)
+
+        expected_output = plots.flatten_image(savepath).astype(int)
+        actual_output = raster.line_array(x, y).ravel().astype(int)
+
+        assert len(expected_output) == len(actual_output)
+        assert np.abs(expected_output - actual_output).mean() < 25
+        assert np.corrcoef(expected_output, actual_output)[0, 1] > 0.8
+
+
+def window_arrays(n_windows, window_size):
+    data = synthetic.make_ohlc(n_windows, window_size)
+
+    return data[["open", "high", "low", "close"]].to_numpy().reshape(n_windows, window_size, 4)
+
+
+def test_candle_arrays_shape_and_dtype():
+    ohlc = window_arrays(5, 20)
+
+    results = raster.candle_arrays(ohlc, chunk_size=2)
+
+    assert results.shape == (5,) + raster.CANDLE_SHAPE
+    assert results.dtype == np.uint8
+    np.testing.assert_array_equal(results[3], raster.candle_array(ohlc[3]))
+
+
+def test_candle_arrays_colors():
+    up = np.array([[10.0, 12.0, 9.0, 11.0]] * 3)
+    down = np.array([[11.0, 12.0, 9.0, 10.0]] * 3)
+
+    results = raster.candle_arrays(np.stack([up, down]))
+
+    assert results[0].min() == raster.EDGE_GRAY
+    assert (results[0] == raster.BACKGROUND).any()
+    assert results[0].mean() > results[1].mean()
+
+
+def test_candle_array_matches_mplfinance(tmp_path):
+    ohlc = window_arrays(5, 26)
+    index = pd.bdate_range("2021-01-04", periods=26)
+
+    for i, window in enumerate(ohlc):
+        data = pd.DataFrame(window, index=index, columns=["open", "high", "low", "close"])
+        savepath = f"{tmp_path}/candle_{i}.jpg"
+        plots.create_candlestick_plot(data, savepath)
+
+        expected_output = plots.flatten_image(savepath).astype(int)
+        actual_output = raster.candle_array(data).ravel().astype(int)
+
+        assert len(expected_output) == len(actual_output)
+        assert np.abs(expected_output - actual_output).mean() < 20
+        assert np.corrcoef(expected_output, actual_output)[0, 1] > 0.85
@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+from source import plots
+from source import sampling
+from source import synthetic
+
+
+def make_signals(n_firms=4, n_days=600, seed=0):
+    df = synthetic.make_ohlc(n_firms=n_firms, n_days=n_days, seed=seed)
+    df["macd_buy"] = (np.random.default_rng(seed).random(len(df)) < 0.05).astype(float)
+
+    return df
+
+
+def test_sample_windows_per_firm_and_year():
+    df = make_signals()
+
+    manifest = sampling.sample_windows(df, "macd_buy", 1.0, 3, 26, strata=("firm", "year"), random_state=0)
+
+    sizes = manifest.groupby(["firm", "year"], observed=True).size()
+    assert (sizes == 3).all()
+    assert {2011, 2012} <= set(sizes.index.get_level_values("year"))
+    assert len(sizes) >= 4 * 2
+    assert (df["macd_buy"].to_numpy()[manifest["row"]] == 1.0).all()
+    assert manifest["row"].is_monotonic_increasing
+    pd.testing.assert_frame_equal(
+        manifest, sampling.sample_windows(df, "macd_buy", 1.0, 3, 26, strata=("firm", "year"), random_state=0))
+
+
+def test_sample_windows_spacing_and_history():
+    df = make_signals()
+    time = df.index.get_level_values("time")
+
+    manifest = sampling.sample_windows(df, "macd_buy", 0.0, 10, 26, min_spacing=26, random_state=1)
+
+    for _, rows in manifest.groupby("firm")["row"]:
+        assert (np.diff(np.sort(rows.to_numpy())) >= 26).all()
+    assert (manifest["start"] >= time.min()).all()
+    assert ((manifest["time"] - manifest["start"]).dt.days >= 25).all()
+
+
+def test_sample_buy_nobuy_excludes_overlapping_windows():
+    df = make_signals()
+    window_size = 26
+
+    manifest = sampling.sample_buy_nobuy(df, "macd_buy", 15, window_size, random_state=2)
+
+    assert (manifest.groupby(["firm", "signal"], observed=True).size() == 15).all()
+    firm_rank = df.groupby("firm").cumcount().to_numpy()
+    buy_rows = np.flatnonzero(df["macd_buy"].to_numpy() == 1.0)
+    firms = df.index.get_level_values("firm")
+    for entry in manifest[manifest["signal"] == "nobuy"].itertuples():
+        same_firm = buy_rows[firms[buy_rows] == entry.firm]
+        assert (np.abs(firm_rank[same_firm] - firm_rank[entry.row]) >= window_size).all()
+
+
+def test_manifest_drives_rendering(tmp_path):
+    df = make_signals(n_firms=2, n_days=80)
+    manifest = sampling.sample_windows(df, "macd_buy", 1.0, 2, 10, random_state=3)
+    df["sampled"] = sampling.manifest_mask(df, manifest)
+
+    expected_output = list(plots.sampled_windows(df, "sampled", "macd", "buy", 10, str(tmp_path)))
+    actual_output = list(sampling.manifest_windows(df, manifest, "macd", 10, str(tmp_path), signal="buy"))
+
+    assert [name for name, _ in actual_output] == [name for name, _ in expected_output]
+    for (_, expected_window), (_, actual_window) in zip(expected_output, actual_output):
+        pd.testing.assert_frame_equal(expected_window, actual_window)
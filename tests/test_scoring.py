@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+
+from source import plots
+from source import scoring
+from source import synthetic
+from source.cache import RenderCache
+
+
+class MeanPixelModel:
+    """Predicts the mean pixel of each image as the buy probability, in place of a trained h2o model."""
+
+    def __init__(self):
+        self.batches = []
+
+    def predict(self, df):
+        self.batches.append(len(df))
+        return pd.DataFrame({"p1": df.filter(like="pixel_").mean(axis=1) / 255})
+
+
+def test_scorer_matches_build_h2o_dataset(tmp_path):
+    data = synthetic.make_ohlc(2, 60)
+    data["sampled"] = [i in (5, 25, 31, 70, 119) for i in range(len(data))]
+    model = MeanPixelModel()
+    scorer = scoring.Scorer(model, "close", "line", window_size=10, engine="numpy", batch_size=2,
+                            to_frame=lambda df: df)
+
+    actual_output = scorer.score(data, "sampled")
+
+    plots.plot_sampled(data, "sampled", "macd", "buy", 10, str(tmp_path), "close", "line", engine="numpy")
+    files = [f"{name}_line.jpg" for name, _ in plots.sampled_windows(data, "sampled", "macd", "buy", 10, str(tmp_path))]
+    h2o_df = plots.build_h2o_dataset(files, [1] * len(files))
+
+    assert actual_output.columns.tolist() == ["firm", "time", "buy_probability"]
+    assert actual_output["firm"].tolist() == ["FIRM0", "FIRM0", "FIRM1", "FIRM1"]
+    assert actual_output["time"].tolist() == data.index.get_level_values("time")[[25, 31, 70, 119]].tolist()
+    assert model.batches == [2, 2]
+    np.testing.assert_array_equal(scorer.pixels([data.iloc[p] for p in plots.window_positions(data, "sampled", 10)]),
+                                  h2o_df.filter(like="pixel_").to_numpy())
+    np.testing.assert_allclose(actual_output["buy_probability"], h2o_df.filter(like="pixel_").mean(axis=1) / 255)
+
+
+def test_scorer_matches_build_h2o_sampled(tmp_path):
+    data = synthetic.make_ohlc(2, 60)
+    data["sampled"] = [i in (25, 70, 119) for i in range(len(data))]
+    windows = [data.iloc[p] for p in plots.window_positions(data, "sampled", 10)]
+
+    for plot_type in ["line", "candle"]:
+        scorer = scoring.Scorer(MeanPixelModel(), "close", plot_type, window_size=10, engine="numpy",
+                                to_frame=lambda df: df)
+        plots.build_h2o_sampled(data, "sampled", "macd", "buy", 10, str(tmp_path), "close", plot_type,
+                                f"{tmp_path}/df.parquet", engine="numpy")
+        expected_output = pd.read_parquet(f"{tmp_path}/df.parquet").filter(like="pixel_").to_numpy()
+
+        np.testing.assert_array_equal(scorer.pixels(windows), expected_output)
+
+
+def test_scorer_cached_candles_match_build_h2o_dataset(tmp_path):
+    data = synthetic.make_ohlc(2, 60)
+    data["sampled"] = [i in (25, 70, 119) for i in range(len(data))]
+    windows = [data.iloc[p] for p in plots.window_positions(data, "sampled", 10)]
+    scorer = scoring.Scorer(MeanPixelModel(), "close", "candle", window_size=10, engine="numpy",
+                            cache=RenderCache(tmp_path / "cache"), to_frame=lambda df: df)
+
+    plots.plot_sampled(data, "sampled", "macd", "buy", 10, str(tmp_path), "close", "candle", engine="numpy")
+    files = [f"{name}_candle.jpg" for name, _ in plots.sampled_windows(data, "sampled", "macd", "buy", 10, str(tmp_path))]
+    expected_output = plots.build_h2o_dataset(files, [1] * len(files)).filter(like="pixel_").to_numpy()
+
+    np.testing.assert_array_equal(scorer.pixels(windows), expected_output)
+    np.testing.assert_array_equal(scorer.pixels(windows), expected_output)
+    assert scorer.cache.stats()["hits"] == 3
+
+
+def test_scorer_single_window_and_empty():
+    data = synthetic.make_ohlc(1, 30)
+    windows = [data.iloc[i:i + 10] for i in range(0, 20, 5)]
+    scorer = scoring.Scorer(MeanPixelModel(), window_size=10, engine="numpy", to_frame=lambda df: df)
+
+    batch = scorer.score_windows(windows)
+    single = [scorer.score_windows([window])[0] for window in windows]
+
+    np.testing.assert_array_equal(batch, single)
+    assert scorer.score_windows([]).shape == (0,)
+
+    stats = scoring.benchmark(scorer, windows, n_single=2)
+    assert stats["windows_per_second"] > 0 and stats["latency_ms"] > 0
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+from source import plots
+from source import store
+
+
+def make_store(save_dir, signal):
+    imgs = np.arange(4 * 6, dtype=np.uint8).reshape(4, 6)
+    names = [f"/plots/{firm}_rsi_{signal}_2021-01-0{i}_line.jpg" for i, firm in enumerate(["AAPL", "AAPL", "GOOG", "MSFT"])]
+    store.write_store(save_dir, imgs, [0 if signal == "nobuy" else 1] * 4, names)
+
+    return imgs, names
+
+
+def test_open_store_is_memory_mapped(tmp_path):
+    imgs, names = make_store(tmp_path, "buy")
+
+    pixels, meta = store.open_store(tmp_path)
+
+    assert isinstance(pixels, np.memmap)
+    assert pixels.dtype == np.uint8
+    np.testing.assert_array_equal(pixels, imgs)
+    assert list(meta["name"]) == names
+    assert list(meta["firm"]) == ["AAPL", "AAPL", "GOOG", "MSFT"]
+    assert set(meta["plot_type"]) == {"line"}
+
+
+def test_select_rows_and_batches(tmp_path):
+    imgs, _ = make_store(tmp_path, "buy")
+    _, meta = store.open_store(tmp_path)
+
+    np.testing.assert_array_equal(store.select_rows(meta, firm=["AAPL", "MSFT"]), [0, 1, 3])
+    np.testing.assert_array_equal(store.select_rows(meta, firm="GOOG", signal="nobuy"), [])
+
+    batches = list(store.iter_batches(tmp_path, batch_size=2, firm=["AAPL", "MSFT"]))
+
+    assert [len(batch) for batch, _ in batches] == [2, 1]
+    np.testing.assert_array_equal(batches[1][0], imgs[[3]])
+    np.testing.assert_array_equal(batches[0][1], [1, 1])
+
+
+def test_load_dataset_matches_pixels_to_dataset(tmp_path):
+    buy_imgs, buy_names = make_store(tmp_path / "buy", "buy")
+    nobuy_imgs, nobuy_names = make_store(tmp_path / "nobuy", "nobuy")
+
+    expected_output = plots.pixels_to_dataset(
+        np.concatenate([buy_imgs[2:3], nobuy_imgs[2:3]]), [1, 0], [buy_names[2], nobuy_names[2]])
+    actual_output = store.load_dataset(tmp_path / "buy", tmp_path / "nobuy", firm="GOOG")
+
+    pd.testing.assert_frame_equal(expected_output, actual_output)
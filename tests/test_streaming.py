@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+from source import features
+from source import streaming
+from source import synthetic
+
+
+def test_streaming_matches_full_recompute(tmp_path):
+    df = synthetic.make_ohlc(n_firms=3, n_days=150, seed=4)
+    firms = df.index.get_level_values("firm")
+    days = df.index.get_level_values("time")
+    history = df[days < days[100]]
+    new_rows = df[days >= days[100]]
+
+    state = streaming.StreamingIndicators()
+    first = state.update(history)
+    state.save(f"{tmp_path}/state.pkl")
+    second = streaming.StreamingIndicators.load(f"{tmp_path}/state.pkl").update(new_rows)
+    actual_output = pd.concat([first, second]).reindex(df.index)
+
+    full = features.build_indicators(df, [("rsi", 27), ("bbands", 20), ("macd", 26)])
+    np.testing.assert_allclose(actual_output["rsi"], full["RSI_27"], rtol=1e-9)
+    np.testing.assert_allclose(actual_output["bb_lower_band"], full["BBL_20_2.0"], rtol=1e-9)
+    np.testing.assert_allclose(actual_output["macd"], full["MACD_12_26_9"], rtol=1e-9)
+    np.testing.assert_allclose(actual_output["macd_signal"], full["MACDs_12_26_9"], rtol=1e-9)
+
+    rsi_buy = features.rsi_buy_indicator(full["RSI_27"], firms)
+    bb_buy = features.bb_buy_indicator(full["BBL_20_2.0"], df["close"], firms)
+    macd_buy = features.macd_buy_indicator(full["MACDs_12_26_9"], full["MACD_12_26_9"], firms)
+
+    np.testing.assert_array_equal(actual_output["rsi_buy"], rsi_buy)
+    np.testing.assert_array_equal(actual_output["bb_buy"], bb_buy)
+    np.testing.assert_array_equal(actual_output["macd_buy"], macd_buy)
+    assert actual_output["macd_buy"].sum() > 0
+
+
+def test_streaming_matches_full_recompute_with_missing_closes():
+    df = synthetic.make_ohlc(n_firms=2, n_days=120, seed=5)
+    df.iloc[[5, 50, 51, 170], df.columns.get_loc("close")] = np.nan
+    firms = df.index.get_level_values("firm")
+
+    actual_output = streaming.StreamingIndicators().update(df)
+
+    full = features.build_indicators(df, [("rsi", 27), ("bbands", 20), ("macd", 26)])
+    np.testing.assert_allclose(actual_output["rsi"], full["RSI_27"], rtol=1e-9)
+    np.testing.assert_allclose(actual_output["bb_lower_band"], full["BBL_20_2.0"], rtol=1e-9)
+    np.testing.assert_allclose(actual_output["macd"], full["MACD_12_26_9"], rtol=1e-9)
+    np.testing.assert_allclose(actual_output["macd_signal"], full["MACDs_12_26_9"], rtol=1e-9)
+    assert actual_output["bb_lower_band"].iloc[71:120].notna().all()
+
+    np.testing.assert_array_equal(actual_output["bb_buy"],
+                                  features.bb_buy_indicator(full["BBL_20_2.0"], df["close"], firms))
+    np.testing.assert_array_equal(actual_output["macd_buy"],
+                                  features.macd_buy_indicator(full["MACDs_12_26_9"], full["MACD_12_26_9"], firms))